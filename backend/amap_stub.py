@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+本地高德桩服务：回放录制的高德响应，可注入延迟和错误，用于离线压测/CI
+使用方法：
+  python amap_stub.py --record-file data/amap_recordings.jsonl --mode record   # 转发真实高德并录制（需 GAODE_API_KEY）
+  python amap_stub.py --record-file data/amap_recordings.jsonl --latency lognormal:40:0.5 --error-rate 0.01
+  然后启动后端时设置 AMAP_BASE=http://127.0.0.1:9100/v3
+"""
+
+import argparse
+import os
+import sys
+from dotenv import load_dotenv
+
+# 添加项目路径
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+# 加载环境变量
+load_dotenv()
+
+
+def main():
+    import uvicorn
+    from app.services.amap_stub import AmapStub, LatencyModel, Recordings, create_stub_app
+
+    parser = argparse.ArgumentParser(description="本地高德桩服务（录制/回放）")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--record-file", default="", help="录制文件（JSONL），回放时读取、录制时追加")
+    parser.add_argument("--mode", choices=["replay", "strict", "record"], default="replay",
+                        help="replay: 有录制回放、没有则返回合成数据；strict: 没有录制返回 404；record: 转发真实高德并录制")
+    parser.add_argument("--upstream", default="https://restapi.amap.com/v3", help="record 模式转发的高德地址")
+    parser.add_argument("--latency", default="0", help="延迟分布: 0 | fixed:MS | uniform:LO:HI | lognormal:MEDIAN:SIGMA")
+    parser.add_argument("--latency-geocode", default="", help="地理编码单独的延迟分布（默认同 --latency）")
+    parser.add_argument("--latency-place", default="", help="POI 搜索单独的延迟分布")
+    parser.add_argument("--latency-direction", default="", help="路径规划单独的延迟分布")
+    parser.add_argument("--latency-batch", default="", help="批量请求单独的延迟分布")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="返回 HTTP 500 的比例")
+    parser.add_argument("--timeout-rate", type=float, default=0.0, help="挂起 --hang-seconds 后返回 504 的比例")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="返回 QPS 超限 infocode 的比例")
+    parser.add_argument("--hang-seconds", type=float, default=30.0)
+    parser.add_argument("--seed", type=int, default=None, help="随机种子，固定后延迟和错误序列可复现")
+    args = parser.parse_args()
+
+    latency = {"default": LatencyModel(args.latency)}
+    for family in ("geocode", "place", "direction", "batch"):
+        spec = getattr(args, f"latency_{family}")
+        if spec:
+            latency[family] = LatencyModel(spec)
+
+    stub = AmapStub(
+        Recordings(args.record_file),
+        mode=args.mode,
+        upstream=args.upstream,
+        latency=latency,
+        error_rate=args.error_rate,
+        timeout_rate=args.timeout_rate,
+        throttle_rate=args.throttle_rate,
+        hang_seconds=args.hang_seconds,
+        seed=args.seed,
+        api_key=os.getenv("GAODE_API_KEY", "") if args.mode == "record" else "",
+    )
+    print(f"🧪 高德桩服务: http://{args.host}:{args.port}/v3 （mode={args.mode}, 录制 {len(stub.recordings)} 条）")
+    uvicorn.run(create_stub_app(stub), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
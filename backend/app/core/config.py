@@ -4,4 +4,144 @@ load_dotenv()
 
 MCP_SERVER_URL = os.getenv("MCP_SERVER_URL", "")
 GAODE_API_KEY = os.getenv("GAODE_API_KEY", "")
+# 高德 Web 服务地址；离线压测时指向本地桩服务，如 http://127.0.0.1:9100/v3（见 amap_stub.py）
+AMAP_BASE = os.getenv("AMAP_BASE", "https://restapi.amap.com/v3").rstrip("/")
 REQUEST_TIMEOUT_SECONDS = int(os.getenv("REQUEST_TIMEOUT_SECONDS", "30"))  # 增加到30秒
+
+# 高德 HTTP 连接池（进程内共享一个 httpx.AsyncClient）
+AMAP_MAX_CONNECTIONS = int(os.getenv("AMAP_MAX_CONNECTIONS", "50"))
+AMAP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("AMAP_MAX_KEEPALIVE_CONNECTIONS", "20"))
+AMAP_KEEPALIVE_EXPIRY_SECONDS = float(os.getenv("AMAP_KEEPALIVE_EXPIRY_SECONDS", "30"))
+
+# 行程规划：POI 搜索并发上限
+POI_SEARCH_CONCURRENCY = int(os.getenv("POI_SEARCH_CONCURRENCY", "8"))
+
+# 行程规划：路段（步行路线）并发查询上限与单路段超时，超时后改用直线距离估算
+ROUTE_CONCURRENCY = int(os.getenv("ROUTE_CONCURRENCY", "8"))
+ROUTE_LEG_TIMEOUT_SECONDS = float(os.getenv("ROUTE_LEG_TIMEOUT_SECONDS", "3"))
+
+# 高德接口进程内缓存（TTL + LRU），按接口分别设置容量与过期时间
+AMAP_CACHE_ENABLED = os.getenv("AMAP_CACHE_ENABLED", "1") == "1"
+AMAP_CACHE_GEOCODE_MAXSIZE = int(os.getenv("AMAP_CACHE_GEOCODE_MAXSIZE", "2048"))
+AMAP_CACHE_GEOCODE_TTL_SECONDS = float(os.getenv("AMAP_CACHE_GEOCODE_TTL_SECONDS", str(7 * 24 * 3600)))
+AMAP_CACHE_POI_MAXSIZE = int(os.getenv("AMAP_CACHE_POI_MAXSIZE", "4096"))
+AMAP_CACHE_POI_TTL_SECONDS = float(os.getenv("AMAP_CACHE_POI_TTL_SECONDS", str(6 * 3600)))
+AMAP_CACHE_ROUTE_MAXSIZE = int(os.getenv("AMAP_CACHE_ROUTE_MAXSIZE", "8192"))
+AMAP_CACHE_ROUTE_TTL_SECONDS = float(os.getenv("AMAP_CACHE_ROUTE_TTL_SECONDS", "900"))
+AMAP_CACHE_NEGATIVE_TTL_SECONDS = float(os.getenv("AMAP_CACHE_NEGATIVE_TTL_SECONDS", "60"))
+AMAP_CACHE_ROUTE_PRECISION = int(os.getenv("AMAP_CACHE_ROUTE_PRECISION", "4"))  # 路线缓存键的坐标小数位（4位约11米）
+
+# 高德结果持久化缓存（SQLite WAL，多 worker 共享、重启不丢）；路径为空则不启用
+AMAP_STORE_PATH = os.getenv("AMAP_STORE_PATH", "")
+AMAP_STORE_MAX_MB = int(os.getenv("AMAP_STORE_MAX_MB", "256"))
+AMAP_STORE_COMPACT_INTERVAL_SECONDS = float(os.getenv("AMAP_STORE_COMPACT_INTERVAL_SECONDS", "300"))
+
+# 多 worker 共享的协调状态（SQLite WAL）：限速令牌桶和当天配额用量由所有 worker 共用，
+# 同一 key 的未命中只有拿到租约的 worker 打上游，其他 worker 等它写入持久化缓存（需同时设置 AMAP_STORE_PATH）。
+# 路径为空则各进程各自限速、各自加载（单进程部署）；gunicorn.conf.py 多 worker 启动时默认放在 data/ 下
+SHARED_STATE_PATH = os.getenv("SHARED_STATE_PATH", "")
+# 加载租约的有效期（秒）：持有者崩溃时最多这么久后其他 worker 接手，等待别人的结果也最多等这么久
+SHARED_LEASE_SECONDS = float(os.getenv("SHARED_LEASE_SECONDS", "10"))
+
+# 路段解析方式：amap = 高德真实路线（失败时估算）；fast = 全部使用本地直线距离估算，不调用高德
+ROUTING_MODE = os.getenv("ROUTING_MODE", "amap")
+# 直线距离小于该值(km)的短路段直接估算，不调用高德
+ROUTE_ESTIMATE_BELOW_KM = float(os.getenv("ROUTE_ESTIMATE_BELOW_KM", "1.0"))
+
+# 行程顺序优化（最近邻 + 2-opt/Or-opt），每天的改进阶段时间预算（毫秒）
+ROUTE_OPTIMIZE = os.getenv("ROUTE_OPTIMIZE", "1") == "1"
+ROUTE_OPT_BUDGET_MS = float(os.getenv("ROUTE_OPT_BUDGET_MS", "5"))
+
+# 多天行程先按地理位置把候选点均衡分成 days 组（容量受限 k-means），随机种子固定保证可复现
+DAY_CLUSTERING = os.getenv("DAY_CLUSTERING", "1") == "1"
+DAY_CLUSTER_SEED = int(os.getenv("DAY_CLUSTER_SEED", "42"))
+
+# 候选 POI 近似去重半径（米）：半径内名称相同/互为前缀的视为同一地点
+POI_DEDUP_RADIUS_M = float(os.getenv("POI_DEDUP_RADIUS_M", "200"))
+# 指定出发点时只保留其周边该半径（km）内的候选，0 表示不限制
+START_RADIUS_KM = float(os.getenv("START_RADIUS_KM", "0"))
+
+# POI 查询规划：关键词去重/去包含、按城市历史贡献排序，合并成多关键词（“|”连接）或分类编码查询，
+# 每次查询最多合并 POI_KEYWORDS_PER_QUERY 个关键词。排序用的历史贡献每 POI_QUERY_RANK_REFRESH_SECONDS 秒
+# 更新一次快照，两次更新之间同样的输入得到同样的查询顺序（0 表示总用最新统计）
+POI_QUERY_COMPACTION = os.getenv("POI_QUERY_COMPACTION", "1") == "1"
+POI_KEYWORDS_PER_QUERY = int(os.getenv("POI_KEYWORDS_PER_QUERY", "3"))
+POI_QUERY_RANK_REFRESH_SECONDS = float(os.getenv("POI_QUERY_RANK_REFRESH_SECONDS", "3600"))
+
+# 合并同一 key 的并发高德请求（singleflight），只发一次上游调用
+AMAP_SINGLEFLIGHT_ENABLED = os.getenv("AMAP_SINGLEFLIGHT_ENABLED", "1") == "1"
+
+# 高德客户端限速：每个接口族一个令牌桶（QPS 按自己 Key 的配额填写，略低于上限），
+# 可攒 QPS × AMAP_RATE_BURST_SECONDS 个令牌应对突发；超出的请求排队（交互请求优先于后台预热/刷新）
+AMAP_RATE_LIMIT_ENABLED = os.getenv("AMAP_RATE_LIMIT_ENABLED", "1") == "1"
+AMAP_QPS_GEOCODE = float(os.getenv("AMAP_QPS_GEOCODE", "30"))
+AMAP_QPS_POI = float(os.getenv("AMAP_QPS_POI", "30"))
+AMAP_QPS_ROUTE = float(os.getenv("AMAP_QPS_ROUTE", "30"))
+AMAP_RATE_BURST_SECONDS = float(os.getenv("AMAP_RATE_BURST_SECONDS", "1"))
+# 每日配额（次），达到后当天不再请求上游、直接走缓存/估算；0 表示不限制
+AMAP_DAILY_LIMIT_GEOCODE = int(os.getenv("AMAP_DAILY_LIMIT_GEOCODE", "0"))
+AMAP_DAILY_LIMIT_POI = int(os.getenv("AMAP_DAILY_LIMIT_POI", "0"))
+AMAP_DAILY_LIMIT_ROUTE = int(os.getenv("AMAP_DAILY_LIMIT_ROUTE", "0"))
+
+# 高德调用容错：单次尝试超时、带抖动的重试（每个行程请求共享 AMAP_RETRY_BUDGET_PER_PLAN 次重试/对冲）、
+# 超过最近 p95 耗时仍未返回时发对冲请求、连续失败 AMAP_BREAKER_FAILURES 次后熔断
+AMAP_RESILIENCE_ENABLED = os.getenv("AMAP_RESILIENCE_ENABLED", "1") == "1"
+AMAP_ATTEMPT_TIMEOUT_SECONDS = float(os.getenv("AMAP_ATTEMPT_TIMEOUT_SECONDS", "2.5"))
+AMAP_MAX_RETRIES = int(os.getenv("AMAP_MAX_RETRIES", "2"))
+AMAP_RETRY_BACKOFF_MS = float(os.getenv("AMAP_RETRY_BACKOFF_MS", "100"))
+AMAP_RETRY_BUDGET_PER_PLAN = int(os.getenv("AMAP_RETRY_BUDGET_PER_PLAN", "10"))
+AMAP_HEDGE_ENABLED = os.getenv("AMAP_HEDGE_ENABLED", "1") == "1"
+AMAP_HEDGE_QUANTILE = float(os.getenv("AMAP_HEDGE_QUANTILE", "0.95"))
+AMAP_HEDGE_MIN_MS = float(os.getenv("AMAP_HEDGE_MIN_MS", "50"))
+AMAP_BREAKER_FAILURES = int(os.getenv("AMAP_BREAKER_FAILURES", "5"))
+AMAP_BREAKER_COOLDOWN_SECONDS = float(os.getenv("AMAP_BREAKER_COOLDOWN_SECONDS", "30"))
+
+# 高德批量接口（/v3/batch）：一次 POST 携带多个子请求，每批最多 AMAP_BATCH_MAX_OPS 个；
+# 一次行程的 POI 搜索、路径规划各自合并成少数几次往返。Key 未开通时自动退回逐个请求
+AMAP_BATCH_ENABLED = os.getenv("AMAP_BATCH_ENABLED", "1") == "1"
+AMAP_BATCH_MAX_OPS = int(os.getenv("AMAP_BATCH_MAX_OPS", "20"))
+
+# 离线城市 POI 索引（由 build_poi_index.py 生成）：设置目录后，已建索引的城市 POI 搜索直接读本地，
+# 未覆盖的城市照常实时搜索。POI_INDEX_MAX_AGE_DAYS 为增量刷新时关键词的过期天数，
+# 服务端也不使用抓取时间超过这个天数的索引结果（抓取任务没跑时改为实时搜索）；
+# POI_INDEX_PAGES 为抓取时每个关键词最多取的页数（每页 25 条）
+POI_INDEX_DIR = os.getenv("POI_INDEX_DIR", "")
+POI_INDEX_MAX_AGE_DAYS = float(os.getenv("POI_INDEX_MAX_AGE_DAYS", "7"))
+POI_INDEX_PAGES = int(os.getenv("POI_INDEX_PAGES", "4"))
+
+# 缓存预热/预取：启动时为热门城市 × 兴趣组合取好城市坐标和第 1 页 POI 搜索（后台优先级），之后每隔
+# PREFETCH_INTERVAL_SECONDS 再预热一遍，并提前刷新 PREFETCH_REFRESH_AHEAD_SECONDS 内将过期、
+# 命中至少 PREFETCH_MIN_HITS 次的条目。PREFETCH_CITIES 留空则不启用；
+# PREFETCH_INTERESTS 组合之间用分号、组合内用逗号分隔，空组合表示不选兴趣，如 "history,food;art;"
+PREFETCH_CITIES = os.getenv("PREFETCH_CITIES", "")
+PREFETCH_INTERESTS = os.getenv("PREFETCH_INTERESTS", "")
+PREFETCH_INTERVAL_SECONDS = float(os.getenv("PREFETCH_INTERVAL_SECONDS", "600"))
+PREFETCH_REFRESH_AHEAD_SECONDS = float(os.getenv("PREFETCH_REFRESH_AHEAD_SECONDS", "900"))
+PREFETCH_MIN_HITS = int(os.getenv("PREFETCH_MIN_HITS", "3"))
+
+# 监控：GET /metrics（Prometheus 文本格式）及 /api/plan_km 响应的 Server-Timing 头
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+
+# 日志：由应用入口（app.main / 脚本）按以下配置初始化，业务模块导入时不做任何配置。
+# LOG_FORMAT 为 text 或 json（每行一条结构化日志）；LOG_QUEUE=1 时请求线程只把记录放进队列，
+# 由后台线程格式化并写出；LOG_CONFIG 指定 logging.config.dictConfig 的 JSON 文件时以文件为准。
+# 逐次调用的调试日志（amap = 每个高德请求/响应，search = 每页 POI 搜索）按采样率记录：
+# LOG_SAMPLE_RATE 为默认比例，LOG_SAMPLE_RATES 按类别覆盖，如 "amap=0.01,search=0.1"
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")
+LOG_QUEUE = os.getenv("LOG_QUEUE", "1") == "1"
+LOG_CONFIG = os.getenv("LOG_CONFIG", "")
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "1"))
+LOG_SAMPLE_RATES = os.getenv("LOG_SAMPLE_RATES", "")
+
+# 整份行程缓存：soft TTL 内直接返回，超过后先返回旧结果并在后台刷新，超过 TTL 视为未命中
+PLAN_CACHE_ENABLED = os.getenv("PLAN_CACHE_ENABLED", "1") == "1"
+PLAN_CACHE_MAXSIZE = int(os.getenv("PLAN_CACHE_MAXSIZE", "1024"))
+PLAN_CACHE_SOFT_TTL_SECONDS = float(os.getenv("PLAN_CACHE_SOFT_TTL_SECONDS", "600"))
+PLAN_CACHE_TTL_SECONDS = float(os.getenv("PLAN_CACHE_TTL_SECONDS", "3600"))
+# 命中整份行程缓存时按出发日期复用已编码的 /api/plan_km 响应体，最多保存的份数；0 表示不保存
+PLAN_BODY_CACHE_MAXSIZE = int(os.getenv("PLAN_BODY_CACHE_MAXSIZE", "256"))
+
+# /api/plan_km 响应：kmTravel 数据由本服务生成，跳过 KmTravelResponse 的再次校验，直接用 orjson 编码；
+# 设为 0 时按 response_model 校验后用标准库 json 编码（与 FastAPI 默认处理相同）
+FAST_JSON_ENABLED = os.getenv("FAST_JSON_ENABLED", "1") == "1"
@@ -0,0 +1,130 @@
+from __future__ import annotations
+
+import atexit
+import json
+import logging
+import logging.config
+import logging.handlers
+import queue
+import random
+import time
+from typing import Dict, Optional
+
+from app.core import config
+
+# 日志配置由入口（app.main、命令行脚本）调用 setup_logging 决定，业务模块只 getLogger、不做任何配置。
+# 请求链路上的日志统一用 %s 占位符延迟格式化；逐次调用的调试日志经 debug_sampled 按比例采样。
+
+TEXT_FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+
+# 可以原样留到后台线程再格式化的参数类型（不可变，不会在格式化前被请求代码改掉）
+_IMMUTABLE = (str, int, float, bool, type(None))
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def parse_rates(spec: str) -> Dict[str, float]:
+    """'amap=0.01,search=0.1' -> {'amap': 0.01, 'search': 0.1}"""
+    rates: Dict[str, float] = {}
+    for part in spec.split(","):
+        name, _, value = part.partition("=")
+        if name.strip() and value.strip():
+            rates[name.strip()] = min(1.0, max(0.0, float(value)))
+    return rates
+
+
+_default_rate = min(1.0, max(0.0, config.LOG_SAMPLE_RATE))
+_rates = parse_rates(config.LOG_SAMPLE_RATES)
+
+
+def sampled(category: str) -> bool:
+    """按该类别的采样率决定这一次是否记录"""
+    rate = _rates.get(category, _default_rate)
+    return rate >= 1.0 or (rate > 0.0 and random.random() < rate)
+
+
+def debug_sampled(logger: logging.Logger, category: str, msg: str, *args: object) -> None:
+    """逐次调用（每个高德请求、每页搜索）的调试日志：未开启 DEBUG 时只有一次级别判断，开启后按类别采样"""
+    if logger.isEnabledFor(logging.DEBUG) and sampled(category):
+        logger.debug(msg, *args, stacklevel=2)
+
+
+class JsonFormatter(logging.Formatter):
+    """每条日志一行 JSON，extra 传入的字段原样带上"""
+
+    _RESERVED = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+    def format(self, record: logging.LogRecord) -> str:
+        out = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(record.created)) + f".{int(record.msecs):03d}",
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for k, v in record.__dict__.items():
+            if k not in self._RESERVED and not k.startswith("_"):
+                out[k] = v
+        if record.exc_info:
+            out["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            out["exc"] = record.exc_text
+        return json.dumps(out, ensure_ascii=False, default=str)
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """只把日志记录放进队列，由后台线程格式化、写出。
+
+    标准 QueueHandler 在调用方线程里先格式化整条消息；这里参数都是不可变值时保留 msg/args，
+    格式化推迟到后台线程。参数里有 dict/list 等可变对象，或带异常信息时，仍在当前线程格式化，
+    避免后台线程读到之后被改动的对象。
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        if record.exc_info or record.stack_info:
+            return super().prepare(record)
+        args = record.args
+        if args and not (isinstance(args, tuple) and all(isinstance(a, _IMMUTABLE) for a in args)):
+            record.msg = record.getMessage()
+            record.args = None
+        return record
+
+
+def setup_logging(force: bool = False) -> None:
+    """按 LOG_* 配置根日志：LOG_CONFIG 指定 dictConfig JSON 文件时完全按文件配置；
+    否则如果运行环境已经给根日志配了 handler（如 uvicorn --log-config），保持不动；
+    都没有时按 LOG_LEVEL / LOG_FORMAT 输出到 stderr，LOG_QUEUE=1 时经队列由后台线程写出。"""
+    global _listener
+    if config.LOG_CONFIG:
+        with open(config.LOG_CONFIG, encoding="utf-8") as f:
+            logging.config.dictConfig(json.load(f))
+        return
+
+    root = logging.getLogger()
+    if root.handlers and not force:
+        return
+    stop_logging()
+    for h in list(root.handlers):
+        root.removeHandler(h)
+
+    handler: logging.Handler = logging.StreamHandler()
+    handler.setFormatter(JsonFormatter() if config.LOG_FORMAT == "json" else logging.Formatter(TEXT_FORMAT))
+    if config.LOG_QUEUE:
+        q: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+        _listener = logging.handlers.QueueListener(q, handler, respect_handler_level=True)
+        _listener.start()
+        handler = DeferredQueueHandler(q)
+    root.addHandler(handler)
+    root.setLevel(config.LOG_LEVEL.upper())
+    # httpx 每个请求记一条 INFO，与 amap 类明细重复；需要时用 LOG_CONFIG 单独打开
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+
+def stop_logging() -> None:
+    """停止后台写日志线程，写完队列中剩余的记录"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+atexit.register(stop_logging)
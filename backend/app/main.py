@@ -1,8 +1,82 @@
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from app.core import config
+from app.core.logging_config import setup_logging
+from app.routers.metrics import router as metrics_router
 from app.routers.plan import router as plan_router
+from app.services.amap_cache import CachedAmapClient
+from app.services.amap_store import AmapStore
+from app.services.plan_cache import PlanCache
+from app.services.poi_index import IndexedAmapClient, PoiIndexSet
+from app.services.prefetch import Prefetcher, parse_targets
+from app.services.shared_state import SharedState
+from app.services.gaode_mcp import AsyncAmapClient, create_http_client, create_rate_limiter, create_resilience
 
-app = FastAPI(title="Travel Agent Minimal")
+# 应用入口负责日志配置（LOG_LEVEL / LOG_FORMAT / LOG_QUEUE / LOG_CONFIG），业务模块导入时不做配置
+setup_logging()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 进程级共享连接池：所有请求复用同一个 httpx.AsyncClient（keep-alive）
+    http = create_http_client()
+    # 多 worker 部署时的共享协调状态：令牌桶、日配额和跨进程加载租约
+    app.state.shared_state = SharedState(config.SHARED_STATE_PATH) if config.SHARED_STATE_PATH else None
+    # 按接口族限速，放在缓存之下：只有真正发往高德的请求才消耗令牌
+    app.state.rate_limiter = create_rate_limiter(app.state.shared_state)
+    app.state.resilience = create_resilience()
+    amap = AsyncAmapClient(http, limiter=app.state.rate_limiter, resilience=app.state.resilience)
+
+    # 可选的持久化二级缓存：多 worker 共享，重启后仍可命中
+    store = None
+    compaction = None
+    if config.AMAP_CACHE_ENABLED and config.AMAP_STORE_PATH:
+        store = AmapStore(config.AMAP_STORE_PATH, config.AMAP_STORE_MAX_MB * 1024 * 1024)
+        compaction = asyncio.create_task(store.run_compaction(config.AMAP_STORE_COMPACT_INTERVAL_SECONDS))
+
+    cache = None
+    if config.AMAP_CACHE_ENABLED:
+        amap = cache = CachedAmapClient(amap, store=store, shared=app.state.shared_state)
+    # 离线 POI 索引放在最外层：已覆盖城市的搜索连缓存都不用查
+    app.state.poi_index = PoiIndexSet(config.POI_INDEX_DIR) if config.POI_INDEX_DIR else None
+    if app.state.poi_index is not None:
+        amap = IndexedAmapClient(amap, app.state.poi_index)
+    app.state.amap = amap
+    app.state.plan_cache = (
+        PlanCache(config.PLAN_CACHE_MAXSIZE, config.PLAN_CACHE_TTL_SECONDS, config.PLAN_CACHE_SOFT_TTL_SECONDS,
+                  config.PLAN_BODY_CACHE_MAXSIZE)
+        if config.PLAN_CACHE_ENABLED else None
+    )
+    # 热门城市预热：不阻塞启动，完成前 /api/ready 返回 503
+    app.state.prefetcher = None
+    prefetch = None
+    targets = parse_targets(config.PREFETCH_CITIES, config.PREFETCH_INTERESTS)
+    if cache is not None and targets:
+        app.state.prefetcher = Prefetcher(
+            amap, cache, targets,
+            config.PREFETCH_INTERVAL_SECONDS, config.PREFETCH_REFRESH_AHEAD_SECONDS, config.PREFETCH_MIN_HITS,
+            shared=app.state.shared_state,
+        )
+        prefetch = asyncio.create_task(app.state.prefetcher.run())
+    try:
+        yield
+    finally:
+        if prefetch:
+            prefetch.cancel()
+        if app.state.plan_cache is not None:
+            await app.state.plan_cache.close()
+        if compaction:
+            compaction.cancel()
+        if store:
+            store.close()
+        if app.state.shared_state is not None:
+            app.state.shared_state.close()
+        await http.aclose()
+
+
+app = FastAPI(title="Travel Agent Minimal", lifespan=lifespan)
 
 # 允许本地前端访问
 app.add_middleware(
@@ -14,3 +88,5 @@ app.add_middleware(
 )
 
 app.include_router(plan_router, prefix="/api")
+if config.METRICS_ENABLED:
+    app.include_router(metrics_router)
@@ -0,0 +1,14 @@
+from fastapi import APIRouter, Request
+from fastapi.responses import PlainTextResponse
+from app.services.metrics import REGISTRY, sync_cache_stats
+
+router = APIRouter()
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def metrics(request: Request):
+    """Prometheus 文本格式的指标：流水线各阶段耗时、高德上游耗时/状态、缓存命中率、每份行程的上游请求数"""
+    amap_stats = getattr(request.app.state.amap, "stats", None)
+    plan_cache = request.app.state.plan_cache
+    sync_cache_stats(amap_stats() if amap_stats else None, plan_cache.stats() if plan_cache is not None else None)
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
@@ -1,57 +1,246 @@
-from fastapi import APIRouter, HTTPException
+from typing import Any, AsyncIterator, Dict, Optional
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from app.schemas.plan import PlanRequest, KmTravelResponse
-from app.services.gaode_mcp import AmapClient
-from app.utils.itinerary import build_itinerary, to_km_travel
+from app.services.gaode_mcp import AsyncAmapClient
+from app.services.metrics import STAGE_SECONDS, server_timing
+from app.services.plan_cache import PlanCache, plan_cache_key
+from app.services.resilience import retry_budget
+from app.core import config
+from app.utils.query_plan import KEYWORD_YIELD
+from app.utils.itinerary import apply_dates, build_itinerary, iter_itinerary, km_cta, km_day, km_header, to_km_travel
+import json
 import logging
+import os
+import time
+import orjson
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
 
 
+def get_amap_client(request: Request) -> AsyncAmapClient:
+    """取 lifespan 中创建的进程级高德客户端"""
+    return request.app.state.amap
+
+
+def get_plan_cache(request: Request) -> Optional[PlanCache]:
+    """整份行程缓存（PLAN_CACHE_ENABLED=0 时为 None）"""
+    return request.app.state.plan_cache
+
+
+def _plan_server_timing(raw: Dict[str, Any], status: str, shaping: Optional[float], serialization: Optional[float], total: float) -> str:
+    """本次请求的 Server-Timing：新规划的行程带上流水线各阶段，命中缓存时只有整形、序列化和总耗时；
+    复用了已编码的响应体时（shaping 为 None）只有总耗时"""
+    timings = []
+    if status == "miss":
+        timings += [(name, t["wall_ms"]) for name, t in raw.get("debug_info", {}).get("timings_ms", {}).items()]
+    if shaping is not None:
+        timings += [("shaping", shaping * 1000), ("serialization", serialization * 1000)]
+    timings.append(("total", total * 1000))
+    header = server_timing(timings)
+    if shaping is None:
+        header = f'body-cache;desc="hit", {header}'
+    if status != "miss":
+        header = f'plan-cache;desc="{status}", {header}'
+    return header
+
+
+def encode_km_travel(shaped: Dict[str, Any]) -> bytes:
+    """to_km_travel 结果的 JSON 响应体。
+
+    FAST_JSON_ENABLED 时数据由本服务生成、结构与 KmTravelResponse 一致，不再逐层构造 pydantic 模型校验，
+    直接用 orjson 编码（输出与校验后的结果相同）；否则按 FastAPI 对 response_model 的默认处理：
+    校验 → jsonable_encoder → 标准库 json 编码。
+    """
+    if config.FAST_JSON_ENABLED:
+        return orjson.dumps(shaped)
+    return JSONResponse(jsonable_encoder(KmTravelResponse.model_validate(shaped))).body
+
+
 @router.post("/plan_km", response_model=KmTravelResponse)
-def create_plan_km(req: PlanRequest):
-    client = AmapClient()
+async def create_plan_km(
+    req: PlanRequest,
+    client: AsyncAmapClient = Depends(get_amap_client),
+    plan_cache: Optional[PlanCache] = Depends(get_plan_cache),
+):
+    started = time.perf_counter()
     try:
-        logger.info(f"开始规划行程: 城市={req.city}, 天数={req.days}, 兴趣={req.interests}")
-        
-        raw = build_itinerary(
-            client=client,
-            city=req.city,
-            days=req.days,
-            interests=req.interests,
-            starting_point=req.starting_point,
-            start_date=req.start_date,
-        )
-        
-        logger.info(f"原始行程数据: {raw.get('debug_info', {})}")
-        
-        shaped = to_km_travel(raw)
-        
-        logger.info(f"转换后数据: 天数={len(shaped.get('days', []))}, 景点总数={sum(len(day.get('spots', [])) for day in shaped.get('days', []))}")
-        
-        return shaped
+        logger.info("开始规划行程: 城市=%s, 天数=%d, 兴趣=%s", req.city, req.days, req.interests)
+
+        async def build():
+            with retry_budget(config.AMAP_RETRY_BUDGET_PER_PLAN):
+                return await build_itinerary(
+                    client=client,
+                    city=req.city,
+                    days=req.days,
+                    interests=req.interests,
+                    starting_point=req.starting_point,
+                    start_date=req.start_date,
+                )
+
+        body = None
+        if plan_cache is not None:
+            # 缓存的行程与日期无关，命中后再套上本次请求的日期；同一日期已编码过的直接复用响应体
+            key = plan_cache_key(req.city, req.days, req.interests, req.starting_point)
+            cached, status = await plan_cache.get_or_build(key, build)
+            body = plan_cache.body(key, req.start_date, cached)
+            raw = cached
+        else:
+            raw, status = await build(), "miss"
+
+        shaping = serialization = None
+        if body is None:
+            if plan_cache is not None:
+                raw = apply_dates(cached, req.start_date)
+            t0 = time.perf_counter()
+            shaped = to_km_travel(raw)
+            t1 = time.perf_counter()
+
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("转换后数据: 天数=%d, 景点总数=%d, 调试信息=%s", len(shaped.get("days", [])),
+                             sum(len(day.get("spots", [])) for day in shaped.get("days", [])), raw.get("debug_info", {}))
+
+            # 在这里编码响应体（而不是交给 response_model），才能把序列化计入阶段耗时
+            body = encode_km_travel(shaped)
+            t2 = time.perf_counter()
+            shaping, serialization = t1 - t0, t2 - t1
+            STAGE_SECONDS.observe(shaping, stage="shaping")
+            STAGE_SECONDS.observe(serialization, stage="serialization")
+            if plan_cache is not None:
+                plan_cache.put_body(key, req.start_date, cached, body)
+
+        response = Response(content=body, media_type="application/json")
+        if plan_cache is not None:
+            response.headers["X-Plan-Cache"] = status
+        if config.METRICS_ENABLED:
+            response.headers["Server-Timing"] = _plan_server_timing(raw, status, shaping, serialization, time.perf_counter() - started)
+        return response
         
     except Exception as e:
-        logger.error(f"行程规划失败: {e}")
+        logger.error("行程规划失败: %s", e)
         raise HTTPException(status_code=502, detail=f"Upstream error: {e}")
 
 
+def _frame(event: str, data: Any, sse: bool) -> bytes:
+    """一条流式事件：NDJSON 为一行 {"event", "data"}，SSE 为 event/data 两行加空行"""
+    if sse:
+        return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n".encode("utf-8")
+    return (json.dumps({"event": event, "data": data}, ensure_ascii=False) + "\n").encode("utf-8")
+
+
+def _stream_header(city: str, days: int, start: Any) -> Dict[str, Any]:
+    return {
+        **km_header(city, days),
+        "days_total": days,
+        "start": {"lng": start[0], "lat": start[1]} if start else None,
+    }
+
+
+def _stream_summary(raw: Dict[str, Any], first_day: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    return {
+        "cta_links": km_cta([first_day] if first_day else []),
+        "overview": raw.get("overview"),
+        "debug_info": raw.get("debug_info", {}),
+    }
+
+
+@router.post("/plan_km/stream")
+async def stream_plan_km(
+    req: PlanRequest,
+    request: Request,
+    client: AsyncAmapClient = Depends(get_amap_client),
+    plan_cache: Optional[PlanCache] = Depends(get_plan_cache),
+):
+    """流式返回 kmTravel 行程，首屏不必等整份行程生成完。
+
+    事件依次为 header（标题、提示、起点坐标）→ 每天一个 day（KmDay，附 index）→ summary（CTA、概览、调试信息）；
+    出错时以 error 事件结束。默认 NDJSON，Accept 含 text/event-stream 时按 SSE 格式输出。
+    """
+    sse = "text/event-stream" in request.headers.get("accept", "")
+    logger.info("开始流式规划行程: 城市=%s, 天数=%d, 兴趣=%s", req.city, req.days, req.interests)
+
+    async def build():
+        with retry_budget(config.AMAP_RETRY_BUDGET_PER_PLAN):
+            return await build_itinerary(
+                client=client,
+                city=req.city,
+                days=req.days,
+                interests=req.interests,
+                starting_point=req.starting_point,
+                start_date=req.start_date,
+            )
+
+    key = plan_cache_key(req.city, req.days, req.interests, req.starting_point)
+    found = plan_cache.peek(key, build) if plan_cache is not None else None
+
+    async def events() -> AsyncIterator[bytes]:
+        first_day = None
+        try:
+            if found is not None:
+                # 命中缓存：整份行程已就绪，一次性按同样的事件顺序输出
+                raw = apply_dates(found[0], req.start_date)
+                yield _frame("header", _stream_header(req.city, req.days, raw.get("start")), sse)
+                for di, day in enumerate(raw.get("days", []), start=1):
+                    shaped = km_day(di, day, req.city)
+                    first_day = first_day or shaped
+                    yield _frame("day", {"index": di, **shaped}, sse)
+                yield _frame("summary", _stream_summary(raw, first_day), sse)
+                return
+
+            di = 0
+            with retry_budget(config.AMAP_RETRY_BUDGET_PER_PLAN):
+                async for event, data in iter_itinerary(client, req.city, req.days, req.interests, req.starting_point, req.start_date):
+                    if event == "start":
+                        yield _frame("header", _stream_header(req.city, req.days, data), sse)
+                    elif event == "day":
+                        di += 1
+                        shaped = km_day(di, data, req.city)
+                        first_day = first_day or shaped
+                        yield _frame("day", {"index": di, **shaped}, sse)
+                    elif event == "done":
+                        if plan_cache is not None:
+                            plan_cache.put(key, data)
+                        yield _frame("summary", _stream_summary(data, first_day), sse)
+        except Exception as e:
+            logger.error("流式行程规划失败: %s", e)
+            yield _frame("error", {"detail": f"Upstream error: {e}"}, sse)
+
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}  # 关闭反向代理缓冲，事件才能逐条到达
+    if plan_cache is not None:
+        headers["X-Plan-Cache"] = found[1] if found is not None else "miss"
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream" if sse else "application/x-ndjson",
+        headers=headers,
+    )
+
+
+@router.get("/ready")
+async def ready(request: Request):
+    """就绪检查：缓存预热完成（或未启用预热）返回 200，否则 503，供负载均衡在预热期间不把流量切过来"""
+    prefetcher = getattr(request.app.state, "prefetcher", None)
+    if prefetcher is None:
+        return {"ready": True, "prefetch": None}
+    stats = prefetcher.stats()
+    return JSONResponse({"ready": stats["ready"], "prefetch": stats}, status_code=200 if stats["ready"] else 503)
+
+
 @router.get("/debug/amap")
-async def debug_amap(city: str = "北京", keywords: str = "博物馆"):
+async def debug_amap(city: str = "北京", keywords: str = "博物馆", client: AsyncAmapClient = Depends(get_amap_client)):
     """调试高德地图API功能"""
     try:
-        client = AmapClient()
-        
         # 测试地理编码
-        geocode_result = client.geocode(city)
+        geocode_result = await client.geocode(city)
         
         # 测试POI搜索
-        poi_result = client.search_poi(city, keywords, page=1, offset=5)
+        poi_result = await client.search_poi(city, keywords, page=1, offset=5)
         
         # 测试路径规划（如果有坐标的话）
         route_result = None
         if geocode_result and poi_result:
-            route_result = client.route_time(geocode_result, poi_result[0]['location'], mode="walk", city=city)
+            route_result = await client.route_time(geocode_result, poi_result[0].location, mode="walk", city=city)
         
         return {
             "status": "success",
@@ -64,7 +253,7 @@ async def debug_amap(city: str = "北京", keywords: str = "博物馆"):
                 "city": city,
                 "keywords": keywords,
                 "count": len(poi_result),
-                "results": poi_result[:3],  # 只返回前3个结果
+                "results": [p.to_dict() for p in poi_result[:3]],  # 只返回前3个结果
                 "success": len(poi_result) > 0
             },
             "route_planning": {
@@ -78,9 +267,30 @@ async def debug_amap(city: str = "北京", keywords: str = "博物馆"):
         }
         
     except Exception as e:
-        logger.error(f"调试API失败: {e}")
+        logger.error("调试API失败: %s", e)
         return {
             "status": "error",
             "error": str(e)
         }
 
+
+@router.get("/debug/cache")
+async def debug_cache(request: Request, client: AsyncAmapClient = Depends(get_amap_client), plan_cache: Optional[PlanCache] = Depends(get_plan_cache)):
+    """查看高德接口缓存及整份行程缓存的命中/未命中/淘汰统计，以及各接口族的限速排队、容错情况和离线 POI 索引的使用情况。
+    多 worker 部署时是处理本次请求的那个 worker 的统计（pid 字段），令牌数和当天用量是所有 worker 共用的值"""
+    stats = getattr(client, "stats", None)
+    limiter = getattr(request.app.state, "rate_limiter", None)
+    resilience = getattr(request.app.state, "resilience", None)
+    poi_index = getattr(request.app.state, "poi_index", None)
+    prefetcher = getattr(request.app.state, "prefetcher", None)
+    return {
+        "pid": os.getpid(),
+        "enabled": stats is not None,
+        "endpoints": stats() if stats else {},
+        "plan_cache": plan_cache.stats() if plan_cache is not None else None,
+        "rate_limit": limiter.stats() if limiter is not None else None,
+        "resilience": resilience.stats() if resilience is not None else None,
+        "query_planner": KEYWORD_YIELD.stats(),
+        "poi_index": poi_index.stats() if poi_index is not None else None,
+        "prefetch": prefetcher.stats() if prefetcher is not None else None,
+    }
@@ -24,12 +24,19 @@ class KmNavLink(BaseModel):
     text: str
     href: str
 
+class KmMove(BaseModel):
+    mode: str                  # walk / transit / drive
+    distance_km: float
+    est_duration_min: int
+    source: str                # "amap" = 高德真实路线, "estimate" = 本地直线距离估算
+
 class KmSpot(BaseModel):
     name: str
     desc: Optional[str] = None
     stay_suggested_hours: Optional[float] = None
     image: Optional[KmImage] = None
     nav_links: List[KmNavLink] = []
+    move: Optional[KmMove] = None   # 从上一个点到此处的移动
 
 class KmDay(BaseModel):
     title: str                 # e.g. "Day 1: 北京市区游 (2025-09-10)"
@@ -0,0 +1,393 @@
+from __future__ import annotations
+import asyncio
+import time
+
+from typing import Dict, Any, List, Optional, Tuple, Callable, Awaitable, Hashable
+from cachetools import Cache, TTLCache
+from app.core import config
+from app.services.amap_store import AmapStore, MISSING
+from app.services.gaode_mcp import AsyncAmapClient, FAILED
+from app.services.rate_limit import is_background
+from app.services.shared_state import SharedState
+from app.services.singleflight import SingleFlight
+from app.utils.poi import Poi
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class _CountingTTLCache(TTLCache):
+    """记录容量淘汰与过期清理次数的 TTLCache"""
+
+    def __init__(self, maxsize: int, ttl: float):
+        super().__init__(maxsize=maxsize, ttl=ttl)
+        self.evictions = 0
+        self.expirations = 0
+
+    def popitem(self):
+        # TTLCache 只在容量已满时调用 popitem（LRU 淘汰）
+        item = super().popitem()
+        self.evictions += 1
+        return item
+
+    def expire(self, time=None):
+        # 用 Cache.__len__：TTLCache.__len__ 自身会调用 expire
+        before = Cache.__len__(self)
+        super().expire(time)
+        self.expirations += before - Cache.__len__(self)
+
+
+class _Endpoint:
+    """单个接口的正/负结果缓存及命中统计"""
+
+    def __init__(self, name: str, maxsize: int, ttl: float, negative_ttl: float, empty: Any):
+        self.name = name
+        # 没有结果时返回给调用方的值（None / []）
+        self.empty = empty
+        self.positive = _CountingTTLCache(maxsize, ttl)
+        # 负结果（高德确实没有结果）只保留很短时间，避免短时间内反复打上游；
+        # 请求失败（FAILED）不缓存，下次照常请求，由熔断器和重试预算保护上游
+        self.negative = _CountingTTLCache(max(1, maxsize // 4), negative_ttl)
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        # key -> [用户请求命中次数, 写入时间]，与正结果同容量同 TTL，供预取挑选“快过期的热门条目”
+        self.usage = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.hits = 0
+        self.negative_hits = 0
+        self.store_hits = 0
+        self.peer_waits = 0
+        self.misses = 0
+
+    def stats(self) -> Dict[str, Any]:
+        served = self.hits + self.negative_hits + self.store_hits
+        lookups = served + self.misses
+        return {
+            "hits": self.hits,
+            "negative_hits": self.negative_hits,
+            "store_hits": self.store_hits,
+            "peer_waits": self.peer_waits,
+            "misses": self.misses,
+            "hit_ratio": round(served / lookups, 4) if lookups else 0.0,
+            "size": len(self.positive),
+            "negative_size": len(self.negative),
+            "maxsize": self.positive.maxsize,
+            "ttl_seconds": self.positive.ttl,
+            "evictions": self.positive.evictions + self.negative.evictions,
+            "expirations": self.positive.expirations + self.negative.expirations,
+        }
+
+
+def _norm(s: Optional[str]) -> str:
+    return (s or "").strip()
+
+
+class CachedAmapClient:
+    """AsyncAmapClient 外层的进程内 TTL/LRU 缓存。
+
+    geocode / place/text / direction 三类接口各自一套容量和过期时间；
+    缓存中的 Poi 不可变，直接在多个请求间共享（返回的列表是副本）。
+    传入 store 时作为二级缓存：内存未命中先查持久化缓存，再打上游。
+    AMAP_SINGLEFLIGHT_ENABLED 时，同一 key 的并发未命中会合并成一次加载；
+    再传入 shared（SharedState）时跨 worker 进程也合并：拿到 key 租约的进程打上游并写入持久化缓存，
+    其他进程轮询持久化缓存等它的结果。
+    """
+
+    # 等待其他 worker 加载结果时轮询持久化缓存的间隔
+    PEER_POLL_SECONDS = 0.02
+
+    def __init__(self, client: AsyncAmapClient, store: Optional[AmapStore] = None, shared: Optional[SharedState] = None):
+        self.client = client
+        self.store = store
+        # 跨进程合并需要持久化缓存来传递结果
+        self.shared = shared if store is not None else None
+        self.flight = SingleFlight() if config.AMAP_SINGLEFLIGHT_ENABLED else None
+        self.route_precision = config.AMAP_CACHE_ROUTE_PRECISION
+        negative_ttl = config.AMAP_CACHE_NEGATIVE_TTL_SECONDS
+        self.endpoints = {
+            "geocode": _Endpoint("geocode", config.AMAP_CACHE_GEOCODE_MAXSIZE, config.AMAP_CACHE_GEOCODE_TTL_SECONDS, negative_ttl, None),
+            "place_text": _Endpoint("place_text", config.AMAP_CACHE_POI_MAXSIZE, config.AMAP_CACHE_POI_TTL_SECONDS, negative_ttl, ()),
+            "direction": _Endpoint("direction", config.AMAP_CACHE_ROUTE_MAXSIZE, config.AMAP_CACHE_ROUTE_TTL_SECONDS, negative_ttl, None),
+        }
+
+    @property
+    def api_key(self) -> str:
+        return self.client.api_key
+
+    @staticmethod
+    def _hit(ep: _Endpoint, key: Hashable) -> None:
+        ep.hits += 1
+        # 预热/后台刷新自己的命中不算热度
+        usage = ep.usage.get(key)
+        if usage is not None and not is_background():
+            usage[0] += 1
+
+    async def _cached(self, endpoint: str, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> Any:
+        ep = self.endpoints[endpoint]
+        value = ep.positive.get(key)
+        if value is not None:
+            self._hit(ep, key)
+            return value
+        # 只读一次：先判断 in 再取值，中间条目可能刚好过期
+        value = ep.negative.get(key, MISSING)
+        if value is not MISSING:
+            ep.negative_hits += 1
+            return value
+
+        if self.flight:
+            # 同一 key 的并发未命中只发一次上游请求
+            return await self.flight.do((endpoint, key), lambda: self._load(ep, endpoint, key, loader))
+        return await self._load(ep, endpoint, key, loader)
+
+    async def _cached_many(self, endpoint: str, keys: List[Hashable], load_many: Callable[[List[int]], Awaitable[List[Any]]]) -> List[Any]:
+        """批量版 _cached：逐条查内存缓存，剩下的未命中（同 key 只算一次）查持久化缓存后交给 load_many 一次加载。
+
+        load_many 接收未命中条目在 keys 中的下标，返回对应的结果。开启 singleflight 时与单条请求一样按 key 合并：
+        其他请求（单条或批量）正在加载的 key 等它的结果，其余 key 登记为在飞后一起加载。
+        """
+        ep = self.endpoints[endpoint]
+        results: List[Any] = [None] * len(keys)
+        missing: Dict[Hashable, List[int]] = {}
+        for i, key in enumerate(keys):
+            value = ep.positive.get(key)
+            if value is not None:
+                self._hit(ep, key)
+                results[i] = value
+                continue
+            value = ep.negative.get(key, MISSING)
+            if value is not MISSING:
+                ep.negative_hits += 1
+                results[i] = value
+            else:
+                missing.setdefault(key, []).append(i)
+        if not missing:
+            return results
+
+        if self.flight:
+            values = await self.flight.do_many(
+                [(endpoint, key) for key in missing],
+                lambda owned: self._load_many(ep, endpoint, [key for _, key in owned], missing, load_many),
+            )
+        else:
+            values = await self._load_many(ep, endpoint, list(missing), missing, load_many)
+        for key, value in zip(missing, values):
+            for i in missing[key]:
+                results[i] = value
+        return results
+
+    async def _load_many(self, ep: _Endpoint, endpoint: str, keys: List[Hashable], missing: Dict[Hashable, List[int]],
+                         load_many: Callable[[List[int]], Awaitable[List[Any]]]) -> List[Any]:
+        """批量加载 keys：先查持久化缓存，再（跨进程合并时只对拿到租约的部分）交给 load_many，返回与 keys 对应的结果"""
+        found: Dict[Hashable, Any] = {}
+        todo = keys
+        if self.store:
+            stored = await asyncio.gather(*(self.store.get(self._store_key(endpoint, k)) for k in keys))
+            todo = []
+            for key, value in zip(keys, stored):
+                if value is MISSING:
+                    todo.append(key)
+                else:
+                    ep.store_hits += 1
+                    self._remember(ep, key, value)
+                    found[key] = value
+
+        if todo and self.shared:
+            # 其他 worker 正在加载的 key 等它写入持久化缓存，只加载拿到租约的部分
+            store_keys = [self._store_key(endpoint, k) for k in todo]
+            leased = await self.shared.try_lease(store_keys, config.SHARED_LEASE_SECONDS)
+            owned = [k for k, ok in zip(todo, leased) if ok]
+            try:
+                await self._load_missing(ep, endpoint, owned, missing, load_many, found)
+            finally:
+                await self.shared.release([sk for sk, ok in zip(store_keys, leased) if ok])
+            peers = [(k, sk) for k, sk, ok in zip(todo, store_keys, leased) if not ok]
+            ep.peer_waits += len(peers)
+            values = await asyncio.gather(*(self._await_peer(sk) for _, sk in peers))
+            left = []
+            for (key, _), value in zip(peers, values):
+                if value is MISSING:
+                    left.append(key)
+                    continue
+                ep.store_hits += 1
+                self._remember(ep, key, value)
+                found[key] = value
+            # 对方失败或超时仍没有结果的，自己加载
+            await self._load_missing(ep, endpoint, left, missing, load_many, found)
+        elif todo:
+            await self._load_missing(ep, endpoint, todo, missing, load_many, found)
+        return [found[key] for key in keys]
+
+    async def _load_missing(self, ep: _Endpoint, endpoint: str, keys: List[Hashable], missing: Dict[Hashable, List[int]],
+                            load_many: Callable[[List[int]], Awaitable[List[Any]]], found: Dict[Hashable, Any]) -> None:
+        """用 load_many 一次加载 keys，结果写入 found、内存缓存和持久化缓存"""
+        if not keys:
+            return
+        ep.misses += len(keys)
+        values = await load_many([missing[key][0] for key in keys])
+        for key, value in zip(keys, values):
+            self._remember(ep, key, value)
+            found[key] = ep.empty if value is FAILED else value
+        if self.store:
+            # 失败的不写：持久化缓存多个 worker 共用、重启后还在，写进去会让所有进程都把这次失败当成没有结果
+            await asyncio.gather(*(
+                self.store.set(self._store_key(endpoint, key), value, ep.ttl if value else ep.negative_ttl)
+                for key, value in zip(keys, values) if value is not FAILED
+            ))
+
+    async def _await_peer(self, store_key: str) -> Any:
+        """另一个 worker 持有该 key 的租约：轮询持久化缓存直到它写入结果。
+        对方已释放租约（失败）仍没有结果，或等满 SHARED_LEASE_SECONDS 时返回 MISSING，由调用方自己加载"""
+        deadline = time.monotonic() + config.SHARED_LEASE_SECONDS
+        while True:
+            await asyncio.sleep(self.PEER_POLL_SECONDS)
+            # 先看租约再读缓存：持有者先写缓存后释放租约，租约已不在时这次读一定能看到它写入的结果
+            held = await self.shared.held(store_key)
+            value = await self.store.get(store_key)
+            if value is not MISSING:
+                return value
+            if not held or time.monotonic() >= deadline:
+                return MISSING
+
+    @staticmethod
+    def _store_key(endpoint: str, key: Hashable) -> str:
+        return f"{endpoint}:{json.dumps(key, ensure_ascii=False)}"
+
+    async def _load(self, ep: _Endpoint, endpoint: str, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> Any:
+        store_key = self._store_key(endpoint, key) if self.store else None
+        if store_key:
+            value = await self.store.get(store_key)
+            if value is not MISSING:
+                ep.store_hits += 1
+                self._remember(ep, key, value)
+                return value
+
+        leased = False
+        if self.shared:
+            leased = (await self.shared.try_lease([store_key], config.SHARED_LEASE_SECONDS))[0]
+            if not leased:
+                # 另一个 worker 正在加载同一个 key
+                ep.peer_waits += 1
+                value = await self._await_peer(store_key)
+                if value is not MISSING:
+                    ep.store_hits += 1
+                    self._remember(ep, key, value)
+                    return value
+
+        ep.misses += 1
+        try:
+            value = await loader()
+            self._remember(ep, key, value)
+            if store_key and value is not FAILED:
+                await self.store.set(store_key, value, ep.ttl if value else ep.negative_ttl)
+        finally:
+            if leased:
+                await self.shared.release([store_key])
+        return ep.empty if value is FAILED else value
+
+    @staticmethod
+    def _remember(ep: _Endpoint, key: Hashable, value: Any) -> None:
+        """成功的结果进正缓存，确实没有结果的进负缓存；请求失败（FAILED）不记住"""
+        if value:
+            ep.positive[key] = value
+            ep.usage[key] = [0, time.monotonic()]
+        elif value is not FAILED:
+            ep.negative[key] = value
+
+    def refresh_candidates(self, endpoint: str, ahead: float, min_hits: int) -> List[Hashable]:
+        """ahead 秒内将过期、且写入以来被用户请求命中至少 min_hits 次的条目，热度高的在前"""
+        ep = self.endpoints[endpoint]
+        deadline = time.monotonic() + ahead - ep.ttl
+        hot = [(hits, key) for key, (hits, stored) in list(ep.usage.items()) if hits >= min_hits and stored <= deadline]
+        return [key for _, key in sorted(hot, key=lambda h: -h[0])]
+
+    async def refresh(self, endpoint: str, keys: List[Hashable]) -> int:
+        """绕过缓存重新加载这些条目（geocode / place_text），成功的覆盖旧值并重新计时；返回刷新成功的条数。
+
+        路线缓存的键是取整后的坐标，无法还原成原始请求，不支持刷新。
+        """
+        if not keys:
+            return 0
+        if endpoint == "geocode":
+            queries = [(address, city or None) for address, city in keys]
+            if config.AMAP_BATCH_ENABLED:
+                values = await self.client.geocode_many(queries)
+            else:
+                values = list(await asyncio.gather(*(self.client.geocode(a, city=c) for a, c in queries)))
+        elif endpoint == "place_text":
+            groups: Dict[Tuple[str, str], List[int]] = {}
+            for i, (city, *_, extensions, _) in enumerate(keys):
+                groups.setdefault((city, extensions), []).append(i)
+            values: List[Any] = [None] * len(keys)
+            for (city, extensions), idx in groups.items():
+                queries = [(keys[i][1], keys[i][2], keys[i][3], keys[i][5]) for i in idx]
+                if config.AMAP_BATCH_ENABLED:
+                    found = await self.client.search_poi_many(city, queries, extensions=extensions)
+                else:
+                    found = await asyncio.gather(*(
+                        self.client.search_poi(city, kw, page=page, offset=offset, extensions=extensions, types=types)
+                        for kw, page, offset, types in queries
+                    ))
+                for i, v in zip(idx, found):
+                    values[i] = v
+        else:
+            raise ValueError(f"不支持刷新的接口: {endpoint}")
+
+        ep = self.endpoints[endpoint]
+        refreshed = 0
+        for key, value in zip(keys, values):
+            # 刷新失败时保留旧值，等它自然过期
+            if not value:
+                continue
+            self._remember(ep, key, value)
+            if self.store:
+                await self.store.set(self._store_key(endpoint, key), value, ep.ttl)
+            refreshed += 1
+        return refreshed
+
+    # --- Geocoding ---
+    async def geocode(self, address: str, city: Optional[str] = None) -> Optional[Tuple[float, float]]:
+        key = (_norm(address), _norm(city))
+        return await self._cached("geocode", key, lambda: self.client.geocode(address, city=city, strict=True))
+
+    async def geocode_many(self, queries: List[Tuple[str, Optional[str]]]) -> List[Optional[Tuple[float, float]]]:
+        keys = [(_norm(address), _norm(city)) for address, city in queries]
+        return await self._cached_many("geocode", keys, lambda idx: self.client.geocode_many([queries[i] for i in idx], strict=True))
+
+    # --- POI search ---
+    async def search_poi(self, city: str, keywords: str, page: int = 1, offset: int = 10, extensions: str = "base", types: str = "") -> List[Poi]:
+        key = (_norm(city), _norm(keywords), int(page), int(offset), extensions, _norm(types))
+        pois = await self._cached("place_text", key, lambda: self.client.search_poi(city, keywords, page=page, offset=offset, extensions=extensions, types=types, strict=True))
+        return list(pois)
+
+    async def search_poi_many(self, city: str, queries: List[Tuple[str, int, int, str]], extensions: str = "base") -> List[List[Poi]]:
+        keys = [(_norm(city), _norm(kw), int(page), int(offset), extensions, _norm(types)) for kw, page, offset, types in queries]
+        results = await self._cached_many("place_text", keys, lambda idx: self.client.search_poi_many(city, [queries[i] for i in idx], extensions=extensions, strict=True))
+        return [list(pois) for pois in results]
+
+    # --- Routing ---
+    def _route_key(self, origin: Tuple[float, float], destination: Tuple[float, float], mode: str, city: Optional[str]) -> Hashable:
+        p = self.route_precision
+        o = (round(float(origin[0]), p), round(float(origin[1]), p))
+        d = (round(float(destination[0]), p), round(float(destination[1]), p))
+        # 只有公交规划会用到 city 参数
+        return (mode, o, d, _norm(city) if mode == "transit" else "")
+
+    async def route_time(self, origin: Tuple[float, float], destination: Tuple[float, float], mode: str = "walk", city: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        key = self._route_key(origin, destination, mode, city)
+        route = await self._cached("direction", key, lambda: self.client.route_time(origin, destination, mode=mode, city=city, strict=True))
+        return dict(route) if route else route
+
+    async def route_time_many(self, legs: List[Tuple[Tuple[float, float], Tuple[float, float]]], mode: str = "walk", city: Optional[str] = None) -> List[Optional[Dict[str, Any]]]:
+        keys = [self._route_key(o, d, mode, city) for o, d in legs]
+        routes = await self._cached_many("direction", keys, lambda idx: self.client.route_time_many([legs[i] for i in idx], mode=mode, city=city, strict=True))
+        return [dict(r) if r else r for r in routes]
+
+    def stats(self) -> Dict[str, Any]:
+        stats = {name: ep.stats() for name, ep in self.endpoints.items()}
+        if self.store:
+            stats["store"] = self.store.stats()
+        if self.flight:
+            stats["singleflight"] = self.flight.stats()
+        if self.shared:
+            stats["shared"] = self.shared.stats()
+        return stats
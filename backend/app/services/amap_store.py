@@ -0,0 +1,239 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import sqlite3
+import struct
+import threading
+import time
+from typing import Any, Dict, List, Tuple
+import logging
+
+from app.utils.poi import Poi, make_poi
+
+logger = logging.getLogger(__name__)
+
+# get() 未命中时的返回值（None / [] 本身是合法的负结果，不能用来表示未命中）
+MISSING = object()
+
+# --- 二进制编码 ---
+# 每个值以 1 字节类型标记开头：
+#   N: None            G: 坐标 (lng, lat) 两个 float64
+#   R: 路线 {mode, distance_km, est_duration_min}
+#   P: Poi 列表（定长坐标 + 变长字符串字段，比 JSON 小约一半）
+#   J: 其他结构，退回 JSON
+_POI_FIELDS = ("id", "name", "category", "address", "tel", "distance", "rating")
+_ROUTE_KEYS = frozenset(("mode", "distance_km", "est_duration_min"))
+
+
+def _pack_str(buf: bytearray, v: Any) -> None:
+    # 字段标记：0=None, 1=str, 2=JSON（高德空字段有时返回 []）
+    if v is None:
+        buf.append(0)
+        return
+    if isinstance(v, str):
+        tag, raw = 1, v.encode("utf-8")
+    else:
+        tag, raw = 2, json.dumps(v, ensure_ascii=False).encode("utf-8")
+    buf.append(tag)
+    buf += struct.pack("<H", len(raw))
+    buf += raw
+
+
+def _unpack_str(data: bytes, pos: int) -> Tuple[Any, int]:
+    tag = data[pos]
+    pos += 1
+    if tag == 0:
+        return None, pos
+    (n,) = struct.unpack_from("<H", data, pos)
+    pos += 2
+    raw = data[pos:pos + n].decode("utf-8")
+    pos += n
+    return (raw if tag == 1 else json.loads(raw)), pos
+
+
+def _is_poi_list(value: Any) -> bool:
+    return isinstance(value, list) and all(isinstance(p, Poi) for p in value)
+
+
+def encode_value(value: Any) -> bytes:
+    if value is None:
+        return b"N"
+    if isinstance(value, tuple) and len(value) == 2:
+        return b"G" + struct.pack("<dd", value[0], value[1])
+    if isinstance(value, dict) and set(value) == _ROUTE_KEYS:
+        buf = bytearray(b"R")
+        _pack_str(buf, value["mode"])
+        buf += struct.pack("<di", value["distance_km"], value["est_duration_min"])
+        return bytes(buf)
+    if _is_poi_list(value):
+        buf = bytearray(b"P")
+        buf += struct.pack("<H", len(value))
+        for p in value:
+            buf += struct.pack("<dd", p.lng, p.lat)
+            for f in _POI_FIELDS:
+                _pack_str(buf, getattr(p, f))
+        return bytes(buf)
+    return b"J" + json.dumps(value, ensure_ascii=False).encode("utf-8")
+
+
+def decode_value(data: bytes) -> Any:
+    tag = data[:1]
+    if tag == b"N":
+        return None
+    if tag == b"G":
+        return struct.unpack_from("<dd", data, 1)
+    if tag == b"R":
+        mode, pos = _unpack_str(data, 1)
+        dist, dur = struct.unpack_from("<di", data, pos)
+        return {"mode": mode, "distance_km": dist, "est_duration_min": dur}
+    if tag == b"P":
+        (n,) = struct.unpack_from("<H", data, 1)
+        pos = 3
+        pois: List[Poi] = []
+        for _ in range(n):
+            lng, lat = struct.unpack_from("<dd", data, pos)
+            pos += 16
+            values = []
+            for _ in _POI_FIELDS:
+                v, pos = _unpack_str(data, pos)
+                values.append(v)
+            id_, name, category, address, tel, distance, rating = values
+            pois.append(make_poi(id_, name, category, lng, lat, address, tel, distance, rating))
+        return pois
+    return json.loads(data[1:].decode("utf-8"))
+
+
+class AmapStore:
+    """SQLite（WAL 模式）持久化的高德结果缓存。
+
+    同一台机器上的多个 worker 进程可以共用一个文件并发读写；进程重启后缓存仍在。
+    每条记录有独立的过期时间，后台定期清理过期记录，并在超过容量上限时按最近访问时间淘汰。
+    """
+
+    # 命中时最多每隔这么久才回写一次 accessed_at，避免每次读都产生写事务
+    TOUCH_INTERVAL_SECONDS = 60
+
+    def __init__(self, path: str, max_bytes: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=5.0, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._conn.execute("PRAGMA mmap_size=268435456")  # 读路径走内存映射
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS amap_cache ("
+            " key TEXT PRIMARY KEY,"
+            " value BLOB NOT NULL,"
+            " expires_at REAL NOT NULL,"
+            " accessed_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_amap_cache_expires ON amap_cache(expires_at)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_amap_cache_accessed ON amap_cache(accessed_at)")
+        logger.info("持久化缓存已打开: %s, 上限 %dMB", path, max_bytes // (1024 * 1024))
+
+    # --- 同步实现（在线程池中执行，避免阻塞事件循环） ---
+    def _get(self, key: str) -> Any:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires_at, accessed_at FROM amap_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or row[1] <= now:
+                self.misses += 1
+                return MISSING
+            if now - row[2] > self.TOUCH_INTERVAL_SECONDS:
+                self._conn.execute("UPDATE amap_cache SET accessed_at = ? WHERE key = ?", (now, key))
+            self.hits += 1
+        return decode_value(row[0])
+
+    def _set(self, key: str, value: Any, ttl: float) -> None:
+        now = time.time()
+        blob = encode_value(value)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO amap_cache (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, blob, now + ttl, now),
+            )
+            self.writes += 1
+
+    def _compact(self) -> Dict[str, int]:
+        now = time.time()
+        with self._lock:
+            expired = self._conn.execute("DELETE FROM amap_cache WHERE expires_at <= ?", (now,)).rowcount
+            total = self._conn.execute(
+                "SELECT COALESCE(SUM(LENGTH(value) + LENGTH(key)), 0) FROM amap_cache"
+            ).fetchone()[0]
+            evicted = 0
+            if total > self.max_bytes:
+                # 按最近访问时间从旧到新淘汰，直到降到上限的 90%，留出余量避免每轮都触发
+                target = total - int(self.max_bytes * 0.9)
+                evicted = self._conn.execute(
+                    "DELETE FROM amap_cache WHERE key IN ("
+                    " SELECT key FROM ("
+                    "  SELECT key, LENGTH(value) + LENGTH(key) AS size,"
+                    "   SUM(LENGTH(value) + LENGTH(key)) OVER (ORDER BY accessed_at, key) AS freed"
+                    "  FROM amap_cache)"
+                    " WHERE freed - size < ?)",
+                    (target,),
+                ).rowcount
+            self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            self.expirations += expired
+            self.evictions += evicted
+        if expired or evicted:
+            logger.info("持久化缓存整理: 过期 %d 条, 淘汰 %d 条", expired, evicted)
+        return {"expired": expired, "evicted": evicted}
+
+    # --- 异步接口 ---
+    async def get(self, key: str) -> Any:
+        try:
+            return await asyncio.to_thread(self._get, key)
+        except Exception as e:
+            logger.warning("持久化缓存读取失败: %s", e)
+            return MISSING
+
+    async def set(self, key: str, value: Any, ttl: float) -> None:
+        try:
+            await asyncio.to_thread(self._set, key, value, ttl)
+        except Exception as e:
+            logger.warning("持久化缓存写入失败: %s", e)
+
+    async def compact(self) -> Dict[str, int]:
+        return await asyncio.to_thread(self._compact)
+
+    async def run_compaction(self, interval: float) -> None:
+        """后台整理循环，由 lifespan 启动、关闭时取消"""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.compact()
+            except Exception as e:
+                logger.warning("持久化缓存整理失败: %s", e)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM amap_cache").fetchone()[0]
+        return {
+            "path": self.path,
+            "entries": entries,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "writes": self.writes,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
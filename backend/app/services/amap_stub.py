@@ -0,0 +1,340 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import os
+import random
+from contextlib import asynccontextmanager
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlsplit
+import httpx
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response
+from starlette.requests import ClientDisconnect
+from app.utils.geo import estimate_move, haversine_km
+from app.utils.query_plan import TYPE_CODES
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 不参与录制键的参数：Key/签名因人而异，output 只影响格式
+_IGNORED_PARAMS = frozenset({"key", "sig", "output", "callback"})
+
+QPS_EXCEEDED = {"status": "0", "info": "CUQPS_HAS_EXCEEDED_THE_LIMIT", "infocode": "10020"}
+
+
+def _family(path: str) -> str:
+    if "/geocode/" in path:
+        return "geocode"
+    if "/place/" in path:
+        return "place"
+    if "/direction/" in path:
+        return "direction"
+    return "other"
+
+
+def _endpoint(path: str) -> str:
+    """统一成不带版本前缀的接口路径，如 place/text、direction/walking"""
+    path = path.strip("/")
+    return path.split("/", 1)[1] if path.startswith("v3/") else path
+
+
+def _record_key(path: str, params: Dict[str, str]) -> str:
+    kept = sorted((k, v) for k, v in params.items() if k not in _IGNORED_PARAMS)
+    return f"{_endpoint(path)}?{json.dumps(kept, ensure_ascii=False)}"
+
+
+def _hash01(*parts: Any) -> float:
+    h = hashlib.md5("|".join(map(str, parts)).encode("utf-8")).hexdigest()
+    return int(h[:12], 16) / float(1 << 48)
+
+
+class LatencyModel:
+    """注入延迟的分布（毫秒）：
+    "0" 不注入；"fixed:20"；"uniform:10:50"；"lognormal:40:0.5"（中位数 40ms、对数标准差 0.5，长尾接近真实网络）
+    """
+
+    def __init__(self, spec: str = "0"):
+        self.spec = (spec or "0").strip()
+        kind, *args = self.spec.split(":")
+        self.kind = kind
+        self.args = [float(a) for a in args]
+        if kind not in ("0", "fixed", "uniform", "lognormal"):
+            raise ValueError(f"未知的延迟分布: {spec}")
+
+    def sample(self, rng: random.Random) -> float:
+        """返回秒"""
+        if self.kind == "fixed":
+            ms = self.args[0]
+        elif self.kind == "uniform":
+            ms = rng.uniform(self.args[0], self.args[1])
+        elif self.kind == "lognormal":
+            median, sigma = self.args[0], self.args[1] if len(self.args) > 1 else 0.5
+            ms = rng.lognormvariate(0.0, sigma) * median
+        else:
+            ms = 0.0
+        return ms / 1000.0
+
+
+class Recordings:
+    """录制的高德响应：JSONL 文件，每行 {"key", "endpoint", "params", "body"}，同一请求以最后一次录制为准"""
+
+    def __init__(self, path: str = ""):
+        self.path = path
+        self._bodies: Dict[str, Any] = {}
+        if path and os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        item = json.loads(line)
+                        self._bodies[item["key"]] = item["body"]
+            logger.info("已加载 %d 条高德录制响应: %s", len(self._bodies), path)
+
+    def __len__(self) -> int:
+        return len(self._bodies)
+
+    def get(self, path: str, params: Dict[str, str]) -> Optional[Any]:
+        return self._bodies.get(_record_key(path, params))
+
+    def add(self, path: str, params: Dict[str, str], body: Any) -> None:
+        key = _record_key(path, params)
+        self._bodies[key] = body
+        if self.path:
+            kept = {k: v for k, v in params.items() if k not in _IGNORED_PARAMS}
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps({"key": key, "endpoint": _endpoint(path), "params": kept, "body": body}, ensure_ascii=False) + "\n")
+
+
+# --- 没有录制时的合成响应：同样的请求总是得到同样的结果 ---
+
+def _city_center(city: str) -> Tuple[float, float]:
+    return round(104.0 + _hash01("lng", city) * 16.0, 6), round(24.0 + _hash01("lat", city) * 16.0, 6)
+
+
+def _synthetic_geocode(params: Dict[str, str]) -> Dict[str, Any]:
+    address = params.get("address", "")
+    city = params.get("city") or address
+    lng, lat = _city_center(city)
+    if address != city:
+        lng += (_hash01("dx", address) - 0.5) * 0.1
+        lat += (_hash01("dy", address) - 0.5) * 0.1
+    return {
+        "status": "1", "info": "OK", "infocode": "10000", "count": "1",
+        "geocodes": [{"formatted_address": address, "city": city, "location": f"{lng:.6f},{lat:.6f}"}],
+    }
+
+
+def _synthetic_pois(params: Dict[str, str], per_term: int = 60) -> Dict[str, Any]:
+    city = params.get("city", "")
+    terms = [t for t in (params.get("keywords") or "").split("|") if t]
+    if not terms:
+        # 分类查询：用分类编码对应的关键词起名
+        names = {code: kw for kw, code in reversed(list(TYPE_CODES.items()))}
+        terms = [names.get(t, t) for t in (params.get("types") or "").split("|") if t]
+    page = max(int(params.get("page", 1) or 1), 1)
+    offset = max(int(params.get("offset", 20) or 20), 1)
+    # 多个关键词的结果交替排列，和真实多关键词查询一样
+    ranked = [(term, i) for i in range(per_term) for term in terms]
+    lng0, lat0 = _city_center(city)
+    pois = []
+    for term, i in ranked[(page - 1) * offset:page * offset]:
+        pid = "B0" + hashlib.md5(f"{city}|{term}|{i}".encode("utf-8")).hexdigest()[:8].upper()
+        lng = lng0 + (_hash01("x", city, term, i) - 0.5) * 0.3
+        lat = lat0 + (_hash01("y", city, term, i) - 0.5) * 0.3
+        pois.append({
+            "id": pid,
+            "name": f"{city}{term}{i + 1}",
+            "type": f"风景名胜;{term}",
+            "location": f"{lng:.6f},{lat:.6f}",
+            "address": f"{city}{term}路{i + 1}号",
+            "tel": [],
+        })
+    return {"status": "1", "info": "OK", "infocode": "10000", "count": str(len(ranked)), "pois": pois}
+
+
+def _synthetic_route(path: str, params: Dict[str, str]) -> Dict[str, Any]:
+    try:
+        o = tuple(float(x) for x in params["origin"].split(","))
+        d = tuple(float(x) for x in params["destination"].split(","))
+    except (KeyError, ValueError):
+        return {"status": "0", "info": "INVALID_PARAMS", "infocode": "20000"}
+    mode = "transit" if "transit" in path else "drive" if "driving" in path else "walk"
+    est = estimate_move(haversine_km(o, d), mode)
+    # ±10% 的确定性扰动，避免和本地估算完全一样
+    factor = 0.9 + 0.2 * _hash01(path, params["origin"], params["destination"])
+    leg = {"distance": str(int(est["distance_km"] * 1000 * factor)), "duration": str(int(est["est_duration_min"] * 60 * factor))}
+    route = {"transits": [leg]} if mode == "transit" else {"paths": [leg]}
+    return {"status": "1", "info": "OK", "infocode": "10000", "route": route}
+
+
+def synthetic_response(path: str, params: Dict[str, str]) -> Dict[str, Any]:
+    family = _family(path)
+    if family == "geocode":
+        return _synthetic_geocode(params)
+    if family == "place":
+        return _synthetic_pois(params)
+    if family == "direction":
+        return _synthetic_route(path, params)
+    return {"status": "0", "info": "UNKNOWN_API", "infocode": "20003"}
+
+
+class AmapStub:
+    """本地高德桩：按 mode 返回录制的响应（replay）、只返回录制的响应（strict）或转发真实高德并录制（record）；
+    replay 模式下没有录制的请求返回确定性的合成数据。
+
+    每次 HTTP 请求（批量请求整体算一次）按延迟分布等待，并按比例注入错误：
+    error_rate 返回 HTTP 500，timeout_rate 挂起 hang_seconds 后返回 504，throttle_rate 返回高德的 QPS 超限 infocode。
+    """
+
+    def __init__(
+        self,
+        recordings: Recordings,
+        mode: str = "replay",
+        upstream: str = "https://restapi.amap.com/v3",
+        latency: Optional[Dict[str, LatencyModel]] = None,
+        error_rate: float = 0.0,
+        timeout_rate: float = 0.0,
+        throttle_rate: float = 0.0,
+        hang_seconds: float = 30.0,
+        seed: Optional[int] = None,
+        api_key: str = "",
+    ):
+        if mode not in ("replay", "strict", "record"):
+            raise ValueError(f"未知的桩模式: {mode}")
+        self.recordings = recordings
+        self.mode = mode
+        self.upstream = upstream.rstrip("/")
+        self.latency = latency or {}
+        self.error_rate = error_rate
+        self.timeout_rate = timeout_rate
+        self.throttle_rate = throttle_rate
+        self.hang_seconds = hang_seconds
+        self.api_key = api_key
+        self.rng = random.Random(seed)
+        self._http: Optional[httpx.AsyncClient] = None
+        self.requests: Dict[str, int] = {}
+        self.replayed = 0
+        self.synthesized = 0
+        self.recorded = 0
+        self.injected = {"error": 0, "timeout": 0, "throttle": 0}
+
+    def _latency(self, family: str) -> LatencyModel:
+        return self.latency.get(family) or self.latency.get("default") or LatencyModel("0")
+
+    async def _inject(self, family: str) -> Optional[Tuple[int, Any]]:
+        """等待注入的延迟；命中错误注入时返回 (HTTP 状态码, 响应体)"""
+        delay = self._latency(family).sample(self.rng)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        r = self.rng.random()
+        if r < self.timeout_rate:
+            self.injected["timeout"] += 1
+            await asyncio.sleep(self.hang_seconds)
+            return 504, {"status": "0", "info": "GATEWAY_TIMEOUT"}
+        r -= self.timeout_rate
+        if r < self.error_rate:
+            self.injected["error"] += 1
+            return 500, {"status": "0", "info": "SERVICE_UNAVAILABLE"}
+        r -= self.error_rate
+        if r < self.throttle_rate:
+            self.injected["throttle"] += 1
+            return 200, dict(QPS_EXCEEDED)
+        return None
+
+    async def _forward(self, path: str, params: Dict[str, str]) -> Any:
+        if self._http is None:
+            self._http = httpx.AsyncClient(timeout=10)
+        query = dict(params)
+        if self.api_key:
+            query["key"] = self.api_key
+        r = await self._http.get(f"{self.upstream}/{_endpoint(path)}", params=query)
+        r.raise_for_status()
+        return r.json()
+
+    async def respond(self, path: str, params: Dict[str, str]) -> Tuple[int, Any]:
+        """单个接口请求的响应体（不含延迟和错误注入）"""
+        body = self.recordings.get(path, params)
+        if body is not None:
+            self.replayed += 1
+            return 200, body
+        if self.mode == "strict":
+            return 404, {"status": "0", "info": "NO_RECORDING", "key": _record_key(path, params)}
+        if self.mode == "record":
+            body = await self._forward(path, params)
+            # 只录制成功的响应，错误不应该被回放
+            if isinstance(body, dict) and body.get("status") == "1":
+                self.recordings.add(path, params, body)
+                self.recorded += 1
+            return 200, body
+        self.synthesized += 1
+        return 200, synthetic_response(path, params)
+
+    async def handle(self, path: str, params: Dict[str, str]) -> Tuple[int, Any]:
+        family = _family(path)
+        self.requests[family] = self.requests.get(family, 0) + 1
+        injected = await self._inject(family)
+        if injected is not None:
+            return injected
+        return await self.respond(path, params)
+
+    async def handle_batch(self, ops: List[Dict[str, Any]]) -> Tuple[int, Any]:
+        self.requests["batch"] = self.requests.get("batch", 0) + 1
+        injected = await self._inject("batch")
+        if injected is not None:
+            return injected
+        out = []
+        for op in ops:
+            parts = urlsplit(op.get("url", ""))
+            status, body = await self.respond(parts.path, dict(parse_qsl(parts.query)))
+            out.append({"status": status, "body": body})
+        return 200, out
+
+    async def close(self) -> None:
+        if self._http is not None:
+            await self._http.aclose()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "mode": self.mode,
+            "recordings": len(self.recordings),
+            "requests": dict(self.requests),
+            "replayed": self.replayed,
+            "synthesized": self.synthesized,
+            "recorded": self.recorded,
+            "injected": dict(self.injected),
+        }
+
+
+def create_stub_app(stub: AmapStub) -> FastAPI:
+    """把 AmapStub 包装成与高德相同路径的 HTTP 服务：GET /v3/...、POST /v3/batch，GET /stub/stats 查看统计。
+    也可以不起端口，直接用 httpx.ASGITransport(app=...) 挂到 httpx.AsyncClient 上。"""
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        try:
+            yield
+        finally:
+            await stub.close()
+
+    app = FastAPI(title="Amap Stub", lifespan=lifespan)
+
+    @app.get("/stub/stats")
+    async def stats():
+        return stub.stats()
+
+    @app.post("/v3/batch")
+    async def batch(request: Request):
+        try:
+            body = await request.json()
+        except ClientDisconnect:
+            # 客户端超时/对冲取消了请求
+            return Response(status_code=499)
+        status, data = await stub.handle_batch(body.get("ops", []))
+        return JSONResponse(data, status_code=status)
+
+    @app.get("/v3/{path:path}")
+    async def api(path: str, request: Request):
+        status, data = await stub.handle(f"/v3/{path}", dict(request.query_params))
+        return JSONResponse(data, status_code=status)
+
+    return app
@@ -1,14 +1,77 @@
 from __future__ import annotations
 
+import asyncio
+import time
 import httpx
-from typing import Dict, Any, List, Optional, Tuple
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Awaitable, Dict, Any, Iterator, List, Optional, Tuple, Union
+from urllib.parse import urlencode, urlsplit
 from app.core import config
+from app.core.logging_config import debug_sampled
+from app.services import metrics
+from app.services.rate_limit import RateLimiter, SharedTokenBucket, TokenBucket
+from app.services.resilience import Resilience
+from app.utils.poi import Poi, make_poi
 import logging
 
 # 设置日志
 logger = logging.getLogger(__name__)
 
-AMAP_BASE = "https://restapi.amap.com/v3"
+AMAP_BASE = config.AMAP_BASE
+
+_upstream_calls: ContextVar[Optional[Dict[str, int]]] = ContextVar("amap_upstream_calls", default=None)
+
+
+@contextmanager
+def track_upstream() -> Iterator[Dict[str, int]]:
+    """统计当前上下文（及其中创建的 Task）实际发往高德的请求：
+    各接口族的子请求数（geocode / place / direction，含重试和对冲），以及 HTTP 往返次数 round_trips"""
+    counts: Dict[str, int] = {"round_trips": 0}
+    token = _upstream_calls.set(counts)
+    try:
+        yield counts
+    finally:
+        try:
+            _upstream_calls.reset(token)
+        except ValueError:
+            # 在异步生成器里使用时，生成器可能在另一个上下文中被关闭，此时无需复原
+            pass
+
+
+def _count_upstream(families: List[str]) -> None:
+    counts = _upstream_calls.get()
+    if counts is None:
+        return
+    counts["round_trips"] += 1
+    for f in families:
+        counts[f] = counts.get(f, 0) + 1
+
+
+async def _instrumented(family: str, request: Awaitable[httpx.Response]) -> httpx.Response:
+    """等待一次高德 HTTP 请求，记录耗时和状态（HTTP 状态码或 timeout / cancelled / error）"""
+    start = time.perf_counter()
+    status = "error"
+    try:
+        r = await request
+        status = str(r.status_code)
+        return r
+    except httpx.TimeoutException:
+        status = "timeout"
+        raise
+    except asyncio.CancelledError:
+        # 对冲落败或单次超时被取消
+        status = "cancelled"
+        raise
+    finally:
+        metrics.UPSTREAM_SECONDS.observe(time.perf_counter() - start, family=family)
+        metrics.UPSTREAM_REQUESTS.inc(family=family, status=status)
+
+
+def _record_amap_error(family: str, data: Any) -> None:
+    if isinstance(data, dict) and data.get("status") != "1":
+        metrics.UPSTREAM_ERRORS.inc(family=family, infocode=str(data.get("infocode") or "unknown"))
+
 
 def _parse_lnglat(s: str) -> Optional[Tuple[float, float]]:
     try:
@@ -17,102 +80,172 @@ def _parse_lnglat(s: str) -> Optional[Tuple[float, float]]:
     except Exception:
         return None
 
+class _Failed:
+    """请求失败（超时、熔断、配额用尽、高德返回错误）的结果标记，用来和“高德确实没有结果”区分开：
+    后者可以当作负结果缓存，前者不能。为假值，按空结果处理的调用方不受影响。"""
+    __slots__ = ()
+
+    def __bool__(self) -> bool:
+        return False
+
+    def __repr__(self) -> str:
+        return "FAILED"
+
+
+FAILED = _Failed()
+
+
+def _or_empty(value: Any, empty: Any, strict: bool) -> Any:
+    """strict 时原样返回（失败为 FAILED），否则失败按空结果返回"""
+    return empty if value is FAILED and not strict else value
+
+# --- 请求构造 / 响应解析（同步与异步客户端共用） ---
+
+def _geocode_request(api_key: str, address: str, city: Optional[str]) -> Tuple[str, Dict[str, Any]]:
+    params = {"key": api_key, "address": address}
+    if city:
+        params["city"] = city
+    return f"{AMAP_BASE}/geocode/geo", params
+
+def _parse_geocode(data: Dict[str, Any], address: str) -> Union[Optional[Tuple[float, float]], _Failed]:
+    if data.get("status") != "1":
+        logger.warning("地理编码失败: %s", data.get("info", "未知错误"))
+        return FAILED
+    if int(data.get("count", "0")) < 1:
+        logger.warning("地理编码未找到: %s", address)
+        return None
+
+    loc = data["geocodes"][0].get("location")
+    result = _parse_lnglat(loc) if loc else None
+    debug_sampled(logger, "amap", "地理编码成功: %s -> %s", address, result)
+    return result
+
+def _search_poi_request(api_key: str, city: str, keywords: str, page: int, offset: int, extensions: str, types: str = "") -> Tuple[str, Dict[str, Any]]:
+    # keywords / types 都可以用“|”连接多个值，至少给一个
+    params = {
+        "key": api_key,
+        "city": city,
+        "keywords": keywords,
+        "page": page,
+        "offset": offset,
+        "extensions": extensions
+    }
+    if types:
+        params["types"] = types
+        if not keywords:
+            # 只按分类查询时限定在本城市，否则会返回周边城市的结果
+            del params["keywords"]
+            params["citylimit"] = "true"
+    return f"{AMAP_BASE}/place/text", params
+
+def _parse_pois(data: Dict[str, Any], keywords: str) -> Union[List[Poi], _Failed]:
+    if data.get("status") != "1":
+        logger.warning("POI搜索失败: %s", data.get("info", "未知错误"))
+        return FAILED
+
+    pois: List[Poi] = []
+    raw_pois = data.get("pois", [])
+
+    for p in raw_pois:
+        loc = _parse_lnglat(p.get("location", ""))
+        if not loc:
+            debug_sampled(logger, "amap", "POI '%s' 位置信息无效: %s", p.get("name"), p.get("location"))
+            continue
+
+        pois.append(make_poi(p.get("id"), p.get("name"), p.get("type"), loc[0], loc[1],
+                             p.get("address"), p.get("tel"), p.get("distance"), p.get("rating")))
+
+    debug_sampled(logger, "amap", "POI搜索成功: 关键词'%s'找到%d个有效POI（原始%d个）", keywords, len(pois), len(raw_pois))
+    return pois
+
+def _route_request(api_key: str, origin: Tuple[float, float], destination: Tuple[float, float], mode: str, city: Optional[str]) -> Tuple[str, Dict[str, Any]]:
+    o = f"{origin[0]},{origin[1]}"
+    d = f"{destination[0]},{destination[1]}"
+    if mode == "drive":
+        url = f"{AMAP_BASE}/direction/driving"
+        params = {"origin": o, "destination": d, "key": api_key}
+    elif mode == "transit":
+        url = f"{AMAP_BASE}/direction/transit/integrated"
+        params = {"origin": o, "destination": d, "key": api_key}
+        if city:
+            params["city"] = city
+    else:
+        url = f"{AMAP_BASE}/direction/walking"
+        params = {"origin": o, "destination": d, "key": api_key}
+    return url, params
+
+def _parse_route(data: Dict[str, Any], mode: str) -> Union[Optional[Dict[str, Any]], _Failed]:
+    if data.get("status") != "1":
+        logger.warning("路径规划失败: %s", data.get("info", "未知错误"))
+        return FAILED
+
+    route = data.get("route") or {}
+
+    if mode == "transit" and route.get("transits"):
+        t = route["transits"][0]
+        dist_m = float(t.get("distance", "0") or 0)
+        dur_s = float(t.get("duration", "0") or 0)
+    else:
+        paths = route.get("paths") or []
+        if not paths:
+            logger.warning("路径规划未找到有效路径")
+            return None
+        p0 = paths[0]
+        dist_m = float(p0.get("distance", "0") or 0)
+        dur_s = float(p0.get("duration", "0") or 0)
+
+    result = {
+        "mode": mode,
+        "distance_km": round(dist_m/1000.0, 2),
+        "est_duration_min": int(round(dur_s/60.0))
+    }
+    debug_sampled(logger, "amap", "路径规划成功: %s km, %s 分钟", result["distance_km"], result["est_duration_min"])
+    return result
+
 class AmapClient:
     """Minimal Amap REST client.
     默认使用高德 Web Service；如你部署了 MCP server，可在此类中扩展优先走 MCP 的分支。
+    同步版本，供脚本/调试使用（search_poi 返回字典）；服务端请求链路使用 AsyncAmapClient（返回 Poi）。
     """
 
     def __init__(self, api_key: Optional[str] = None, timeout: int = None):
         self.api_key = api_key or config.GAODE_API_KEY
         self.timeout = timeout or config.REQUEST_TIMEOUT_SECONDS
         self.http = httpx.Client(timeout=self.timeout)
-        
+
         if not self.api_key:
             logger.error("高德地图API密钥未设置！请在.env文件中设置GAODE_API_KEY")
         else:
-            logger.info(f"高德地图客户端初始化完成，API密钥: {self.api_key[:8]}...")
+            logger.info("高德地图客户端初始化完成，API密钥: %s...", self.api_key[:8])
 
     # --- Geocoding ---
     def geocode(self, address: str, city: Optional[str] = None) -> Optional[Tuple[float, float]]:
         if not self.api_key:
             logger.error("API密钥未设置，无法进行地理编码")
             return None
-            
-        params = {"key": self.api_key, "address": address}
-        if city:
-            params["city"] = city
-            
+
+        url, params = _geocode_request(self.api_key, address, city)
         try:
-            logger.info(f"地理编码请求: {address}, 城市: {city}")
-            r = self.http.get(f"{AMAP_BASE}/geocode/geo", params=params)
-            data = r.json()
-            logger.info(f"地理编码响应状态: {data.get('status')}, 结果数: {data.get('count')}")
-            
-            if data.get("status") != "1" or int(data.get("count", "0")) < 1:
-                logger.warning(f"地理编码失败: {data.get('info', '未知错误')}")
-                return None
-                
-            loc = data["geocodes"][0].get("location")
-            result = _parse_lnglat(loc) if loc else None
-            logger.info(f"地理编码成功: {address} -> {result}")
-            return result
-            
+            debug_sampled(logger, "amap", "地理编码请求: %s, 城市: %s", address, city)
+            r = self.http.get(url, params=params)
+            return _or_empty(_parse_geocode(r.json(), address), None, False)
         except Exception as e:
-            logger.error(f"地理编码请求异常: {e}")
+            logger.error("地理编码请求异常: %s", e)
             return None
 
     # --- POI search ---
-    def search_poi(self, city: str, keywords: str, page: int = 1, offset: int = 10, extensions: str = "base") -> List[Dict[str, Any]]:
+    def search_poi(self, city: str, keywords: str, page: int = 1, offset: int = 10, extensions: str = "base", types: str = "") -> List[Dict[str, Any]]:
         if not self.api_key:
             logger.error("API密钥未设置，无法进行POI搜索")
             return []
-            
-        params = {
-            "key": self.api_key, 
-            "city": city, 
-            "keywords": keywords, 
-            "page": page, 
-            "offset": offset, 
-            "extensions": extensions
-        }
-        
+
+        url, params = _search_poi_request(self.api_key, city, keywords, page, offset, extensions, types)
         try:
-            logger.info(f"POI搜索请求: 城市={city}, 关键词={keywords}, 页码={page}, 数量={offset}")
-            r = self.http.get(f"{AMAP_BASE}/place/text", params=params)
-            data = r.json()
-            logger.info(f"POI搜索响应状态: {data.get('status')}, 结果数: {data.get('count')}")
-            
-            if data.get("status") != "1":
-                logger.warning(f"POI搜索失败: {data.get('info', '未知错误')}")
-                return []
-                
-            pois = []
-            raw_pois = data.get("pois", [])
-            logger.info(f"原始POI数据: {len(raw_pois)}个")
-            
-            for p in raw_pois:
-                loc = _parse_lnglat(p.get("location", ""))
-                if not loc:
-                    logger.warning(f"POI '{p.get('name')}' 位置信息无效: {p.get('location')}")
-                    continue
-                    
-                poi_data = {
-                    "id": p.get("id"), 
-                    "name": p.get("name"), 
-                    "category": p.get("type"), 
-                    "location": [loc[0], loc[1]], 
-                    "address": p.get("address"),
-                    "tel": p.get("tel"),
-                    "distance": p.get("distance"),
-                    "rating": p.get("rating")
-                }
-                pois.append(poi_data)
-                
-            logger.info(f"POI搜索成功: 关键词'{keywords}'找到{len(pois)}个有效POI")
-            return pois
-            
+            debug_sampled(logger, "amap", "POI搜索请求: 城市=%s, 关键词=%s, 分类=%s, 页码=%s, 数量=%s", city, keywords, types, page, offset)
+            r = self.http.get(url, params=params)
+            return [p.to_dict() for p in _or_empty(_parse_pois(r.json(), keywords or types), [], False)]
         except Exception as e:
-            logger.error(f"POI搜索请求异常: {e}")
+            logger.error("POI搜索请求异常: %s", e)
             return []
 
     # --- Routing ---
@@ -120,60 +253,236 @@ class AmapClient:
         if not self.api_key:
             logger.error("API密钥未设置，无法进行路径规划")
             return None
-            
-        o = f"{origin[0]},{origin[1]}"
-        d = f"{destination[0]},{destination[1]}"
-        
+
+        url, params = _route_request(self.api_key, origin, destination, mode, city)
         try:
-            if mode == "drive":
-                url = f"{AMAP_BASE}/direction/driving"
-                params = {"origin": o, "destination": d, "key": self.api_key}
-            elif mode == "transit":
-                url = f"{AMAP_BASE}/direction/transit/integrated"
-                params = {"origin": o, "destination": d, "key": self.api_key}
-                if city:
-                    params["city"] = city
-            else:
-                url = f"{AMAP_BASE}/direction/walking"
-                params = {"origin": o, "destination": d, "key": self.api_key}
-                
-            logger.info(f"路径规划请求: {mode}模式, 从{origin}到{destination}")
+            debug_sampled(logger, "amap", "路径规划请求: %s模式, 从%s到%s", mode, origin, destination)
             r = self.http.get(url, params=params)
-            data = r.json()
-            logger.info(f"路径规划响应状态: {data.get('status')}")
-            
-            if data.get("status") != "1":
-                logger.warning(f"路径规划失败: {data.get('info', '未知错误')}")
-                return None
-                
-            route = data.get("route") or {}
-            
-            if mode == "transit" and route.get("transits"):
-                t = route["transits"][0]
-                dist_m = float(t.get("distance", "0") or 0)
-                dur_s = float(t.get("duration", "0") or 0)
-            else:
-                paths = route.get("paths") or []
-                if not paths:
-                    logger.warning("路径规划未找到有效路径")
-                    return None
-                p0 = paths[0]
-                dist_m = float(p0.get("distance", "0") or 0)
-                dur_s = float(p0.get("duration", "0") or 0)
-                
-            result = {
-                "mode": mode, 
-                "distance_km": round(dist_m/1000.0, 2), 
-                "est_duration_min": int(round(dur_s/60.0))
-            }
-            logger.info(f"路径规划成功: {result}")
-            return result
-            
+            return _or_empty(_parse_route(r.json(), mode), None, False)
         except Exception as e:
-            logger.error(f"路径规划请求异常: {e}")
+            logger.error("路径规划请求异常: %s", e)
             return None
 
+    def close(self):
+        self.http.close()
+
     def __del__(self):
         """清理HTTP客户端"""
         if hasattr(self, 'http'):
             self.http.close()
+
+
+def create_http_client() -> httpx.AsyncClient:
+    """创建进程级共享的 httpx.AsyncClient（连接池 + keep-alive），由 FastAPI lifespan 负责开启/关闭。"""
+    limits = httpx.Limits(
+        max_connections=config.AMAP_MAX_CONNECTIONS,
+        max_keepalive_connections=config.AMAP_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=config.AMAP_KEEPALIVE_EXPIRY_SECONDS,
+    )
+    return httpx.AsyncClient(timeout=config.REQUEST_TIMEOUT_SECONDS, limits=limits)
+
+
+def create_resilience() -> Optional[Resilience]:
+    """按配置创建高德调用的容错策略（AMAP_RESILIENCE_ENABLED=0 时返回 None，保持单次请求）"""
+    if not config.AMAP_RESILIENCE_ENABLED:
+        return None
+    return Resilience(
+        attempt_timeout=config.AMAP_ATTEMPT_TIMEOUT_SECONDS,
+        max_retries=config.AMAP_MAX_RETRIES,
+        backoff=config.AMAP_RETRY_BACKOFF_MS / 1000,
+        hedge=config.AMAP_HEDGE_ENABLED,
+        hedge_quantile=config.AMAP_HEDGE_QUANTILE,
+        hedge_min=config.AMAP_HEDGE_MIN_MS / 1000,
+        breaker_failures=config.AMAP_BREAKER_FAILURES,
+        breaker_cooldown=config.AMAP_BREAKER_COOLDOWN_SECONDS,
+    )
+
+
+def create_rate_limiter(state: Optional[Any] = None) -> Optional[RateLimiter]:
+    """按配置创建各接口族的令牌桶（AMAP_RATE_LIMIT_ENABLED=0 时返回 None）；
+    传入 SharedState 时令牌和当天用量由所有 worker 共用"""
+    if not config.AMAP_RATE_LIMIT_ENABLED:
+        return None
+    families = {
+        "geocode": (config.AMAP_QPS_GEOCODE, config.AMAP_DAILY_LIMIT_GEOCODE),
+        "place": (config.AMAP_QPS_POI, config.AMAP_DAILY_LIMIT_POI),
+        "direction": (config.AMAP_QPS_ROUTE, config.AMAP_DAILY_LIMIT_ROUTE),
+    }
+    return RateLimiter({
+        name: (
+            SharedTokenBucket(name, rate=qps, burst=qps * config.AMAP_RATE_BURST_SECONDS, state=state, daily_limit=daily)
+            if state is not None else
+            TokenBucket(name, rate=qps, burst=qps * config.AMAP_RATE_BURST_SECONDS, daily_limit=daily)
+        )
+        for name, (qps, daily) in families.items()
+        if qps > 0
+    })
+
+
+class AsyncAmapClient:
+    """AmapClient 的 asyncio 版本。
+    不持有自己的连接：复用外部传入的共享 httpx.AsyncClient，因此可以按进程只创建一次。
+    """
+
+    def __init__(self, http: httpx.AsyncClient, api_key: Optional[str] = None, limiter: Optional[RateLimiter] = None, resilience: Optional[Resilience] = None):
+        self.api_key = api_key or config.GAODE_API_KEY
+        self.http = http
+        self.limiter = limiter
+        self.resilience = resilience
+
+        if not self.api_key:
+            logger.error("高德地图API密钥未设置！请在.env文件中设置GAODE_API_KEY")
+
+    async def _get(self, family: str, url: str, params: Dict[str, Any]) -> Dict[str, Any]:
+        """按接口族限速后发请求，经容错层重试/对冲/熔断。
+
+        日配额用尽（QuotaExhausted）、熔断（CircuitOpenError）或重试耗尽时抛异常，由各方法按失败处理，走缓存/估算。
+        """
+        async def send() -> Dict[str, Any]:
+            _count_upstream([family])
+            r = await _instrumented(family, self.http.get(url, params=params))
+            r.raise_for_status()
+            data = r.json()
+            _record_amap_error(family, data)
+            if self.limiter:
+                self.limiter.feedback(family, data)
+            return data
+
+        acquire = (lambda: self.limiter.acquire(family)) if self.limiter else None
+        if self.resilience:
+            try_acquire = (lambda: self.limiter.try_acquire(family)) if self.limiter else None
+            return await self.resilience.call(family, send, acquire, try_acquire)
+        if acquire:
+            await acquire()
+        return await send()
+
+    # --- Batch ---
+    async def _batch_chunk(self, ops: List[Tuple[str, str, Dict[str, Any]]]) -> List[Optional[Dict[str, Any]]]:
+        """一次 /batch 请求：ops 为 (接口族, url, params)，返回与 ops 对应的子请求响应体"""
+        body = {"ops": [{"url": f"{urlsplit(url).path}?{urlencode(params)}"} for _, url, params in ops]}
+
+        async def send() -> List[Optional[Dict[str, Any]]]:
+            _count_upstream([family for family, _, _ in ops])
+            r = await _instrumented("batch", self.http.post(f"{AMAP_BASE}/batch", params={"key": self.api_key}, json=body))
+            r.raise_for_status()
+            data = r.json()
+            if not isinstance(data, list) or len(data) != len(ops):
+                raise ValueError(f"批量接口返回格式异常: {str(data)[:200]}")
+            out = []
+            for (family, _, _), item in zip(ops, data):
+                sub = item.get("body") if isinstance(item, dict) and str(item.get("status")) == "200" else None
+                _record_amap_error(family, sub)
+                if self.limiter and isinstance(sub, dict):
+                    self.limiter.feedback(family, sub)
+                out.append(sub)
+            return out
+
+        async def acquire() -> None:
+            # 每个子请求都计入各自接口的配额
+            if self.limiter:
+                for family, _, _ in ops:
+                    await self.limiter.acquire(family)
+
+        if self.resilience:
+            try_acquire = (lambda: self.limiter.try_acquire_all([family for family, _, _ in ops])) if self.limiter else None
+            return await self.resilience.call("batch", send, acquire, try_acquire)
+        await acquire()
+        return await send()
+
+    async def _batch(self, ops: List[Tuple[str, str, Dict[str, Any]]]) -> List[Optional[Dict[str, Any]]]:
+        """把多个子请求按 AMAP_BATCH_MAX_OPS 分批合并发送（各批并发）；
+        某一批整体失败（如 Key 未开通批量接口）时，该批退回逐个请求。失败的子请求返回 None。"""
+        size = max(1, config.AMAP_BATCH_MAX_OPS)
+        chunks = [ops[i:i + size] for i in range(0, len(ops), size)]
+
+        async def run(chunk: List[Tuple[str, str, Dict[str, Any]]]) -> List[Optional[Dict[str, Any]]]:
+            try:
+                return await self._batch_chunk(chunk)
+            except Exception as e:
+                logger.warning("批量请求失败，改为逐个请求(%d个): %s", len(chunk), e)
+
+            async def single(family: str, url: str, params: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+                try:
+                    return await self._get(family, url, params)
+                except Exception as e:
+                    logger.error("%s 请求异常: %s", family, e)
+                    return None
+
+            return list(await asyncio.gather(*(single(*op) for op in chunk)))
+
+        results: List[Optional[Dict[str, Any]]] = []
+        for part in await asyncio.gather(*(run(c) for c in chunks)):
+            results.extend(part)
+        debug_sampled(logger, "amap", "批量请求: %d个子请求, %d次往返", len(ops), len(chunks))
+        return results
+
+    # 各方法默认失败时返回空结果（None / []）；strict=True 时返回 FAILED（返回类型中的 _Failed），供缓存层区分失败和确实没有结果
+
+    # --- Geocoding ---
+    async def geocode(self, address: str, city: Optional[str] = None, strict: bool = False) -> Union[Optional[Tuple[float, float]], _Failed]:
+        if not self.api_key:
+            logger.error("API密钥未设置，无法进行地理编码")
+            return _or_empty(FAILED, None, strict)
+
+        url, params = _geocode_request(self.api_key, address, city)
+        try:
+            debug_sampled(logger, "amap", "地理编码请求: %s, 城市: %s", address, city)
+            result = _parse_geocode(await self._get("geocode", url, params), address)
+        except Exception as e:
+            logger.error("地理编码请求异常: %s", e)
+            result = FAILED
+        return _or_empty(result, None, strict)
+
+    async def geocode_many(self, queries: List[Tuple[str, Optional[str]]], strict: bool = False) -> List[Union[Optional[Tuple[float, float]], _Failed]]:
+        """批量地理编码，queries 为 (地址, 城市)，结果与 geocode 一致、与 queries 一一对应"""
+        if not self.api_key or not queries:
+            return [_or_empty(FAILED, None, strict) for _ in queries]
+        ops = [("geocode", *_geocode_request(self.api_key, address, city)) for address, city in queries]
+        bodies = await self._batch(ops)
+        return [_or_empty(_parse_geocode(b, address) if b else FAILED, None, strict) for b, (address, _) in zip(bodies, queries)]
+
+    # --- POI search ---
+    async def search_poi(self, city: str, keywords: str, page: int = 1, offset: int = 10, extensions: str = "base", types: str = "", strict: bool = False) -> Union[List[Poi], _Failed]:
+        if not self.api_key:
+            logger.error("API密钥未设置，无法进行POI搜索")
+            return _or_empty(FAILED, [], strict)
+
+        url, params = _search_poi_request(self.api_key, city, keywords, page, offset, extensions, types)
+        try:
+            debug_sampled(logger, "amap", "POI搜索请求: 城市=%s, 关键词=%s, 分类=%s, 页码=%s, 数量=%s", city, keywords, types, page, offset)
+            result = _parse_pois(await self._get("place", url, params), keywords or types)
+        except Exception as e:
+            logger.error("POI搜索请求异常: %s", e)
+            result = FAILED
+        return _or_empty(result, [], strict)
+
+    async def search_poi_many(self, city: str, queries: List[Tuple[str, int, int, str]], extensions: str = "base", strict: bool = False) -> List[Union[List[Poi], _Failed]]:
+        """批量 POI 搜索，queries 为 (关键词, 页码, 每页数量, 分类编码)，结果与 search_poi 一致、与 queries 一一对应"""
+        if not self.api_key or not queries:
+            return [_or_empty(FAILED, [], strict) for _ in queries]
+        ops = [("place", *_search_poi_request(self.api_key, city, kw, page, offset, extensions, types)) for kw, page, offset, types in queries]
+        bodies = await self._batch(ops)
+        return [_or_empty(_parse_pois(b, kw or types) if b else FAILED, [], strict) for b, (kw, _, _, types) in zip(bodies, queries)]
+
+    # --- Routing ---
+    async def route_time(self, origin: Tuple[float, float], destination: Tuple[float, float], mode: str = "walk", city: Optional[str] = None, strict: bool = False) -> Union[Optional[Dict[str, Any]], _Failed]:
+        if not self.api_key:
+            logger.error("API密钥未设置，无法进行路径规划")
+            return _or_empty(FAILED, None, strict)
+
+        url, params = _route_request(self.api_key, origin, destination, mode, city)
+        try:
+            debug_sampled(logger, "amap", "路径规划请求: %s模式, 从%s到%s", mode, origin, destination)
+            result = _parse_route(await self._get("direction", url, params), mode)
+        except Exception as e:
+            logger.error("路径规划请求异常: %s", e)
+            result = FAILED
+        return _or_empty(result, None, strict)
+
+    async def route_time_many(self, legs: List[Tuple[Tuple[float, float], Tuple[float, float]]], mode: str = "walk", city: Optional[str] = None, strict: bool = False) -> List[Union[Optional[Dict[str, Any]], _Failed]]:
+        """批量路径规划，legs 为 (起点, 终点)，结果与 route_time 一致、与 legs 一一对应"""
+        if not self.api_key or not legs:
+            return [_or_empty(FAILED, None, strict) for _ in legs]
+        ops = [("direction", *_route_request(self.api_key, o, d, mode, city)) for o, d in legs]
+        bodies = await self._batch(ops)
+        return [_or_empty(_parse_route(b, mode) if b else FAILED, None, strict) for b in bodies]
@@ -0,0 +1,182 @@
+from __future__ import annotations
+
+import bisect
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+# 进程内的 Prometheus 指标，/metrics 按文本格式（0.0.4）输出。
+# 多 worker 部署时每个进程各自一份，由 Prometheus 按实例分别抓取。
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# 每份行程的上游请求数
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _num(v: float) -> str:
+    if v == float("inf"):
+        return "+Inf"
+    return repr(float(v)) if not float(v).is_integer() else str(int(v))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(n, "")) for n in self.labelnames)
+
+    def lines(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"] + self.samples()
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, help, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0.0) + amount
+
+    def set(self, value: float, **labels: str) -> None:
+        """镜像已有的累计计数（如缓存统计），抓取时直接设为当前值"""
+        self._values[self._key(labels)] = float(value)
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def samples(self) -> List[str]:
+        return [f"{self.name}{_labels(self.labelnames, k)} {_num(v)}" for k, v in sorted(self._values.items())]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[Tuple[str, ...], List[float]] = {}  # 各桶计数（非累计）+ [总和, 总数]
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        s = self._series.get(key)
+        if s is None:
+            s = self._series[key] = [0.0] * (len(self.buckets) + 2)
+        i = bisect.bisect_left(self.buckets, value)
+        if i < len(self.buckets):
+            s[i] += 1
+        s[-2] += value
+        s[-1] += 1
+
+    def count(self, **labels: str) -> int:
+        s = self._series.get(self._key(labels))
+        return int(s[-1]) if s else 0
+
+    def samples(self) -> List[str]:
+        out = []
+        for key, s in sorted(self._series.items()):
+            acc = 0.0
+            for bound, n in zip(self.buckets, s):
+                acc += n
+                le = 'le="%s"' % _num(bound)
+                out.append(f"{self.name}_bucket{_labels(self.labelnames, key, le)} {_num(acc)}")
+            inf = _labels(self.labelnames, key, 'le="+Inf"')
+            out.append(f"{self.name}_bucket{inf} {_num(s[-1])}")
+            labels = _labels(self.labelnames, key)
+            out.append(f"{self.name}_sum{labels} {_num(s[-2])}")
+            out.append(f"{self.name}_count{labels} {_num(s[-1])}")
+        return out
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"指标重复注册: {metric.name}")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for m in self._metrics.values():
+            lines.extend(m.lines())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+# --- 行程流水线 ---
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    "plan_stage_seconds", "行程流水线各阶段耗时（geocode / collect / order / routing / shaping / serialization）", ["stage"]))
+PLAN_UPSTREAM_CALLS = REGISTRY.register(Histogram(
+    "plan_upstream_calls", "每份行程实际发往高德的子请求数（按接口族，round_trips 为 HTTP 往返数）", ["family"], COUNT_BUCKETS))
+PLANS = REGISTRY.register(Counter("plans_total", "生成的行程数（按是否搜到景点）", ["result"]))
+
+# --- 高德上游 ---
+UPSTREAM_SECONDS = REGISTRY.register(Histogram(
+    "amap_upstream_seconds", "单次高德 HTTP 请求耗时（batch 为整个批量请求）", ["family"]))
+UPSTREAM_REQUESTS = REGISTRY.register(Counter(
+    "amap_upstream_requests_total", "高德 HTTP 请求数，status 为 HTTP 状态码或 timeout / cancelled / error", ["family", "status"]))
+UPSTREAM_ERRORS = REGISTRY.register(Counter(
+    "amap_upstream_errors_total", "高德返回 status!=1 的响应数（按 infocode）", ["family", "infocode"]))
+
+# --- 缓存（抓取时从各组件的统计同步） ---
+CACHE_LOOKUPS = REGISTRY.register(Counter(
+    "amap_cache_lookups_total", "高德接口缓存查询数，result 为 hit / negative_hit / store_hit / miss", ["endpoint", "result"]))
+CACHE_HIT_RATIO = REGISTRY.register(Gauge("amap_cache_hit_ratio", "高德接口缓存命中率", ["endpoint"]))
+PLAN_CACHE_LOOKUPS = REGISTRY.register(Counter(
+    "plan_cache_lookups_total", "整份行程缓存查询数，result 为 hit / stale / miss", ["result"]))
+PLAN_CACHE_HIT_RATIO = REGISTRY.register(Gauge("plan_cache_hit_ratio", "整份行程缓存命中率（含 stale）"))
+
+
+def observe_plan(debug_info: Dict[str, object]) -> None:
+    """记录一份完整行程的各阶段耗时和上游请求数"""
+    for stage, t in (debug_info.get("timings_ms") or {}).items():
+        STAGE_SECONDS.observe(t["wall_ms"] / 1000.0, stage=stage)
+    for family, n in (debug_info.get("upstream") or {}).items():
+        PLAN_UPSTREAM_CALLS.observe(n, family=family)
+    PLANS.inc(result="ok" if debug_info.get("search_success") else "empty")
+
+
+def sync_cache_stats(amap_stats: Optional[Dict[str, Dict[str, object]]], plan_stats: Optional[Dict[str, object]]) -> None:
+    for endpoint in ("geocode", "place_text", "direction"):
+        s = (amap_stats or {}).get(endpoint)
+        if not s:
+            continue
+        for field, result in (("hits", "hit"), ("negative_hits", "negative_hit"), ("store_hits", "store_hit"), ("misses", "miss")):
+            CACHE_LOOKUPS.set(s[field], endpoint=endpoint, result=result)
+        CACHE_HIT_RATIO.set(s["hit_ratio"], endpoint=endpoint)
+    if plan_stats:
+        for field, result in (("hits", "hit"), ("stale_hits", "stale"), ("misses", "miss")):
+            PLAN_CACHE_LOOKUPS.set(plan_stats[field], result=result)
+        PLAN_CACHE_HIT_RATIO.set(plan_stats["hit_ratio"])
+
+
+def server_timing(timings: Iterable[Tuple[str, float]]) -> str:
+    """Server-Timing 响应头：name;dur=毫秒"""
+    return ", ".join(f"{name};dur={ms:.1f}" for name, ms in timings)
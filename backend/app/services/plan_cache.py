@@ -0,0 +1,141 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Set, Tuple
+from cachetools import LRUCache, TTLCache
+from app.services.rate_limit import background_priority
+from app.services.singleflight import SingleFlight
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def plan_cache_key(city: str, days: int, interests: Optional[list], starting_point: Optional[str]) -> Tuple:
+    """规范化的行程请求键：兴趣去重排序、字符串去空白；start_date 不参与（命中后再套日期），
+    pace 目前不影响规划结果，也不参与。"""
+    return (
+        (city or "").strip(),
+        int(days),
+        tuple(sorted({(i or "").strip() for i in interests or [] if (i or "").strip()})),
+        (starting_point or "").strip(),
+    )
+
+
+class PlanCache:
+    """整份行程的缓存，带 stale-while-revalidate。
+
+    条目在 soft_ttl 内直接返回；超过 soft_ttl、未到 ttl 时仍返回旧结果，同时在后台重新规划一次；
+    超过 ttl 视为未命中。同一 key 的并发未命中只规划一次。
+    body_maxsize > 0 时另外按 (key, 变体) 保存已编码好的响应体（如不同出发日期的 kmTravel JSON），
+    只在对应的行程对象仍是当前缓存条目时有效，行程刷新后自动失效。
+    """
+
+    def __init__(self, maxsize: int, ttl: float, soft_ttl: float, body_maxsize: int = 0):
+        self.soft_ttl = soft_ttl
+        self._entries: TTLCache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._bodies: Optional[LRUCache] = LRUCache(maxsize=body_maxsize) if body_maxsize > 0 else None
+        self.body_hits = 0
+        self._flight = SingleFlight()
+        self._refreshing: Set[Hashable] = set()
+        self._tasks: Set[asyncio.Task] = set()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.refresh_errors = 0
+
+    async def get_or_build(self, key: Hashable, build: Callable[[], Awaitable[Dict[str, Any]]]) -> Tuple[Dict[str, Any], str]:
+        """返回 (行程, 状态)，状态为 hit / stale / miss"""
+        found = self.peek(key, build)
+        if found is not None:
+            return found
+        plan = await self._flight.do(key, lambda: self._build_and_store(key, build))
+        return plan, "miss"
+
+    def peek(self, key: Hashable, build: Callable[[], Awaitable[Dict[str, Any]]]) -> Optional[Tuple[Dict[str, Any], str]]:
+        """只查缓存不规划：命中返回 (行程, hit/stale)（stale 时同样触发后台刷新），未命中返回 None 并计一次 miss。
+
+        供流式接口使用：未命中时由调用方边生成边输出，结束后再 put() 回来。
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        plan, created = entry
+        if time.monotonic() - created < self.soft_ttl:
+            self.hits += 1
+            return plan, "hit"
+        self.stale_hits += 1
+        self._refresh_in_background(key, build)
+        return plan, "stale"
+
+    def put(self, key: Hashable, plan: Dict[str, Any]) -> None:
+        # 没搜到任何景点（多半是上游故障）的结果不缓存
+        if plan.get("debug_info", {}).get("search_success", True):
+            self._entries[key] = (plan, time.monotonic())
+
+    def body(self, key: Hashable, variant: Hashable, plan: Dict[str, Any]) -> Optional[bytes]:
+        """plan 对应的已编码响应体；没有，或 plan 已被刷新替换时返回 None"""
+        if self._bodies is None:
+            return None
+        found = self._bodies.get((key, variant))
+        if found is None or found[0] is not plan:
+            return None
+        self.body_hits += 1
+        return found[1]
+
+    def put_body(self, key: Hashable, variant: Hashable, plan: Dict[str, Any], body: bytes) -> None:
+        # 只保存当前缓存条目的编码结果（没缓存的行程、已被替换的旧行程都不保存）
+        entry = self._entries.get(key)
+        if self._bodies is not None and entry is not None and entry[0] is plan:
+            self._bodies[(key, variant)] = (plan, body)
+
+    async def _build_and_store(self, key: Hashable, build: Callable[[], Awaitable[Dict[str, Any]]]) -> Dict[str, Any]:
+        plan = await build()
+        self.put(key, plan)
+        return plan
+
+    def _refresh_in_background(self, key: Hashable, build: Callable[[], Awaitable[Dict[str, Any]]]) -> None:
+        if key in self._refreshing:
+            return
+        self._refreshing.add(key)
+
+        async def refresh():
+            try:
+                # 后台刷新的高德请求排在用户请求之后
+                with background_priority():
+                    await self._flight.do(key, lambda: self._build_and_store(key, build))
+                self.refreshes += 1
+            except Exception as e:
+                # 刷新失败时保留旧结果，等下次过期再试
+                self.refresh_errors += 1
+                logger.warning("后台刷新行程缓存失败: %s", e)
+            finally:
+                self._refreshing.discard(key)
+
+        task = asyncio.create_task(refresh())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def close(self) -> None:
+        for t in list(self._tasks):
+            t.cancel()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.stale_hits + self.misses
+        return {
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "hit_ratio": round((self.hits + self.stale_hits) / lookups, 4) if lookups else 0.0,
+            "refreshes": self.refreshes,
+            "refresh_errors": self.refresh_errors,
+            "refreshing": len(self._refreshing),
+            "size": len(self._entries),
+            "maxsize": self._entries.maxsize,
+            "body_hits": self.body_hits,
+            "bodies": len(self._bodies) if self._bodies is not None else 0,
+        }
@@ -0,0 +1,407 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import re
+import shutil
+import time
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+import logging
+import numpy as np
+
+from app.core import config
+from app.services.gaode_mcp import FAILED, AsyncAmapClient
+from app.utils.poi import Poi, make_poi
+from app.utils.query_plan import TYPE_CODES
+
+logger = logging.getLogger(__name__)
+
+INDEX_VERSION = 1
+# 字符串列：每列是 int32 的字符串表下标，-1 表示空
+_STR_COLUMNS = ("id", "name", "category", "address", "tel")
+
+
+def _city_dir(root: str, city: str) -> str:
+    return os.path.join(root, city.strip())
+
+
+def _search_blob(rows: Iterable[Tuple[Optional[str], Optional[str]]]) -> Tuple[bytes, np.ndarray]:
+    """没抓取过的关键词按名称/分类做子串匹配用的检索文本：每个 POI 一条“名称 NUL 分类 NUL”（UTF-8），
+    以及每条的起始字节偏移（N+1 个）。UTF-8 的字节子串匹配与字符子串匹配等价，一次正则扫描即可"""
+    parts = [f"{name or ''}\0{category or ''}\0".encode("utf-8") for name, category in rows]
+    offsets = np.zeros(len(parts) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in parts], out=offsets[1:])
+    return b"".join(parts), offsets
+
+
+# --- 写入 ---
+
+class _StringTable:
+    """字符串驻留表：相同的字符串（如分类名）只存一份"""
+
+    def __init__(self):
+        self._ids: Dict[str, int] = {}
+        self._strings: List[str] = []
+
+    def intern(self, s: Any) -> int:
+        if not isinstance(s, str) or not s:
+            # 高德空字段有时返回 []，统一按空处理
+            return -1
+        i = self._ids.get(s)
+        if i is None:
+            i = self._ids[s] = len(self._strings)
+            self._strings.append(s)
+        return i
+
+    def dump(self, path: str) -> None:
+        encoded = [s.encode("utf-8") for s in self._strings]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(b) for b in encoded], out=offsets[1:])
+        with open(os.path.join(path, "strings.bin"), "wb") as f:
+            f.write(b"".join(encoded))
+        np.save(os.path.join(path, "string_offsets.npy"), offsets)
+
+
+def write_city_index(root: str, city: str, pois: Sequence[Poi], postings: Dict[str, List[int]],
+                     keyword_times: Dict[str, float], center: Optional[Tuple[float, float]]) -> str:
+    """把一个城市的 POI 写成列式文件：坐标 N×2 float64、各字符串列为字符串表下标，
+    每个关键词的结果按高德返回顺序存成倒排表。先写临时目录再整体替换，读者不会看到写了一半的索引。"""
+    final = _city_dir(root, city)
+    tmp = final + ".tmp"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+
+    strings = _StringTable()
+    coords = np.array([p.location for p in pois], dtype=np.float64).reshape(-1, 2)
+    np.save(os.path.join(tmp, "coords.npy"), coords)
+    for col in _STR_COLUMNS:
+        np.save(os.path.join(tmp, f"{col}.npy"), np.array([strings.intern(getattr(p, col)) for p in pois], dtype=np.int32))
+
+    keywords = sorted(postings)
+    offsets = np.zeros(len(keywords) + 1, dtype=np.int64)
+    np.cumsum([len(postings[k]) for k in keywords], out=offsets[1:])
+    flat = [i for k in keywords for i in postings[k]]
+    np.save(os.path.join(tmp, "kw_offsets.npy"), offsets)
+    np.save(os.path.join(tmp, "kw_postings.npy"), np.array(flat, dtype=np.int32))
+    strings.dump(tmp)
+    text, text_offsets = _search_blob((p.name, p.category) for p in pois)
+    with open(os.path.join(tmp, "search.bin"), "wb") as f:
+        f.write(text)
+    np.save(os.path.join(tmp, "search_offsets.npy"), text_offsets)
+
+    meta = {
+        "version": INDEX_VERSION,
+        "city": city,
+        "center": list(center) if center else None,
+        "count": len(pois),
+        "keywords": keywords,
+        "keyword_updated_at": {k: keyword_times[k] for k in keywords},
+        "built_at": time.time(),
+    }
+    with open(os.path.join(tmp, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False)
+
+    old = final + ".old"
+    shutil.rmtree(old, ignore_errors=True)
+    if os.path.exists(final):
+        os.rename(final, old)
+    os.rename(tmp, final)
+    shutil.rmtree(old, ignore_errors=True)
+    return final
+
+
+# --- 读取 ---
+
+class CityPoiIndex:
+    """单个城市的只读 POI 索引，所有数组以内存映射方式打开，多个 worker 进程共享同一份页缓存"""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, "meta.json"), encoding="utf-8") as f:
+            self.meta = json.load(f)
+        if self.meta.get("version") != INDEX_VERSION:
+            raise ValueError(f"POI 索引版本不匹配: {path}")
+        self.city = self.meta["city"]
+        self.center = tuple(self.meta["center"]) if self.meta.get("center") else None
+        load = lambda name: np.load(os.path.join(path, name), mmap_mode="r")
+        self.coords = load("coords.npy")
+        self.columns = {col: load(f"{col}.npy") for col in _STR_COLUMNS}
+        self._str_offsets = load("string_offsets.npy")
+        size = os.path.getsize(os.path.join(path, "strings.bin"))
+        self._strings = np.memmap(os.path.join(path, "strings.bin"), dtype=np.uint8, mode="r") if size else np.zeros(0, np.uint8)
+        self._kw_offsets = load("kw_offsets.npy")
+        self._kw_postings = load("kw_postings.npy")
+        self._kw_slot = {k: i for i, k in enumerate(self.meta["keywords"])}
+        self._kw_time: Dict[str, float] = self.meta["keyword_updated_at"]
+        self._text: Optional[Tuple[Any, np.ndarray]] = None
+        self._scans: Dict[str, np.ndarray] = {}
+
+    def __len__(self) -> int:
+        return int(self.meta["count"])
+
+    def string(self, i: int) -> Optional[str]:
+        if i < 0:
+            return None
+        a, b = int(self._str_offsets[i]), int(self._str_offsets[i + 1])
+        return self._strings[a:b].tobytes().decode("utf-8")
+
+    def poi(self, i: int) -> Poi:
+        """还原成与 search_poi 相同的 Poi"""
+        lng, lat = self.coords[i]
+        return make_poi(
+            self.string(int(self.columns["id"][i])),
+            self.string(int(self.columns["name"][i])),
+            self.string(int(self.columns["category"][i])),
+            lng, lat,
+            self.string(int(self.columns["address"][i])),
+            self.string(int(self.columns["tel"][i])),
+        )
+
+    def _search_text(self) -> Tuple[Any, np.ndarray]:
+        if self._text is None:
+            path = os.path.join(self.path, "search.bin")
+            if os.path.isfile(path):
+                size = os.path.getsize(path)
+                text = np.memmap(path, dtype=np.uint8, mode="r") if size else b""
+                self._text = (text, np.load(os.path.join(self.path, "search_offsets.npy"), mmap_mode="r"))
+            else:
+                # 旧版抓取脚本写的索引没有检索文本，现场拼一次
+                names, cats = self.columns["name"], self.columns["category"]
+                self._text = _search_blob((self.string(int(names[i])), self.string(int(cats[i]))) for i in range(len(self)))
+        return self._text
+
+    def postings(self, keyword: str) -> np.ndarray:
+        """关键词对应的 POI 下标（按高德返回顺序）；没抓取过的关键词退回名称/分类的子串匹配（按 POI 顺序）"""
+        slot = self._kw_slot.get(keyword)
+        if slot is not None:
+            return self._kw_postings[self._kw_offsets[slot]:self._kw_offsets[slot + 1]]
+        hits = self._scans.get(keyword)
+        if hits is None:
+            text, offsets = self._search_text()
+            starts = np.fromiter((m.start() for m in re.finditer(re.escape(keyword.encode("utf-8")), text)), dtype=np.int64)
+            hits = np.unique(np.searchsorted(offsets, starts, side="right") - 1).astype(np.int32)
+            self._scans[keyword] = hits
+        return hits
+
+    @staticmethod
+    def _terms(keywords: str, types: str) -> List[str]:
+        terms = [k for k in (keywords or "").split("|") if k]
+        codes = {c for c in (types or "").split("|") if c}
+        if codes:
+            terms += [k for k, code in TYPE_CODES.items() if code in codes and k not in terms]
+        return terms
+
+    def updated_at(self, keywords: str, types: str = "") -> float:
+        """这次检索用到的结果是什么时候抓取的（取最旧的关键词；没抓取过的关键词按整个索引的生成时间）"""
+        built = float(self.meta.get("built_at") or 0.0)
+        return min((self._kw_time.get(t, built) for t in self._terms(keywords, types)), default=built)
+
+    def search(self, keywords: str, page: int = 1, offset: int = 10, types: str = "") -> List[Poi]:
+        """按 place/text 的语义在本地检索：keywords / types 可用“|”连接多个值，多个值的结果交替合并"""
+        lists = [self.postings(t) for t in self._terms(keywords, types)]
+
+        merged: List[int] = []
+        seen = set()
+        depth = max((len(l) for l in lists), default=0)
+        for r in range(depth):
+            for l in lists:
+                if r < len(l):
+                    i = int(l[r])
+                    if i not in seen:
+                        seen.add(i)
+                        merged.append(i)
+        start = (max(page, 1) - 1) * offset
+        return [self.poi(i) for i in merged[start:start + offset]]
+
+
+class PoiIndexSet:
+    """目录下所有城市索引的集合；按需加载，索引被重建（meta.json 变化）后自动重新打开"""
+
+    def __init__(self, root: str):
+        self.root = root
+        self._loaded: Dict[str, Tuple[float, CityPoiIndex]] = {}
+        self.hits = 0
+        self.fallbacks = 0
+        self.stale = 0  # 城市有索引但关键词已过期、改为实时搜索的次数
+
+    def get(self, city: Optional[str]) -> Optional[CityPoiIndex]:
+        if not city:
+            return None
+        meta = os.path.join(_city_dir(self.root, city), "meta.json")
+        try:
+            mtime = os.stat(meta).st_mtime
+        except OSError:
+            return None
+        cached = self._loaded.get(city)
+        if cached and cached[0] == mtime:
+            return cached[1]
+        try:
+            index = CityPoiIndex(os.path.dirname(meta))
+        except Exception as e:
+            logger.warning("POI 索引加载失败(%s): %s", city, e)
+            return None
+        self._loaded[city] = (mtime, index)
+        logger.info("已加载 %s 的 POI 索引: %d 个POI", city, len(index))
+        return index
+
+    def cities(self) -> List[str]:
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(d for d in os.listdir(self.root) if os.path.isfile(os.path.join(self.root, d, "meta.json")))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "root": self.root,
+            "cities": self.cities(),
+            "loaded": {c: len(ix) for c, (_, ix) in self._loaded.items()},
+            "hits": self.hits,
+            "fallbacks": self.fallbacks,
+            "stale": self.stale,
+        }
+
+
+class IndexedAmapClient:
+    """有本地索引的城市，POI 搜索和城市中心地理编码直接读索引，不请求高德；
+    没有索引的城市以及路线、起点地理编码照常交给内层客户端（缓存/实时请求）。"""
+
+    def __init__(self, client: Any, indexes: PoiIndexSet):
+        self.client = client
+        self.indexes = indexes
+        self.max_age_seconds = config.POI_INDEX_MAX_AGE_DAYS * 24 * 3600
+
+    def __getattr__(self, name: str) -> Any:
+        # api_key、stats 等其余属性沿用内层客户端
+        return getattr(self.client, name)
+
+    # --- Geocoding ---
+    def _center(self, address: str, city: Optional[str]) -> Optional[Tuple[float, float]]:
+        index = self.indexes.get(address) if not city else None
+        return index.center if index else None
+
+    async def geocode(self, address: str, city: Optional[str] = None) -> Optional[Tuple[float, float]]:
+        center = self._center(address, city)
+        if center:
+            self.indexes.hits += 1
+            return center
+        return await self.client.geocode(address, city=city)
+
+    async def geocode_many(self, queries: List[Tuple[str, Optional[str]]]) -> List[Optional[Tuple[float, float]]]:
+        out = [self._center(a, c) for a, c in queries]
+        rest = [i for i, v in enumerate(out) if not v]
+        if rest:
+            for i, v in zip(rest, await self.client.geocode_many([queries[i] for i in rest])):
+                out[i] = v
+        return out
+
+    # --- POI search ---
+    def _fresh_index(self, city: str, keywords: str, types: str) -> Optional[CityPoiIndex]:
+        """城市有索引、且这次检索用到的关键词抓取时间都在 POI_INDEX_MAX_AGE_DAYS 以内时返回索引；
+        过期（抓取任务没跑）的改为实时搜索，不一直返回旧数据"""
+        index = self.indexes.get(city)
+        if index is None:
+            return None
+        if time.time() - index.updated_at(keywords, types) > self.max_age_seconds:
+            self.indexes.stale += 1
+            return None
+        return index
+
+    async def search_poi(self, city: str, keywords: str, page: int = 1, offset: int = 10, extensions: str = "base", types: str = "") -> List[Poi]:
+        index = self._fresh_index(city, keywords, types)
+        if index is not None:
+            self.indexes.hits += 1
+            return index.search(keywords, page, offset, types)
+        self.indexes.fallbacks += 1
+        return await self.client.search_poi(city, keywords, page=page, offset=offset, extensions=extensions, types=types)
+
+    async def search_poi_many(self, city: str, queries: List[Tuple[str, int, int, str]], extensions: str = "base") -> List[List[Poi]]:
+        out: List[Optional[List[Poi]]] = []
+        for kw, page, offset, types in queries:
+            index = self._fresh_index(city, kw, types)
+            out.append(index.search(kw, page, offset, types) if index is not None else None)
+        rest = [i for i, v in enumerate(out) if v is None]
+        self.indexes.hits += len(queries) - len(rest)
+        self.indexes.fallbacks += len(rest)
+        if rest:
+            for i, v in zip(rest, await self.client.search_poi_many(city, [queries[i] for i in rest], extensions=extensions)):
+                out[i] = v
+        return out
+
+    # --- Routing ---
+    async def route_time(self, origin: Tuple[float, float], destination: Tuple[float, float], mode: str = "walk", city: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        return await self.client.route_time(origin, destination, mode=mode, city=city)
+
+    async def route_time_many(self, legs: List[Tuple[Tuple[float, float], Tuple[float, float]]], mode: str = "walk", city: Optional[str] = None) -> List[Optional[Dict[str, Any]]]:
+        return await self.client.route_time_many(legs, mode=mode, city=city)
+
+
+# --- 抓取 ---
+
+def _load_existing(root: str, city: str) -> Tuple[List[Poi], Dict[str, List[int]], Dict[str, float], Optional[Tuple[float, float]]]:
+    path = _city_dir(root, city)
+    if not os.path.isfile(os.path.join(path, "meta.json")):
+        return [], {}, {}, None
+    index = CityPoiIndex(path)
+    pois = [index.poi(i) for i in range(len(index))]
+    postings = {k: [int(i) for i in index.postings(k)] for k in index.meta["keywords"]}
+    return pois, postings, dict(index.meta["keyword_updated_at"]), index.center
+
+
+async def crawl_city(client: AsyncAmapClient, root: str, city: str, keywords: Iterable[str], pages: int = 4,
+                     offset: int = 25, max_age_seconds: float = 7 * 24 * 3600, concurrency: int = 4) -> Dict[str, Any]:
+    """抓取（或增量刷新）一个城市的索引：只重新抓取不在索引里、或上次抓取早于 max_age_seconds 的关键词。
+
+    同一 POI（按高德 id，没有 id 时按名称+坐标）只存一份；刷新的关键词替换其倒排表，其余保留。
+    """
+    pois, postings, times, center = _load_existing(root, city)
+    now = time.time()
+    todo = [k for k in dict.fromkeys(keywords) if k and now - times.get(k, 0) > max_age_seconds]
+    if center is None:
+        center = await client.geocode(city)
+
+    by_key: Dict[Any, int] = {}
+    for i, p in enumerate(pois):
+        by_key[p.id or (p.name, p.location)] = i
+
+    sem = asyncio.Semaphore(concurrency)
+
+    async def fetch(keyword: str) -> Tuple[str, Optional[List[Poi]]]:
+        """关键词的全部结果；任一页请求失败（上游出错、配额用尽）时返回 None，不拿半截结果当完整结果"""
+        found: List[Poi] = []
+        async with sem:
+            for page in range(1, pages + 1):
+                try:
+                    batch = await client.search_poi(city, keyword, page=page, offset=offset, strict=True)
+                except Exception as e:
+                    logger.warning("%s 关键词'%s'第%d页抓取异常: %s", city, keyword, page, e)
+                    batch = FAILED
+                if batch is FAILED:
+                    return keyword, None
+                found.extend(batch)
+                if len(batch) < offset:
+                    break
+        return keyword, found
+
+    crawled = 0
+    for keyword, found in await asyncio.gather(*(fetch(k) for k in todo)):
+        if found is None:
+            # 抓取失败：保留旧结果（新关键词不写入），也不更新抓取时间，下次照常重新抓取
+            logger.warning("%s 关键词'%s'抓取失败，%s", city, keyword, "保留旧索引" if keyword in postings else "暂不写入索引")
+            continue
+        ids: List[int] = []
+        for p in found:
+            key = p.id or (p.name, p.location)
+            i = by_key.get(key)
+            if i is None:
+                i = by_key[key] = len(pois)
+                pois.append(p)
+            else:
+                pois[i] = p
+            if i not in ids:
+                ids.append(i)
+        postings[keyword] = ids
+        times[keyword] = now
+        crawled += 1
+
+    path = write_city_index(root, city, pois, postings, times, center)
+    return {"city": city, "path": path, "pois": len(pois), "keywords": len(postings), "refreshed": crawled, "skipped": len(todo) - crawled}
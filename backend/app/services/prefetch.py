@@ -0,0 +1,125 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from app.core import config
+from app.services.amap_cache import CachedAmapClient
+from app.services.rate_limit import background_priority
+from app.services.shared_state import SharedState
+from app.utils.itinerary import first_page_queries
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def parse_targets(cities: str, interests: str) -> List[Tuple[str, Tuple[str, ...]]]:
+    """PREFETCH_CITIES（逗号分隔）× PREFETCH_INTERESTS（组合之间用分号、组合内用逗号分隔，空组合表示不选兴趣）"""
+    combos = list(dict.fromkeys(
+        tuple(sorted({i.strip() for i in combo.split(",") if i.strip()})) for combo in interests.split(";")
+    ))
+    return [(city.strip(), combo) for city in cities.split(",") if city.strip() for combo in combos]
+
+
+class Prefetcher:
+    """缓存预热与后台预取。
+
+    启动时为热门城市 × 兴趣组合预先取好城市中心地理编码和规划时会发出的第 1 页 POI 搜索，完成后 ready；
+    之后每 interval 秒再预热一遍（已缓存的条目不打上游），并把 refresh_ahead 秒内将过期、
+    且被用户请求命中至少 min_hits 次的 geocode / POI 条目提前重新加载。
+    所有请求按后台优先级排队，不和用户请求抢限速令牌。
+    传入 shared 时多个 worker 每轮只有一个做提前刷新和重新预热（结果经持久化缓存共享）。
+    """
+
+    # 每轮刷新/重新预热的选举租约
+    REFRESH_LEASE = "prefetch:refresh"
+
+    def __init__(self, client: Any, cache: Optional[CachedAmapClient], targets: List[Tuple[str, Tuple[str, ...]]],
+                 interval: float, refresh_ahead: float, min_hits: int, shared: Optional[SharedState] = None):
+        self.client = client
+        self.cache = cache
+        self.shared = shared
+        self.targets = targets
+        self.interval = interval
+        self.refresh_ahead = refresh_ahead
+        self.min_hits = min_hits
+        self.ready = asyncio.Event()
+        self.warmed = 0
+        self.warm_errors = 0
+        self.warmup_seconds: Optional[float] = None
+        self.rounds = 0
+        self.refreshed = 0
+        self.refresh_errors = 0
+        self.refresh_skipped = 0
+
+    async def _warm(self, city: str, interests: Tuple[str, ...]) -> None:
+        queries = first_page_queries(city, list(interests))
+        await self.client.geocode(city)
+        if config.AMAP_BATCH_ENABLED:
+            await self.client.search_poi_many(city, queries)
+        else:
+            sem = asyncio.Semaphore(config.POI_SEARCH_CONCURRENCY)
+
+            async def one(kw: str, page: int, offset: int, types: str) -> None:
+                async with sem:
+                    await self.client.search_poi(city, kw, page=page, offset=offset, types=types)
+
+            await asyncio.gather(*(one(*q) for q in queries))
+
+    async def warm_up(self) -> None:
+        start = time.monotonic()
+        warmed = 0
+        for city, interests in self.targets:
+            try:
+                await self._warm(city, interests)
+                warmed += 1
+            except Exception as e:
+                self.warm_errors += 1
+                logger.warning("预热失败(%s, %s): %s", city, list(interests), e)
+        self.warmed = warmed
+        if self.warmup_seconds is None:
+            self.warmup_seconds = round(time.monotonic() - start, 3)
+            logger.info("缓存预热完成: %d/%d 组, 用时 %ss", self.warmed, len(self.targets), self.warmup_seconds)
+
+    async def refresh_hot(self) -> None:
+        if self.cache is None:
+            return
+        for endpoint in ("geocode", "place_text"):
+            keys = self.cache.refresh_candidates(endpoint, self.refresh_ahead, self.min_hits)
+            if not keys:
+                continue
+            try:
+                self.refreshed += await self.cache.refresh(endpoint, keys)
+            except Exception as e:
+                self.refresh_errors += 1
+                logger.warning("预取刷新 %s 失败: %s", endpoint, e)
+
+    async def run(self) -> None:
+        with background_priority():
+            try:
+                await self.warm_up()
+            finally:
+                # 预热出错也不能让服务一直不就绪
+                self.ready.set()
+            while True:
+                await asyncio.sleep(self.interval)
+                self.rounds += 1
+                # 租约不主动释放：本轮其他 worker 都拿不到，过期后下一轮重新选
+                if self.shared and not (await self.shared.try_lease([self.REFRESH_LEASE], self.interval / 2))[0]:
+                    self.refresh_skipped += 1
+                    continue
+                await self.refresh_hot()
+                await self.warm_up()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "ready": self.ready.is_set(),
+            "targets": len(self.targets),
+            "warmed": self.warmed,
+            "warm_errors": self.warm_errors,
+            "warmup_seconds": self.warmup_seconds,
+            "rounds": self.rounds,
+            "refreshed": self.refreshed,
+            "refresh_errors": self.refresh_errors,
+            "refresh_skipped": self.refresh_skipped,
+        }
@@ -0,0 +1,344 @@
+from __future__ import annotations
+
+import asyncio
+import datetime
+import heapq
+import itertools
+import sqlite3
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 优先级：数值越小越先拿到令牌
+PRIORITY_INTERACTIVE = 0   # 用户正在等待的行程请求
+PRIORITY_BACKGROUND = 10   # 预热、后台刷新、批量任务
+
+_priority: ContextVar[int] = ContextVar("amap_priority", default=PRIORITY_INTERACTIVE)
+
+# 高德 infocode：超出 QPS 限制 / 日配额用尽
+QPS_LIMIT_CODES = frozenset({"10004", "10014", "10015", "10019", "10020", "10021"})
+DAILY_LIMIT_CODES = frozenset({"10003", "10044", "10045"})
+
+
+class QuotaExhausted(Exception):
+    """当天配额已用尽，调用方应直接走缓存/估算，不再请求上游"""
+
+
+def is_background() -> bool:
+    """当前上下文是否为后台任务（预热、后台刷新等）"""
+    return _priority.get() >= PRIORITY_BACKGROUND
+
+
+@contextmanager
+def background_priority() -> Iterator[None]:
+    """在该上下文里（包括其中创建的 Task）发出的高德请求都按后台优先级排队"""
+    token = _priority.set(PRIORITY_BACKGROUND)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+class TokenBucket:
+    """令牌桶：每秒补充 rate 个令牌，最多攒 burst 个。
+
+    拿不到令牌的请求进入按 (优先级, 到达顺序) 排列的等待队列，令牌补充时依次放行，
+    因此交互请求总是排在后台任务前面；日配额用尽后直接抛 QuotaExhausted。
+    """
+
+    def __init__(self, name: str, rate: float, burst: float, daily_limit: int = 0):
+        self.name = name
+        self.rate = rate
+        self.burst = max(burst, 1.0)
+        self.daily_limit = daily_limit
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._day = datetime.date.today()
+        self._used_today = 0
+        self._exhausted = False
+        # 指标
+        self.acquired = 0
+        self.queued = 0
+        self.waits = 0
+        self.rejected = 0
+        self.throttled = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.max_depth = 0
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    # --- 令牌来源：本进程内的计数；SharedTokenBucket 改为读写多个 worker 共用的状态 ---
+    def _take(self) -> bool:
+        """补充后取一个令牌，不足 1 个时返回 False"""
+        self._refill()
+        if self._tokens < 1:
+            return False
+        self._tokens -= 1
+        self._used_today += 1
+        return True
+
+    async def _take_now(self) -> bool:
+        """不排队地取一个令牌；SharedTokenBucket 在共享状态的专用线程里完成"""
+        return self._take()
+
+    def _untake(self) -> None:
+        self._tokens += 1
+        self._used_today -= 1
+
+    def _next_delay(self) -> float:
+        """距离下一个令牌补充的秒数"""
+        return max((1 - self._tokens) / self.rate, 0.001)
+
+    def _drain(self) -> None:
+        self._refill()
+        self._tokens = min(self._tokens, 0.0)
+
+    def _set_exhausted(self) -> None:
+        self._exhausted = True
+
+    def _state(self) -> Tuple[float, int, bool]:
+        """当前令牌数、当天已用次数、是否已耗尽"""
+        today = datetime.date.today()
+        if today != self._day:
+            self._day, self._used_today, self._exhausted = today, 0, False
+        tokens = min(self.burst, self._tokens + (time.monotonic() - self._updated) * self.rate)
+        return tokens, self._used_today, self._exhausted
+
+    def _check_quota(self) -> None:
+        _, used, exhausted = self._state()
+        if exhausted or (self.daily_limit and used >= self.daily_limit):
+            self.rejected += 1
+            raise QuotaExhausted(f"{self.name} 今日配额已用尽")
+
+    def _depth(self) -> int:
+        return sum(1 for _, _, f in self._waiters if not f.done())
+
+    async def acquire(self, priority: Optional[int] = None) -> float:
+        """等到一个令牌，返回等待的秒数"""
+        self._check_quota()
+        if not self._waiters and await self._take_now():
+            self.acquired += 1
+            return 0.0
+
+        prio = _priority.get() if priority is None else priority
+        fut = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (prio, next(self._seq), fut))
+        self.queued += 1
+        self.max_depth = max(self.max_depth, self._depth())
+        start = time.monotonic()
+        self._dispatch()
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled() and fut.exception() is None:
+                # 令牌已经发给了这个调用方但它被取消了：还回去给下一个
+                self.release()
+            raise
+        waited = time.monotonic() - start
+        self.waits += 1
+        self.wait_total += waited
+        self.wait_max = max(self.wait_max, waited)
+        return waited
+
+    async def try_acquire(self) -> bool:
+        """有空闲令牌就立即拿走，否则返回 False，从不排队（对冲请求用：只有不挤占别人的令牌时才发）"""
+        if self._waiters:
+            return False
+        try:
+            self._check_quota()
+            granted = await self._take_now()
+        except QuotaExhausted:
+            return False
+        if granted:
+            self.acquired += 1
+        return granted
+
+    def release(self) -> None:
+        """还回一个已经拿到但没有用掉的令牌，排队的请求接着取"""
+        self._untake()
+        self.acquired -= 1
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        # 入队、还令牌时也会调用：先取消已排上的唤醒，保证任何时候最多只有一个
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        while self._waiters:
+            prio, seq, fut = self._waiters[0]
+            if fut.done():
+                heapq.heappop(self._waiters)
+                continue
+            if not self._take():
+                break
+            heapq.heappop(self._waiters)
+            self.acquired += 1
+            fut.set_result(None)
+        if self._waiters and self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self._next_delay(), self._dispatch)
+
+    def feedback(self, data: Dict[str, Any]) -> None:
+        """根据高德返回的 infocode 调整：被限流时清空令牌，日配额用尽时当天不再放行"""
+        code = str(data.get("infocode") or "")
+        if code in QPS_LIMIT_CODES:
+            self.throttled += 1
+            self._drain()
+            logger.warning("高德 %s 接口被限流（%s），暂停补充令牌", self.name, data.get("info"))
+        elif code in DAILY_LIMIT_CODES:
+            self._set_exhausted()
+            logger.error("高德 %s 接口今日配额已用尽（%s）", self.name, data.get("info"))
+
+    def stats(self) -> Dict[str, Any]:
+        tokens, used, _ = self._state()
+        return {
+            "rate": self.rate,
+            "burst": self.burst,
+            "tokens": round(tokens, 2),
+            "acquired": self.acquired,
+            "queue_depth": self._depth(),
+            "max_queue_depth": self.max_depth,
+            "queued": self.queued,
+            "avg_wait_ms": round(self.wait_total / self.waits * 1000, 2) if self.waits else 0.0,
+            "max_wait_ms": round(self.wait_max * 1000, 2),
+            "throttled": self.throttled,
+            "rejected": self.rejected,
+            "used_today": used,
+            "daily_limit": self.daily_limit,
+        }
+
+
+class SharedTokenBucket(TokenBucket):
+    """令牌数和当天用量放在 SharedState 里、由同一台机器上所有 worker 共用的令牌桶。
+
+    等待队列和优先级仍在本进程内，只有取令牌这一步跨进程原子完成，并且在 SharedState 的专用线程里执行，
+    事件循环不会因为等 SQLite 的锁而卡住。排队的请求由一个后台任务依次取令牌放行；其他 worker 也在取，
+    所以按剩余令牌算出的等待时间只是下一次尝试的时机。
+
+    当天用量和耗尽标记取自最近一次取令牌的结果，检查配额不再单独读共享状态；
+    共享状态读写失败时当作暂时没有令牌，稍后重试，配额状态保留上一次看到的值。
+    """
+
+    def __init__(self, name: str, rate: float, burst: float, state: Any, daily_limit: int = 0):
+        super().__init__(name, rate, burst, daily_limit)
+        self.state = state
+        self._seen = self.burst  # 最近一次从共享状态读到的令牌数
+        self._pump: Optional[asyncio.Task] = None
+
+    async def _take_now(self) -> bool:
+        try:
+            granted, self._seen, used, exhausted = await self.state.take(self.name, self.rate, self.burst, self.daily_limit)
+        except sqlite3.Error as e:
+            logger.warning("共享令牌桶 %s 读写失败: %s", self.name, e)
+            self._seen = 0.0
+            return False
+        self._day, self._used_today, self._exhausted = datetime.date.today(), used, exhausted
+        if not granted:
+            # 没拿到是因为配额（可能是别的 worker 用完的）时直接失败，不再排队
+            self._check_quota()
+        return granted
+
+    def _untake(self) -> None:
+        self.state.give_back(self.name, self.rate, self.burst)
+
+    def _next_delay(self) -> float:
+        return max((1 - self._seen) / self.rate, 0.001)
+
+    def _drain(self) -> None:
+        self._seen = min(self._seen, 0.0)
+        self.state.drain(self.name, self.rate, self.burst)
+
+    def _set_exhausted(self) -> None:
+        self._exhausted = True
+        self.state.mark_exhausted(self.name, self.rate, self.burst)
+
+    def _state(self) -> Tuple[float, int, bool]:
+        # 只做跨天清零，不读共享状态
+        _, used, exhausted = super()._state()
+        return self._seen, used, exhausted
+
+    def _dispatch(self) -> None:
+        if self._waiters and self._pump is None:
+            self._pump = asyncio.get_running_loop().create_task(self._pump_waiters())
+
+    async def _pump_waiters(self) -> None:
+        """按 (优先级, 到达顺序) 依次给排队的请求取令牌，取不到就等到下一个令牌补充的时机再试"""
+        try:
+            while self._waiters:
+                if self._waiters[0][2].done():
+                    heapq.heappop(self._waiters)
+                    continue
+                try:
+                    granted = await self._take_now()
+                except QuotaExhausted as e:
+                    for _, _, fut in self._waiters:
+                        if not fut.done():
+                            fut.set_exception(QuotaExhausted(str(e)))
+                    self._waiters.clear()
+                    break
+                if not granted:
+                    await asyncio.sleep(self._next_delay())
+                    continue
+                # 等线程的这段时间里队首可能被取消或换成了优先级更高的请求
+                while self._waiters and self._waiters[0][2].done():
+                    heapq.heappop(self._waiters)
+                if not self._waiters:
+                    self._untake()
+                    break
+                _, _, fut = heapq.heappop(self._waiters)
+                self.acquired += 1
+                fut.set_result(None)
+        finally:
+            self._pump = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {**super().stats(), "shared": True}
+
+
+class RateLimiter:
+    """按接口族（geocode / place / direction）分别限速的令牌桶集合"""
+
+    def __init__(self, buckets: Dict[str, TokenBucket]):
+        self.buckets = buckets
+
+    async def acquire(self, family: str) -> float:
+        bucket = self.buckets.get(family)
+        return await bucket.acquire() if bucket else 0.0
+
+    async def try_acquire(self, family: str) -> bool:
+        bucket = self.buckets.get(family)
+        return await bucket.try_acquire() if bucket else True
+
+    async def try_acquire_all(self, families: Sequence[str]) -> bool:
+        """每个接口族各取一个令牌（批量请求的每个子请求一个），任何一个没有空闲令牌就把已取到的还回去"""
+        taken: List[str] = []
+        for family in families:
+            if not await self.try_acquire(family):
+                for f in taken:
+                    self.release(f)
+                return False
+            taken.append(family)
+        return True
+
+    def release(self, family: str) -> None:
+        bucket = self.buckets.get(family)
+        if bucket:
+            bucket.release()
+
+    def feedback(self, family: str, data: Dict[str, Any]) -> None:
+        bucket = self.buckets.get(family)
+        if bucket and isinstance(data, dict):
+            bucket.feedback(data)
+
+    def stats(self) -> Dict[str, Any]:
+        return {name: b.stats() for name, b in self.buckets.items()}
@@ -0,0 +1,299 @@
+from __future__ import annotations
+
+import asyncio
+import random
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Deque, Dict, Iterator, Optional
+import httpx
+from app.services.rate_limit import QuotaExhausted
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitOpenError(Exception):
+    """熔断器打开，直接失败（调用方走缓存/估算）"""
+
+
+def _retryable(e: Exception) -> bool:
+    # 4xx（429 除外）说明请求本身有问题，重试也一样
+    if isinstance(e, httpx.HTTPStatusError):
+        code = e.response.status_code
+        return code >= 500 or code == 429
+    return True
+
+
+class RetryBudget:
+    """一次行程请求内所有高德调用共享的重试/对冲次数上限，防止上游变慢时重试把流量放大"""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.used = 0
+
+    def take(self) -> bool:
+        if self.used >= self.limit:
+            return False
+        self.used += 1
+        return True
+
+
+_budget: ContextVar[Optional[RetryBudget]] = ContextVar("amap_retry_budget", default=None)
+
+
+@contextmanager
+def retry_budget(limit: int) -> Iterator[RetryBudget]:
+    """为当前请求（及其中创建的 Task）设置共享的重试预算"""
+    budget = RetryBudget(limit)
+    token = _budget.set(budget)
+    try:
+        yield budget
+    finally:
+        try:
+            _budget.reset(token)
+        except ValueError:
+            # 在异步生成器里使用时，客户端断开后生成器可能在另一个上下文中被关闭，此时无需复原
+            pass
+
+
+class LatencyWindow:
+    """最近 N 次成功请求的耗时，用于估计对冲阈值（p95）"""
+
+    def __init__(self, size: int = 200):
+        self._samples: Deque[float] = deque(maxlen=size)
+
+    def add(self, seconds: float) -> None:
+        self._samples.append(seconds)
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def quantile(self, q: float) -> Optional[float]:
+        if not self._samples:
+            return None
+        s = sorted(self._samples)
+        return s[min(int(q * len(s)), len(s) - 1)]
+
+
+class CircuitBreaker:
+    """连续失败 failures 次后打开，cooldown 秒内直接失败；之后半开，只放一个探测请求，成功则关闭、失败则重新打开"""
+
+    def __init__(self, failures: int, cooldown: float):
+        self.failures = failures
+        self.cooldown = cooldown
+        self.state = "closed"
+        self._consecutive = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self.opens = 0
+        self.short_circuited = 0
+
+    def allow(self) -> bool:
+        if self.state == "closed":
+            return True
+        if self.state == "open" and time.monotonic() - self._opened_at >= self.cooldown:
+            self.state = "half_open"
+            self._probing = False
+        if self.state == "half_open" and not self._probing:
+            self._probing = True
+            return True
+        self.short_circuited += 1
+        return False
+
+    def release(self) -> None:
+        """探测请求被取消（未得出结论）时让出名额，下一个请求可以继续探测"""
+        if self.state == "half_open":
+            self._probing = False
+
+    def record_success(self) -> None:
+        self._consecutive = 0
+        if self.state != "closed":
+            logger.info("熔断器恢复关闭")
+        self.state = "closed"
+        self._probing = False
+
+    def record_failure(self) -> None:
+        self._consecutive += 1
+        if self.state == "half_open" or (self.state == "closed" and self._consecutive >= self.failures):
+            if self.state == "closed":
+                self.opens += 1
+            self.state = "open"
+            self._opened_at = time.monotonic()
+            self._probing = False
+
+
+class _Family:
+    """单个接口族的延迟窗口、熔断器和计数"""
+
+    def __init__(self, breaker: CircuitBreaker):
+        self.latency = LatencyWindow()
+        self.breaker = breaker
+        self.calls = 0
+        self.attempts = 0
+        self.retries = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.hedges_skipped = 0  # 到了对冲时机但没有空闲令牌，没发
+        self.timeouts = 0
+        self.errors = 0
+        self.failures = 0
+
+
+class Resilience:
+    """高德调用的容错策略：每次尝试短超时、带抖动的重试（受请求级预算限制）、
+    超过 p95 仍未返回时发对冲请求、按接口族熔断。
+
+    send 是“发一次请求”的协程工厂，call() 决定发几次、何时放弃。
+    """
+
+    def __init__(
+        self,
+        attempt_timeout: float,
+        max_retries: int,
+        backoff: float,
+        hedge: bool,
+        hedge_quantile: float,
+        hedge_min: float,
+        breaker_failures: int,
+        breaker_cooldown: float,
+        min_samples: int = 20,
+    ):
+        self.attempt_timeout = attempt_timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.hedge = hedge
+        self.hedge_quantile = hedge_quantile
+        self.hedge_min = hedge_min
+        self.breaker_failures = breaker_failures
+        self.breaker_cooldown = breaker_cooldown
+        self.min_samples = min_samples
+        self._families: Dict[str, _Family] = {}
+
+    def _family(self, name: str) -> _Family:
+        fam = self._families.get(name)
+        if fam is None:
+            fam = self._families[name] = _Family(CircuitBreaker(self.breaker_failures, self.breaker_cooldown))
+        return fam
+
+    def _hedge_delay(self, fam: _Family) -> Optional[float]:
+        # 样本太少时 p95 不可信，不对冲
+        if not self.hedge or len(fam.latency) < self.min_samples:
+            return None
+        p = fam.latency.quantile(self.hedge_quantile)
+        return min(max(p, self.hedge_min), self.attempt_timeout)
+
+    async def _timed(self, fam: _Family, send: Callable[[], Awaitable[Any]], started: Optional[asyncio.Event] = None) -> Any:
+        fam.attempts += 1
+        if started is not None:
+            started.set()
+        start = time.monotonic()
+        try:
+            result = await asyncio.wait_for(send(), self.attempt_timeout)
+        except asyncio.TimeoutError:
+            fam.timeouts += 1
+            raise
+        fam.latency.add(time.monotonic() - start)
+        return result
+
+    async def _attempt(self, fam: _Family, send: Callable[[], Awaitable[Any]], acquire: Optional[Callable[[], Awaitable[Any]]],
+                       try_acquire: Optional[Callable[[], Awaitable[bool]]]) -> Any:
+        """一次逻辑尝试：首个请求超过 p95 仍未返回时再发一个，取先成功的那个。
+
+        限速排队发生在首个请求发出之前，不计入延迟，对冲计时从首个请求真正发出时开始；
+        对冲请求只在立即有空闲令牌时才发（try_acquire），不会为了对冲去排队。
+        """
+        if acquire is not None:
+            await acquire()
+        started = asyncio.Event()
+        first = asyncio.ensure_future(self._timed(fam, send, started))
+        tasks = {first}
+        try:
+            delay = self._hedge_delay(fam)
+            if delay is None:
+                return await first
+            await started.wait()
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            budget = _budget.get()
+            if done or (budget is not None and not budget.take()):
+                return await first
+            if try_acquire is not None and not await try_acquire():
+                fam.hedges_skipped += 1
+                return await first
+            second = asyncio.ensure_future(self._timed(fam, send))
+            tasks.add(second)
+            fam.hedges += 1
+            error: Optional[BaseException] = None
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for t in done:
+                    if t.exception() is None:
+                        if t is second:
+                            fam.hedge_wins += 1
+                        return t.result()
+                    error = t.exception()
+            raise error
+        finally:
+            for t in tasks:
+                if not t.done():
+                    t.cancel()
+
+    async def call(self, family: str, send: Callable[[], Awaitable[Any]], acquire: Optional[Callable[[], Awaitable[Any]]] = None,
+                   try_acquire: Optional[Callable[[], Awaitable[bool]]] = None) -> Any:
+        """按策略执行 send；acquire（如限速器取令牌）在每次尝试发送前调用，不计入超时；
+        try_acquire 不排队地取令牌，拿不到时不发对冲请求"""
+        fam = self._family(family)
+        fam.calls += 1
+        if not fam.breaker.allow():
+            raise CircuitOpenError(f"{family} 熔断中，跳过高德请求")
+
+        budget = _budget.get()
+        attempt = 0
+        try:
+            while True:
+                try:
+                    result = await self._attempt(fam, send, acquire, try_acquire)
+                except (asyncio.CancelledError, QuotaExhausted):
+                    raise
+                except Exception as e:
+                    fam.errors += 1
+                    if not _retryable(e) or attempt >= self.max_retries or (budget is not None and not budget.take()):
+                        fam.failures += 1
+                        fam.breaker.record_failure()
+                        raise
+                    # full jitter：在 [0, backoff × 2^attempt] 内随机等待，避免大家同时重试
+                    attempt += 1
+                    fam.retries += 1
+                    logger.warning("高德 %s 请求失败，第%d次重试: %r", family, attempt, e)
+                    await asyncio.sleep(random.uniform(0, self.backoff * (2 ** (attempt - 1))))
+                    continue
+                fam.breaker.record_success()
+                return result
+        except (asyncio.CancelledError, QuotaExhausted):
+            fam.breaker.release()
+            raise
+
+    def stats(self) -> Dict[str, Any]:
+        out = {}
+        for name, fam in self._families.items():
+            p50 = fam.latency.quantile(0.5)
+            p95 = fam.latency.quantile(0.95)
+            out[name] = {
+                "calls": fam.calls,
+                "attempts": fam.attempts,
+                "retries": fam.retries,
+                "hedges": fam.hedges,
+                "hedge_wins": fam.hedge_wins,
+                "hedges_skipped": fam.hedges_skipped,
+                "timeouts": fam.timeouts,
+                "errors": fam.errors,
+                "failures": fam.failures,
+                "latency_p50_ms": round(p50 * 1000, 1) if p50 is not None else None,
+                "latency_p95_ms": round(p95 * 1000, 1) if p95 is not None else None,
+                "breaker": fam.breaker.state,
+                "breaker_opens": fam.breaker.opens,
+                "short_circuited": fam.breaker.short_circuited,
+            }
+        return out
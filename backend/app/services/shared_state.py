@@ -0,0 +1,242 @@
+from __future__ import annotations
+
+import asyncio
+import datetime
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Tuple
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class SharedState:
+    """同一台机器上多个 worker 进程共享的协调状态（SQLite WAL 文件）。
+
+    - buckets：各接口族令牌桶的令牌数、当天已用次数和配额耗尽标记，所有 worker 从同一个桶里取令牌，
+      增加 worker 不会成倍放大发往高德的 QPS 和日配额消耗；
+    - leases：某个缓存 key 正由哪个进程从上游加载（跨进程 singleflight），其他 worker 等它写入持久化缓存。
+
+    状态都在文件里，worker 被回收、重启后接着用。所有 SQLite 读写都交给一个专用线程按提交顺序串行执行，
+    别的 worker 长时间占着写锁时也不会卡住事件循环（还令牌、清空、标记耗尽不需要等结果）；
+    stats() 只返回最近一次租约操作时统计的数字，不读数据库。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        # 本进程持有租约时写入的标记，关闭时据此释放
+        self.owner = f"{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.leases_acquired = 0
+        self.leases_contended = 0
+        self.active_leases = 0
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="shared-state")
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=1.0, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        # 事务都很短，等锁超过 1 秒说明出了问题：令牌桶当作暂时没有令牌，租约退回各进程自己加载
+        self._conn.execute("PRAGMA busy_timeout=1000")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS buckets ("
+            " name TEXT PRIMARY KEY,"
+            " tokens REAL NOT NULL,"
+            " updated_at REAL NOT NULL,"
+            " day TEXT NOT NULL,"
+            " used INTEGER NOT NULL,"
+            " exhausted INTEGER NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS leases ("
+            " key TEXT PRIMARY KEY,"
+            " owner TEXT NOT NULL,"
+            " expires_at REAL NOT NULL)"
+        )
+        logger.info("共享状态已打开: %s (owner=%s)", path, self.owner)
+
+    @contextmanager
+    def _write(self) -> Iterator[sqlite3.Connection]:
+        """写事务：BEGIN IMMEDIATE 一开始就拿写锁，读-改-写在多个进程间是原子的"""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._conn
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    # --- 令牌桶 ---
+    @staticmethod
+    def _bucket(conn: sqlite3.Connection, name: str, rate: float, burst: float, now: float) -> Tuple[float, int, bool]:
+        """读出补充到 now 的令牌数、当天已用次数和耗尽标记（跨天清零）"""
+        row = conn.execute(
+            "SELECT tokens, updated_at, day, used, exhausted FROM buckets WHERE name = ?", (name,)
+        ).fetchone()
+        if row is None:
+            return burst, 0, False
+        tokens, updated, day, used, exhausted = row
+        tokens = min(burst, tokens + max(0.0, now - updated) * rate)
+        if day != datetime.date.today().isoformat():
+            used, exhausted = 0, False
+        return tokens, used, bool(exhausted)
+
+    @staticmethod
+    def _save(conn: sqlite3.Connection, name: str, tokens: float, used: int, exhausted: bool, now: float) -> None:
+        conn.execute(
+            "INSERT OR REPLACE INTO buckets (name, tokens, updated_at, day, used, exhausted) VALUES (?, ?, ?, ?, ?, ?)",
+            (name, tokens, now, datetime.date.today().isoformat(), used, int(exhausted)),
+        )
+
+    def _take(self, name: str, rate: float, burst: float, daily_limit: int) -> Tuple[bool, float, int, bool]:
+        now = time.time()
+        with self._write() as conn:
+            tokens, used, exhausted = self._bucket(conn, name, rate, burst, now)
+            granted = tokens >= 1 and not exhausted and not (daily_limit and used >= daily_limit)
+            if granted:
+                tokens -= 1
+                used += 1
+            self._save(conn, name, tokens, used, exhausted, now)
+        return granted, tokens, used, exhausted
+
+    def _give_back(self, name: str, rate: float, burst: float) -> None:
+        now = time.time()
+        with self._write() as conn:
+            tokens, used, exhausted = self._bucket(conn, name, rate, burst, now)
+            self._save(conn, name, tokens + 1, max(0, used - 1), exhausted, now)
+
+    def _drain(self, name: str, rate: float, burst: float) -> None:
+        now = time.time()
+        with self._write() as conn:
+            tokens, used, exhausted = self._bucket(conn, name, rate, burst, now)
+            self._save(conn, name, min(tokens, 0.0), used, exhausted, now)
+
+    def _mark_exhausted(self, name: str, rate: float, burst: float) -> None:
+        now = time.time()
+        with self._write() as conn:
+            tokens, used, _ = self._bucket(conn, name, rate, burst, now)
+            self._save(conn, name, tokens, used, True, now)
+
+    async def take(self, name: str, rate: float, burst: float, daily_limit: int = 0) -> Tuple[bool, float, int, bool]:
+        """取一个令牌，返回 (是否取到, 剩余令牌数, 当天已用次数, 是否已耗尽)；已耗尽或用量到了 daily_limit 时不发令牌"""
+        fut = asyncio.get_running_loop().run_in_executor(self._pool, self._take, name, rate, burst, daily_limit)
+        try:
+            return await asyncio.shield(fut)
+        except asyncio.CancelledError:
+            # 调用方被取消时事务照样会提交：取到的令牌还回去
+            def undo(f: asyncio.Future) -> None:
+                if not f.cancelled() and f.exception() is None and f.result()[0]:
+                    self.give_back(name, rate, burst)
+            fut.add_done_callback(undo)
+            raise
+
+    def _submit(self, fn: Any, *args: Any) -> None:
+        self._pool.submit(fn, *args).add_done_callback(self._log_failure)
+
+    async def _run(self, fn: Any, *args: Any) -> Any:
+        return await asyncio.get_running_loop().run_in_executor(self._pool, fn, *args)
+
+    @staticmethod
+    def _log_failure(f: Future) -> None:
+        if f.exception() is not None:
+            logger.warning("共享令牌桶读写失败: %s", f.exception())
+
+    def give_back(self, name: str, rate: float, burst: float) -> None:
+        """发出的令牌没有用掉（调用方被取消），还回桶里"""
+        self._submit(self._give_back, name, rate, burst)
+
+    def drain(self, name: str, rate: float, burst: float) -> None:
+        """被高德限流：清空令牌，所有 worker 一起暂停"""
+        self._submit(self._drain, name, rate, burst)
+
+    def mark_exhausted(self, name: str, rate: float, burst: float) -> None:
+        """日配额用尽：当天所有 worker 都不再放行"""
+        self._submit(self._mark_exhausted, name, rate, burst)
+
+    # --- 加载租约 ---
+    def _try_lease(self, keys: List[str], ttl: float) -> List[bool]:
+        now = time.time()
+        acquired = []
+        with self._write() as conn:
+            for key in keys:
+                # 没有租约、或原租约已过期（持有者崩溃/超时）时才能拿到
+                changed = conn.execute(
+                    "INSERT INTO leases (key, owner, expires_at) VALUES (?, ?, ?)"
+                    " ON CONFLICT(key) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at"
+                    " WHERE leases.expires_at <= ?",
+                    (key, self.owner, now + ttl, now),
+                ).rowcount
+                acquired.append(changed > 0)
+            self._count_leases(conn, now)
+        self.leases_acquired += sum(acquired)
+        self.leases_contended += len(acquired) - sum(acquired)
+        return acquired
+
+    def _release(self, keys: List[str]) -> None:
+        with self._write() as conn:
+            conn.executemany("DELETE FROM leases WHERE key = ? AND owner = ?", [(k, self.owner) for k in keys])
+            # 顺带清掉崩溃进程留下的过期租约（表里只有正在加载的 key，很小）
+            now = time.time()
+            conn.execute("DELETE FROM leases WHERE expires_at <= ?", (now,))
+            self._count_leases(conn, now)
+
+    def _count_leases(self, conn: sqlite3.Connection, now: float) -> None:
+        self.active_leases = conn.execute("SELECT COUNT(*) FROM leases WHERE expires_at > ?", (now,)).fetchone()[0]
+
+    def _held(self, key: str) -> bool:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT 1 FROM leases WHERE key = ? AND expires_at > ?", (key, time.time())
+            ).fetchone()
+        return row is not None
+
+    async def try_lease(self, keys: List[str], ttl: float) -> List[bool]:
+        """逐个尝试拿 key 的租约；共享状态不可用时当作都拿到，退回各进程自己加载"""
+        if not keys:
+            return []
+        try:
+            return await self._run(self._try_lease, keys, ttl)
+        except Exception as e:
+            logger.warning("共享状态获取租约失败: %s", e)
+            return [True] * len(keys)
+
+    async def release(self, keys: List[str]) -> None:
+        if not keys:
+            return
+        try:
+            await self._run(self._release, keys)
+        except Exception as e:
+            logger.warning("共享状态释放租约失败: %s", e)
+
+    async def held(self, key: str) -> bool:
+        """是否有进程（可能是本进程）持有该 key 的有效租约"""
+        try:
+            return await self._run(self._held, key)
+        except Exception as e:
+            logger.warning("共享状态读取租约失败: %s", e)
+            return False
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "path": self.path,
+            "owner": self.owner,
+            "active_leases": self.active_leases,  # 最近一次拿/放租约时的数目（含其他 worker 的）
+            "leases_acquired": self.leases_acquired,
+            "leases_contended": self.leases_contended,
+        }
+
+    def close(self) -> None:
+        """等还没写完的操作，释放本进程还持有的租约（worker 平滑退出时其他 worker 不必等到租约过期），然后关闭连接"""
+        self._pool.shutdown(wait=True)
+        with self._lock:
+            try:
+                self._conn.execute("DELETE FROM leases WHERE owner = ?", (self.owner,))
+            except sqlite3.Error as e:
+                logger.warning("共享状态释放租约失败: %s", e)
+            self._conn.close()
@@ -0,0 +1,112 @@
+from __future__ import annotations
+
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Sequence
+
+
+class _Call:
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """合并同一 key 的并发请求：同一时刻只有一个上游调用在飞，其余调用方等待并共享它的结果或异常。
+
+    上游调用跑在独立的 Task 里，单个调用方被取消不会连累其他等待者；
+    只有当所有等待者都取消时，才取消这次上游调用。
+    """
+
+    def __init__(self):
+        self._calls: Dict[Hashable, _Call] = {}
+        self.leaders = 0      # 实际发出的上游调用
+        self.collapsed = 0    # 被合并（搭便车）的调用
+        self.shared_errors = 0
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        call = self._calls.get(key)
+        leader = call is None
+        if leader:
+            call = self._start(key, asyncio.ensure_future(fn()))
+        else:
+            self.collapsed += 1
+        return await self._wait(call, leader)
+
+    async def do_many(self, keys: Sequence[Hashable], fn: Callable[[List[Hashable]], Awaitable[List[Any]]]) -> List[Any]:
+        """批量版 do：已经在飞的 key（无论由 do 还是 do_many 发起）等它的结果，其余 key 一起交给一次
+        fn(owned) 调用并各自登记为在飞，之后的 do / do_many 可以按单个 key 搭便车。
+
+        fn 返回与 owned 一一对应的结果，每个 key 的等待者只拿到自己那一条；fn 抛出的异常交给所有这些等待者。
+        keys 不能重复，返回值与 keys 一一对应。
+        """
+        calls = {k: self._calls.get(k) for k in keys}
+        owned = [k for k, call in calls.items() if call is None]
+        leaders = set(owned)
+        self.collapsed += len(keys) - len(owned)
+        if owned:
+            batch = asyncio.ensure_future(fn(owned))
+            live = [len(owned)]
+            for i, k in enumerate(owned):
+                calls[k] = self._start(k, asyncio.ensure_future(self._pick(batch, i, live)))
+        # 等待者计数在第一次挂起之前加上：调用方随时可能被取消，计数必须和下面的 finally 成对
+        for call in calls.values():
+            call.waiters += 1
+        try:
+            results = await asyncio.gather(*(asyncio.shield(calls[k].task) for k in keys), return_exceptions=True)
+        finally:
+            for call in calls.values():
+                call.waiters -= 1
+                if call.waiters == 0 and not call.task.done():
+                    call.task.cancel()
+        errors = [(k, r) for k, r in zip(keys, results) if isinstance(r, BaseException)]
+        if errors:
+            self.shared_errors += sum(1 for k, _ in errors if k not in leaders)
+            raise errors[0][1]
+        return results
+
+    @staticmethod
+    async def _pick(batch: asyncio.Future, i: int, live: List[int]) -> Any:
+        """批量调用中第 i 个 key 的结果；批量里所有 key 的等待者都取消时才取消批量调用"""
+        try:
+            return (await asyncio.shield(batch))[i]
+        except asyncio.CancelledError:
+            live[0] -= 1
+            if live[0] == 0:
+                batch.cancel()
+            raise
+
+    def _start(self, key: Hashable, task: asyncio.Future) -> _Call:
+        call = _Call(task)
+        self._calls[key] = call
+        task.add_done_callback(lambda _t, k=key, c=call: self._forget(k, c))
+        self.leaders += 1
+        return call
+
+    async def _wait(self, call: _Call, leader: bool) -> Any:
+        call.waiters += 1
+        try:
+            return await asyncio.shield(call.task)
+        except Exception:
+            if not leader:
+                self.shared_errors += 1
+            raise
+        finally:
+            call.waiters -= 1
+            if call.waiters == 0 and not call.task.done():
+                call.task.cancel()
+
+    def _forget(self, key: Hashable, call: _Call) -> None:
+        if self._calls.get(key) is call:
+            del self._calls[key]
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.leaders + self.collapsed
+        return {
+            "upstream_calls": self.leaders,
+            "collapsed_calls": self.collapsed,
+            "collapse_ratio": round(self.collapsed / total, 4) if total else 0.0,
+            "shared_errors": self.shared_errors,
+            "in_flight": len(self._calls),
+        }
@@ -0,0 +1,159 @@
+from __future__ import annotations
+
+from collections import OrderedDict
+from dataclasses import dataclass, field, replace
+from typing import Dict, Any, Hashable, Optional, Sequence, Tuple
+import math
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0088
+
+
+def haversine_km(a: Tuple[float, float], b: Tuple[float, float]) -> float:
+    """两点 (lng, lat) 间的球面直线距离（km）"""
+    lng1, lat1, lng2, lat2 = map(math.radians, (a[0], a[1], b[0], b[1]))
+    h = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(h))
+
+
+def haversine_matrix(coords: Sequence[Sequence[float]]) -> np.ndarray:
+    """所有点两两之间的直线距离矩阵（km），coords 为 N×2 的 (lng, lat)。
+
+    一次广播计算 N×N，几百个候选点也只需零点几毫秒，可替代绝大多数逐段的路线查询。
+    """
+    pts = np.radians(np.asarray(coords, dtype=np.float64).reshape(-1, 2))
+    lng = pts[:, 0]
+    lat = pts[:, 1]
+    dlat = lat[:, None] - lat[None, :]
+    dlng = lng[:, None] - lng[None, :]
+    cos_lat = np.cos(lat)
+    h = np.sin(dlat / 2) ** 2 + cos_lat[:, None] * cos_lat[None, :] * np.sin(dlng / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(h, 0.0, 1.0)))
+
+
+@dataclass
+class SpeedModel:
+    """直线距离 → 实际路程/耗时 的估算模型：路程 = 直线 × 绕路系数，耗时 = 固定开销 + 路程 / 速度。
+
+    observe() 记录真实的高德路线，按 (起点, 终点) 去重、最多保留最近 max_samples 条不同的路段，
+    样本够 min_samples 条后系数取这些路段的中位数：缓存命中反复观测同一条路段不会把系数带偏，
+    结果只取决于最近见过哪些路段、与观测顺序无关。样本不够时用初始的经验值。
+    """
+    detour: float
+    speed_kmh: float
+    overhead_min: float = 0.0
+    max_samples: int = 256
+    min_samples: int = 20
+    _samples: "OrderedDict[Hashable, Tuple[float, float]]" = field(default_factory=OrderedDict, repr=False, compare=False)
+
+    def __post_init__(self) -> None:
+        self._prior = (self.detour, self.speed_kmh)
+
+    def estimate(self, straight_km: float) -> Tuple[float, float]:
+        dist_km = straight_km * self.detour
+        return dist_km, self.overhead_min + dist_km / self.speed_kmh * 60
+
+    def observe(self, key: Hashable, straight_km: float, dist_km: float, duration_min: float) -> None:
+        # 太短的路段噪声大（起终点吸附到路网），不参与校准
+        if straight_km < 0.2 or dist_km <= 0 or duration_min <= self.overhead_min:
+            return
+        detour = min(max(dist_km / straight_km, 1.0), 3.0)
+        speed = min(max(dist_km / ((duration_min - self.overhead_min) / 60), 1.0), 80.0)
+        self._samples[key] = (detour, speed)
+        self._samples.move_to_end(key)
+        while len(self._samples) > self.max_samples:
+            self._samples.popitem(last=False)
+        if len(self._samples) >= self.min_samples:
+            detours, speeds = zip(*self._samples.values())
+            self.detour, self.speed_kmh = float(np.median(detours)), float(np.median(speeds))
+        else:
+            self.detour, self.speed_kmh = self._prior
+
+    def frozen(self) -> SpeedModel:
+        """当前系数的副本（不带样本）：一份行程从头到尾用同一组系数，不受规划过程中新观测的影响"""
+        return replace(self, _samples=OrderedDict())
+
+
+# 初始参数取城市内的经验值，运行中由真实路线校准
+SPEED_MODELS: Dict[str, SpeedModel] = {
+    "walk": SpeedModel(detour=1.3, speed_kmh=4.5),
+    "transit": SpeedModel(detour=1.4, speed_kmh=18.0, overhead_min=8.0),
+    "drive": SpeedModel(detour=1.4, speed_kmh=25.0, overhead_min=3.0),
+}
+
+
+def speed_snapshot() -> Dict[str, SpeedModel]:
+    return {mode: m.frozen() for mode, m in SPEED_MODELS.items()}
+
+
+def estimate_move(straight_km: float, mode: str = "walk", models: Optional[Dict[str, SpeedModel]] = None) -> Dict[str, Any]:
+    """按直线距离估算移动距离和时间（不调用高德），返回结构与 route_time 一致；models 为 speed_snapshot() 的快照"""
+    models = models or SPEED_MODELS
+    dist_km, duration_min = models.get(mode, models["walk"]).estimate(straight_km)
+    return {
+        "mode": mode,
+        "distance_km": round(dist_km, 2),
+        "est_duration_min": int(round(duration_min)),
+        "source": "estimate",
+    }
+
+
+def _project_km(coords: np.ndarray) -> np.ndarray:
+    """经纬度 → 以中心点为原点的局部平面坐标（km，等距圆柱投影），城市范围内误差可忽略"""
+    lat0 = np.radians(coords[:, 1].mean())
+    x = np.radians(coords[:, 0]) * np.cos(lat0) * EARTH_RADIUS_KM
+    y = np.radians(coords[:, 1]) * EARTH_RADIUS_KM
+    return np.column_stack([x, y])
+
+
+def balanced_clusters(coords: Sequence[Sequence[float]], k: int, seed: int = 0, max_iter: int = 15) -> np.ndarray:
+    """容量受限的 k-means：把 N 个 (lng, lat) 分成 k 组，每组最多 ceil(N/k) 个点。
+
+    k-means++ 初始化（固定随机种子，结果可复现）；每轮按“最近与次近中心的差距”从大到小依次分配，
+    优先照顾换组代价大的点，已满的组顺延到下一个最近的组。返回长度 N 的组号数组。
+    """
+    pts = _project_km(np.asarray(coords, dtype=np.float64).reshape(-1, 2))
+    n = len(pts)
+    if k <= 1:
+        return np.zeros(n, dtype=np.int64)
+    if n <= k:
+        return np.arange(n, dtype=np.int64)
+    capacity = -(-n // k)
+    rng = np.random.default_rng(seed)
+
+    # k-means++ 初始化
+    centers = [pts[rng.integers(n)]]
+    d2 = ((pts - centers[0]) ** 2).sum(axis=1)
+    for _ in range(1, k):
+        probs = d2 / d2.sum() if d2.sum() > 0 else np.full(n, 1.0 / n)
+        centers.append(pts[rng.choice(n, p=probs)])
+        d2 = np.minimum(d2, ((pts - centers[-1]) ** 2).sum(axis=1))
+    centers = np.asarray(centers)
+
+    labels = np.full(n, -1, dtype=np.int64)
+    for _ in range(max_iter):
+        d = ((pts[:, None, :] - centers[None, :, :]) ** 2).sum(axis=2)  # N×k
+        prefs = np.argsort(d, axis=1)
+        sorted_d = np.take_along_axis(d, prefs[:, :2], axis=1)
+        regret = sorted_d[:, 1] - sorted_d[:, 0]
+        order = np.argsort(-regret, kind="stable")
+
+        new_labels = np.empty(n, dtype=np.int64)
+        load = [0] * k
+        prefs_list = prefs.tolist()
+        for i in order.tolist():
+            for c in prefs_list[i]:
+                if load[c] < capacity:
+                    new_labels[i] = c
+                    load[c] += 1
+                    break
+
+        if np.array_equal(new_labels, labels):
+            break
+        labels = new_labels
+        sums = np.zeros_like(centers)
+        np.add.at(sums, labels, pts)
+        counts = np.bincount(labels, minlength=k)[:, None]
+        centers = np.where(counts > 0, sums / np.maximum(counts, 1), centers)
+
+    return labels
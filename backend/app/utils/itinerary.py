@@ -1,23 +1,61 @@
 from __future__ import annotations
-from typing import List, Dict, Any, Optional, Tuple
-from dataclasses import dataclass
-from app.services.gaode_mcp import AmapClient
+from typing import AsyncIterator, List, Dict, Any, Iterator, Optional, Tuple
+from contextlib import contextmanager
+from app.core import config
+from app.core.logging_config import debug_sampled
+from app.services.gaode_mcp import AsyncAmapClient, track_upstream
+from app.services.metrics import observe_plan
+from app.utils.query_plan import KEYWORD_YIELD, PoiQuery, plan_queries
+from app.utils.poi import PLACEHOLDER_POI, Poi
+from app.utils.geo import SPEED_MODELS, SpeedModel, balanced_clusters, estimate_move, haversine_matrix, speed_snapshot
+from app.utils.spatial import GridIndex, same_place
 from datetime import datetime, timedelta
+import asyncio
 import logging
+import time
+import numpy as np
 
-# 设置日志
-logging.basicConfig(level=logging.INFO)
+# 日志由应用入口配置（见 app.core.logging_config），这里只取 logger
 logger = logging.getLogger(__name__)
 
-@dataclass
 class Item:
-    time_slot: str
-    poi: Dict[str, Any]
-    move: Optional[Dict[str, Any]] = None
-    notes: Optional[str] = None
+    """某天某个时段的安排；move 为从上一个点到此处的移动，路段解析完成后写入。
+    整份行程（含缓存中的）都保存 Item / Poi，只在 km_day 整形时读出需要的字段"""
+
+    __slots__ = ("time_slot", "poi", "move", "notes")
+
+    def __init__(self, time_slot: str, poi: Poi, move: Optional[Dict[str, Any]] = None, notes: Optional[str] = None):
+        self.time_slot = time_slot
+        self.poi = poi
+        self.move = move
+        self.notes = notes
 
 SLOTS = ["morning", "noon", "afternoon"]
 
+
+class StageTimer:
+    """按阶段累计墙钟时间和本线程 CPU 时间（毫秒），同名阶段多次进入时累加。
+
+    CPU 时间用 thread_time 统计：阶段内 await 期间同一事件循环上其他协程消耗的 CPU 也会算进来，
+    因此只在单个请求顺序执行时（如 benchmark.py 的分阶段测量）才准确。
+    """
+
+    def __init__(self):
+        self.timings: Dict[str, Dict[str, float]] = {}
+
+    @contextmanager
+    def __call__(self, name: str) -> Iterator[None]:
+        wall, cpu = time.perf_counter(), time.thread_time()
+        try:
+            yield
+        finally:
+            t = self.timings.setdefault(name, {"wall_ms": 0.0, "cpu_ms": 0.0})
+            t["wall_ms"] += (time.perf_counter() - wall) * 1000
+            t["cpu_ms"] += (time.thread_time() - cpu) * 1000
+
+    def result(self) -> Dict[str, Dict[str, float]]:
+        return {name: {k: round(v, 3) for k, v in t.items()} for name, t in self.timings.items()}
+
 # 完善兴趣关键词映射，增加更多通用关键词
 INTEREST_KEYWORDS = {
     "history": ["博物馆", "古迹", "历史文化", "城墙", "故宫", "天坛", "长城", "历史", "文化", "遗址", "古建筑"],
@@ -36,162 +74,557 @@ UNIVERSAL_KEYWORDS = [
     "美食", "购物", "娱乐", "文化", "历史", "自然", "地标"
 ]
 
-def build_itinerary(client: AmapClient, city: str, days: int, interests: Optional[List[str]], starting_point: Optional[str], start_date: str) -> Dict[str, Any]:
-    logger.info(f"开始为{city}规划{days}天行程，兴趣: {interests}")
-    
-    # 1) 起点坐标（优先起点，否则用城市中心）
-    start_lnglat = None
-    if starting_point:
-        start_lnglat = client.geocode(starting_point, city=city)
-        logger.info(f"起点坐标: {start_lnglat}")
-    if not start_lnglat:
-        start_lnglat = client.geocode(city)
-        logger.info(f"城市中心坐标: {start_lnglat}")
+# POI 数量不足时使用的更通用关键词
+FALLBACK_KEYWORDS = ["景点", "旅游", "公园", "广场"]
+POI_PAGES_PER_KEYWORD = 2  # 每个关键词最多取2页
+# 主查询预计新增的 POI 不到 min_needed 的这么多倍时，第一波就把备用关键词一起发出
+FALLBACK_PREFETCH_MARGIN = 1.5
 
-    # 2) 基于兴趣搜集候选 POI
+def interest_keywords(interests: Optional[List[str]]) -> List[str]:
+    """兴趣 → 搜索关键词池；不在预定义列表中的兴趣直接作为关键词，为空时用通用关键词"""
     keywords_pool: List[str] = []
-    if interests:
-        for it in interests:
-            if it in INTEREST_KEYWORDS:
-                keywords_pool.extend(INTEREST_KEYWORDS[it])
-            else:
-                # 如果兴趣不在预定义列表中，直接使用作为关键词
-                keywords_pool.append(it)
-    
-    # 如果没有兴趣或兴趣关键词为空，使用通用关键词
-    if not keywords_pool:
-        keywords_pool = UNIVERSAL_KEYWORDS.copy()
-    
-    logger.info(f"搜索关键词池: {keywords_pool}")
+    for it in interests or []:
+        if it in INTEREST_KEYWORDS:
+            keywords_pool.extend(INTEREST_KEYWORDS[it])
+        else:
+            keywords_pool.append(it)
+    return keywords_pool or UNIVERSAL_KEYWORDS.copy()
+
+
+def _main_queries(city: str, keywords_pool: List[str]) -> List[Tuple[PoiQuery, int, int]]:
+    """主关键词的 (查询, 页码, 每页数量)，按发出顺序排列"""
+    if config.POI_QUERY_COMPACTION:
+        planned = plan_queries(city, keywords_pool, config.POI_KEYWORDS_PER_QUERY)
+        pages = {q: POI_PAGES_PER_KEYWORD * len(q.terms) for q in planned}
+        return [(q, page, 8) for page in range(1, max(pages.values(), default=0) + 1) for q in planned if page <= pages[q]]
+    return [(PoiQuery(kw, "", (kw,)), page, 8) for kw in keywords_pool for page in range(1, POI_PAGES_PER_KEYWORD + 1)]
+
+
+def first_page_queries(city: str, interests: Optional[List[str]]) -> List[Tuple[str, int, int, str]]:
+    """规划这组兴趣时会发出的第 1 页 POI 搜索，格式同 search_poi_many 的 queries（供预热使用）"""
+    return [(q.keywords, page, offset, q.types) for q, page, offset in _main_queries(city, interest_keywords(interests)) if page == 1]
+
+
+def _fallback_at_risk(city: str, queries: List[Tuple[PoiQuery, int, int]], min_needed: int) -> bool:
+    """按各关键词在本城市的历史新增数（没有历史时按整页乐观估计）估算主查询能凑到多少个 POI，
+    余量不足时备用关键词多半要用上"""
+    expected = sum(min(offset, sum(KEYWORD_YIELD.expected_new(city, t, live=True) for t in q.terms)) for q, _, offset in queries)
+    return expected < min_needed * FALLBACK_PREFETCH_MARGIN
+
+
+async def _collect_pois(client: AsyncAmapClient, city: str, keywords_pool: List[str], max_needed: int, min_needed: int) -> List[Poi]:
+    """并发搜集候选 POI。
+
+    POI_QUERY_COMPACTION 时先由 plan_queries 把关键词去重、按本城市历史贡献排序并合并成多关键词/分类查询，
+    按页码逐层展开（所有查询的第 1 页在前）；否则每个关键词单独查询、连续取 POI_PAGES_PER_KEYWORD 页。
+    查询按顺序提前发出一个窗口（受 POI_SEARCH_CONCURRENCY 限制；AMAP_BATCH_ENABLED 时每个窗口合并成一次批量请求；
+    查询规划开启时窗口按所需数量缩小），但结果严格按查询顺序合并，保证同样的输入得到同样的行程；
+    凑够数量后取消剩余请求。
+    主关键词最多收集 max_needed 个，不足 min_needed 时再用备用关键词结果补足。
+    预计主查询凑不够 min_needed 时（_fallback_at_risk），备用关键词的第一个窗口随主查询第一波一起发出，
+    不必等主查询用完再多一次往返；结果仍排在主查询之后合并，行程不受影响，用不上时取消。
+    """
+    compact = config.POI_QUERY_COMPACTION
+    fallback_pool = [kw for kw in FALLBACK_KEYWORDS if kw not in keywords_pool]
+    queries = _main_queries(city, keywords_pool)
+    if compact:
+        fallback = plan_queries(city, fallback_pool, config.POI_KEYWORDS_PER_QUERY)
+    else:
+        fallback = [PoiQuery(kw, "", (kw,)) for kw in fallback_pool]
+    n_main = len(queries)
+    # 备用关键词排在最后：只有主查询不够、合并到这里时才用上
+    queries += [(q, 1, 10) for q in fallback]
+    prefetch_fallback = n_main < len(queries) and _fallback_at_risk(city, queries[:n_main], min_needed)
+
+    batch = config.AMAP_BATCH_ENABLED
+    cap = max(1, config.AMAP_BATCH_MAX_OPS) if batch else config.POI_SEARCH_CONCURRENCY
+    if compact:
+        # 在途查询数按需要的页数估计（每页 8 个、留一倍余量），需要的少就少发
+        window = min(max(1, -(-2 * max_needed // 8)), cap)
+    else:
+        window = min(max(config.POI_SEARCH_CONCURRENCY, -(-2 * max_needed // 8)), cap) if batch else len(queries)
+    last_new: Dict[PoiQuery, int] = {}  # 查询 -> 上一页新增的 POI 数
+
+    def covered(j: int) -> bool:
+        # 上一页一个新 POI 都没有：结果已被前面的查询覆盖，后面的页不再查
+        return compact and last_new.get(queries[j][0]) == 0
+
+    sem = asyncio.Semaphore(config.POI_SEARCH_CONCURRENCY)
+
+    async def fetch(q: PoiQuery, page: int, offset: int) -> List[Poi]:
+        async with sem:
+            return await client.search_poi(city, keywords=q.keywords, page=page, offset=offset, types=q.types)
+
+    tasks: List[asyncio.Future] = []
+    launched: Dict[int, Tuple[asyncio.Future, int]] = {}  # 查询下标 -> (任务, 在批量结果中的位置，单个请求为 -1)
+
+    def ensure(i: int) -> None:
+        """保证从 i 起的 window 个未被覆盖的查询已经发出；批量模式下一次发一整波。
+        主查询和备用关键词的窗口分开算，只有 prefetch_fallback 时第一波顺带发出备用关键词的第一个窗口"""
+        if batch and i in launched:
+            return
+        end = n_main if i < n_main else len(queries)
+        ahead = [j for j in range(i, end) if not covered(j)][:window]
+        if prefetch_fallback and not launched and i < n_main:
+            ahead += list(range(n_main, len(queries)))[:window]
+        new = [j for j in ahead if j not in launched]
+        if not new:
+            return
+        if batch:
+            t = asyncio.ensure_future(client.search_poi_many(city, [(queries[j][0].keywords, queries[j][1], queries[j][2], queries[j][0].types) for j in new]))
+            tasks.append(t)
+            for pos, j in enumerate(new):
+                launched[j] = (t, pos)
+        else:
+            for j in new:
+                t = asyncio.create_task(fetch(*queries[j]))
+                tasks.append(t)
+                launched[j] = (t, -1)
 
     seen = set()
-    poi_list: List[Dict[str, Any]] = []
-    
-    # 优化POI搜索逻辑 - 减少搜索页数，优先获取高质量结果
-    max_pois_needed = days * len(SLOTS) * 2  # 需要的最多POI数量
-    
-    for kw in keywords_pool:
-        if len(poi_list) >= max_pois_needed:
-            break
-            
-        logger.info(f"搜索关键词: {kw}")
-        for page in range(1, 3):  # 减少到最多2页
+    poi_list: List[Poi] = []
+    # 近似去重：同一地点的不同坐标/名称变体（如“故宫博物院”与“故宫博物院-午门”）只保留先出现的那个
+    index = GridIndex(cell_km=max(config.POI_DEDUP_RADIUS_M / 1000.0, 0.05))
+    merged = 0
+    skipped = 0
+    try:
+        for i in range(len(queries)):
+            limit = max_needed if i < n_main else min_needed
+            if len(poi_list) >= limit:
+                break
+            if i == n_main:
+                logger.info("POI数量不足(%d)，使用更通用的关键词补充", len(poi_list))
+
+            q, page, _ = queries[i]
+            if covered(i):
+                skipped += 1
+                continue
+            ensure(i)
+            task, pos = launched[i]
             try:
-                pois = client.search_poi(city, keywords=kw, page=page, offset=8)  # 减少每页数量
-                logger.info(f"关键词'{kw}'第{page}页找到{len(pois)}个POI")
-                
-                for p in pois:
-                    key = (p["name"], tuple(p["location"]))
-                    if key in seen:
-                        continue
-                    seen.add(key)
-                    poi_list.append(p)
-                    
-                    if len(poi_list) >= max_pois_needed:
-                        break
-                
-                if len(poi_list) >= max_pois_needed:
-                    break
-                    
+                pois = await task
+                if pos >= 0:
+                    pois = pois[pos]
             except Exception as e:
-                logger.error(f"搜索关键词'{kw}'第{page}页时出错: {e}")
+                logger.error("搜索关键词'%s'第%d页时出错: %s", q.label, page, e)
                 continue
-        
-        if len(poi_list) >= max_pois_needed:
-            break
-    
-    logger.info(f"总共收集到{len(poi_list)}个POI")
-    
-    # 如果POI数量不足，使用更通用的关键词快速补充
-    if len(poi_list) < days * len(SLOTS):
-        logger.info("POI数量不足，使用更通用的关键词搜索")
-        fallback_keywords = ["景点", "旅游", "公园", "广场"]
-        for kw in fallback_keywords:
-            if kw not in keywords_pool and len(poi_list) < days * len(SLOTS):
-                try:
-                    pois = client.search_poi(city, keywords=kw, page=1, offset=10)
-                    for p in pois:
-                        key = (p["name"], tuple(p["location"]))
-                        if key not in seen:
-                            seen.add(key)
-                            poi_list.append(p)
-                            if len(poi_list) >= days * len(SLOTS):
-                                break
-                    if len(poi_list) >= days * len(SLOTS):
-                        break
-                except Exception as e:
-                    logger.error(f"备用关键词'{kw}'搜索出错: {e}")
+            debug_sampled(logger, "search", "关键词'%s'第%d页找到%d个POI", q.label, page, len(pois))
+            before = len(poi_list)
+
+            for p in pois:
+                key = (p.name, p.location)
+                if key in seen:
                     continue
-    
-    logger.info(f"最终POI数量: {len(poi_list)}")
+                seen.add(key)
+                lng, lat = p.lng, p.lat
+                near = index.query_radius(lng, lat, config.POI_DEDUP_RADIUS_M / 1000.0)
+                if any(same_place(poi_list[j], p) for j, _ in near):
+                    merged += 1
+                    continue
+                index.add(len(poi_list), lng, lat)
+                poi_list.append(p)
+                if len(poi_list) >= limit:
+                    break
+            last_new[q] = len(poi_list) - before
+            KEYWORD_YIELD.record(city, q, len(pois), last_new[q])
+    finally:
+        pending = [t for t in tasks if not t.done()]
+        for t in pending:
+            t.cancel()
+        if pending:
+            logger.debug("已凑够POI，取消%d个未完成的搜索请求", len(pending))
+            await asyncio.gather(*pending, return_exceptions=True)
 
-    # 3) 按天填充 & 估算移动（优化：减少路径规划调用）
-    days_blocks: List[Dict[str, Any]] = []
-    idx = 0
-    prev = start_lnglat
-    
-    for d in range(days):
+    if merged:
+        logger.debug("合并了%d个近似重复的POI", merged)
+    if skipped:
+        logger.debug("跳过了%d个已被覆盖的查询页", skipped)
+    return poi_list
+
+def _filter_near_start(poi_list: List[Poi], start: Tuple[float, float], radius_km: float, min_needed: int) -> List[Poi]:
+    """只保留起点 radius_km 范围内的候选；范围内不够 min_needed 个时，改为保留离起点最近的 min_needed 个。
+    保持原有的搜索结果顺序，结果可复现。
+    """
+    index = GridIndex(cell_km=max(radius_km / 4, 0.25), ref_lat=start[1])
+    for i, p in enumerate(poi_list):
+        index.add(i, p.lng, p.lat)
+    keep = [i for i, _ in index.query_radius(start[0], start[1], radius_km)]
+    if len(keep) < min_needed:
+        keep = [i for i, _ in index.nearest(start[0], start[1], k=min_needed)]
+    keep_set = set(keep)
+    return [p for i, p in enumerate(poi_list) if i in keep_set]
+
+# --- 行程顺序优化：最近邻构造 + 2-opt / Or-opt 改进（开放路径，起点固定、终点自由） ---
+
+def _path_length(dist: np.ndarray, start: Optional[int], path: List[int]) -> float:
+    nodes = ([start] if start is not None else []) + path
+    if len(nodes) < 2:
+        return 0.0
+    idx = np.asarray(nodes)
+    return float(dist[idx[:-1], idx[1:]].sum())
+
+def _nearest_neighbour(dist: np.ndarray, start: Optional[int], candidates: np.ndarray, k: int) -> List[int]:
+    """从 start 出发，每次走向最近的未访问候选点，选出 k 个点"""
+    remaining = candidates.copy()
+    path: List[int] = []
+    cur = start
+    while remaining.size and len(path) < k:
+        if cur is None:
+            j = 0  # 没有起点时从第一个候选点开始
+        else:
+            j = int(np.argmin(dist[cur, remaining]))
+        cur = int(remaining[j])
+        path.append(cur)
+        remaining = np.delete(remaining, j)
+    return path
+
+def _two_opt(dist: np.ndarray, start: Optional[int], path: List[int], deadline: float) -> List[int]:
+    """2-opt：反转 path[i..j] 能缩短总长就接受，直到没有改进或超出时间预算"""
+    nodes = ([start] if start is not None else []) + path
+    fixed = 1 if start is not None else 0  # 有起点时第一个节点不能动
+    n = len(nodes)
+    improved = True
+    while improved and time.perf_counter() < deadline:
+        improved = False
+        for i in range(fixed, n - 1):
+            b = nodes[i]
+            js = np.arange(i + 1, n)
+            c = np.asarray(nodes)[js]
+            # 开放路径：i 为第一个节点（没有起点）时没有前驱边，j 为最后一个节点时没有后继边
+            if i > 0:
+                a = nodes[i - 1]
+                head_old, head_new = dist[a, b], dist[a, c]
+            else:
+                head_old, head_new = 0.0, 0.0
+            nxt = np.asarray(nodes + [nodes[-1]])[js + 1]
+            tail_old = np.where(js < n - 1, dist[c, nxt], 0.0)
+            tail_new = np.where(js < n - 1, dist[b, nxt], 0.0)
+            delta = head_new + tail_new - head_old - tail_old
+            k = int(np.argmin(delta))
+            if delta[k] < -1e-9:
+                j = int(js[k])
+                nodes[i:j + 1] = nodes[i:j + 1][::-1]
+                improved = True
+    return nodes[fixed:]
+
+def _or_opt(dist: np.ndarray, start: Optional[int], path: List[int], deadline: float) -> List[int]:
+    """Or-opt：把长度 1~3 的连续片段挪到别处（可翻转），总长变短就接受"""
+    best = list(path)
+    best_len = _path_length(dist, start, best)
+    improved = True
+    while improved and time.perf_counter() < deadline:
+        improved = False
+        for seg_len in (1, 2, 3):
+            for i in range(len(best) - seg_len + 1):
+                seg = best[i:i + seg_len]
+                rest = best[:i] + best[i + seg_len:]
+                for pos in range(len(rest) + 1):
+                    if pos == i:
+                        continue
+                    for cand_seg in (seg, seg[::-1]):
+                        cand = rest[:pos] + cand_seg + rest[pos:]
+                        cand_len = _path_length(dist, start, cand)
+                        if cand_len < best_len - 1e-9:
+                            best, best_len = cand, cand_len
+                            improved = True
+                            break
+                    if improved or time.perf_counter() >= deadline:
+                        break
+                if improved or time.perf_counter() >= deadline:
+                    break
+            if improved or time.perf_counter() >= deadline:
+                break
+    return best
+
+def _optimize_days(dist: np.ndarray, coords: np.ndarray, days: int, has_start: bool) -> Tuple[List[List[int]], Dict[str, Any]]:
+    """为每天选出并排序景点，返回每天的点下标（指向 [起点] + poi_list）及优化统计。
+
+    多天行程先用 balanced_clusters 把候选点分成 days 个紧凑的组，每天只在一个组里选点，
+    组的先后顺序按“离当前位置最近的组”依次决定。每天从前一天最后一个景点（第一天从起点）出发，
+    用最近邻在组内选出当天的景点（组内不够时从其余候选补足），再用 2-opt / Or-opt 调整顺序；
+    每天的改进阶段不超过 ROUTE_OPT_BUDGET_MS 毫秒。
+    统计中的 baseline_km 为按搜索结果顺序依次填充时的总直线距离。
+    """
+    t0 = time.perf_counter()
+    per_day = len(SLOTS)
+    n_pois = len(coords)
+    remaining = np.arange(1, n_pois + 1)
+    prev: Optional[int] = 0 if has_start else None
+    day_orders: List[List[int]] = []
+
+    groups: List[np.ndarray] = []
+    if config.DAY_CLUSTERING and days > 1 and n_pois > per_day:
+        labels = balanced_clusters(coords, days, seed=config.DAY_CLUSTER_SEED)
+        groups = [np.flatnonzero(labels == c) + 1 for c in range(days)]
+    cluster_ms = (time.perf_counter() - t0) * 1000
+
+    for _ in range(days):
+        candidates = remaining
+        groups = [g[np.isin(g, remaining)] for g in groups]
+        groups = [g for g in groups if g.size]
+        if groups:
+            if prev is None:
+                gi = 0
+            else:
+                gi = int(np.argmin([dist[prev, g].min() for g in groups]))
+            candidates = groups.pop(gi)
+
+        path = _nearest_neighbour(dist, prev, candidates, per_day)
+        if len(path) < per_day:
+            # 组内点不够，从其余候选中就近补足
+            others = remaining[~np.isin(remaining, path)]
+            path += _nearest_neighbour(dist, path[-1] if path else prev, others, per_day - len(path))
+        if config.ROUTE_OPTIMIZE and len(path) > 1:
+            deadline = time.perf_counter() + config.ROUTE_OPT_BUDGET_MS / 1000.0
+            path = _two_opt(dist, prev, path, deadline)
+            path = _or_opt(dist, prev, path, deadline)
+        day_orders.append(path)
+        remaining = remaining[~np.isin(remaining, path)]
+        if path:
+            prev = path[-1]
+
+    used = min(n_pois, days * per_day)
+    start = 0 if has_start else None
+    baseline = _path_length(dist, start, list(range(1, used + 1)))
+    optimized = _path_length(dist, start, [i for day in day_orders for i in day])
+    stats = {
+        "baseline_km": round(baseline, 2),
+        "optimized_km": round(optimized, 2),
+        "saved_km": round(baseline - optimized, 2),
+        "saved_pct": round((baseline - optimized) / baseline * 100, 1) if baseline > 0 else 0.0,
+        "clustered": bool(config.DAY_CLUSTERING and days > 1 and n_pois > per_day),
+        "cluster_ms": round(cluster_ms, 2),
+        "elapsed_ms": round((time.perf_counter() - t0) * 1000, 2),
+    }
+    return day_orders, stats
+
+def _assign_slots(poi_list: List[Poi], day_orders: List[List[int]], has_start: bool) -> Tuple[List[List[Item]], List[List[Tuple[Item, int, int]]]]:
+    """按 _optimize_days 给出的顺序填充每天的时段（不发起任何请求）。
+
+    返回每天的 Item 列表，以及每天需要查询移动方式的路段 (item, 起点下标, 终点下标)。
+    下标指向 [起点] + poi_list 组成的点列（0 为起点，i+1 为 poi_list[i]）；
+    路段起点沿用上一个有效景点（跨天延续），第一个路段从起点出发（如果有）。
+    """
+    day_items: List[List[Item]] = []
+    day_legs: List[List[Tuple[Item, int, int]]] = []
+    prev: Optional[int] = 0 if has_start else None
+
+    for order in day_orders:
         items: List[Item] = []
-        for s in SLOTS:
-            if idx < len(poi_list):
-                poi = poi_list[idx]
-                curr = (poi["location"][0], poi["location"][1])
-                
-                # 优化：只在有前一个坐标时才计算路径
-                move = None
-                if prev and prev != (0, 0):
-                    try:
-                        move = client.route_time(prev, curr, mode="walk", city=city)
-                    except Exception as e:
-                        logger.warning(f"路径规划失败: {e}")
-                        # 路径规划失败不影响整体流程
-                
-                items.append(Item(time_slot=s, poi=poi, move=move, notes=None))
-                prev = curr
-                idx += 1
+        legs: List[Tuple[Item, int, int]] = []
+        for k, s in enumerate(SLOTS):
+            if k < len(order):
+                point = order[k]
+                item = Item(time_slot=s, poi=poi_list[point - 1], move=None, notes=None)
+                # 只在有前一个坐标时才计算路径
+                if prev is not None:
+                    legs.append((item, prev, point))
+                items.append(item)
+                prev = point
             else:
                 # 如果POI不足，创建占位项
-                placeholder_poi = {
-                    "name": f"待定景点",
-                    "category": "景点",
-                    "location": [0, 0],
-                    "address": "待定"
-                }
-                items.append(Item(time_slot=s, poi=placeholder_poi, move=None, notes="需要手动添加景点"))
-        
-        days_blocks.append({"date": _date_plus(start_date, d), "items": [i.__dict__ for i in items]})
+                items.append(Item(time_slot=s, poi=PLACEHOLDER_POI, move=None, notes="需要手动添加景点"))
+        day_items.append(items)
+        day_legs.append(legs)
+
+    return day_items, day_legs
+
+async def _route_legs(client: AsyncAmapClient, city: str, legs: List[Tuple[Tuple[float, float], Tuple[float, float], float]], mode: str = "walk",
+                      sem: Optional[asyncio.Semaphore] = None, models: Optional[Dict[str, SpeedModel]] = None) -> List[Dict[str, Any]]:
+    """解析所有路段 (起点, 终点, 直线距离km)，结果与 legs 一一对应，move.source 标明来源。
+
+    ROUTING_MODE=fast 时全部使用本地估算；否则直线距离短于 ROUTE_ESTIMATE_BELOW_KM 的路段直接估算，
+    其余路段并发查询高德（受 ROUTE_CONCURRENCY 限制，多次调用可传入同一个 sem 共享上限），
+    AMAP_BATCH_ENABLED 时合并为一次批量请求；超时或失败的路段退化为估算，不阻塞整个行程。
+    估算用 models（整份行程共用的 speed_snapshot()，不传时现取一份），高德返回的真实路线只用于校准全局模型。
+    """
+    sem = sem or asyncio.Semaphore(config.ROUTE_CONCURRENCY)
+    models = models or speed_snapshot()
+    fast = config.ROUTING_MODE == "fast"
+
+    async def resolve(origin: Tuple[float, float], dest: Tuple[float, float], straight_km: float) -> Dict[str, Any]:
+        if fast or straight_km < config.ROUTE_ESTIMATE_BELOW_KM:
+            return estimate_move(straight_km, mode, models)
+
+        move = None
+        async with sem:
+            try:
+                move = await asyncio.wait_for(
+                    client.route_time(origin, dest, mode=mode, city=city),
+                    timeout=config.ROUTE_LEG_TIMEOUT_SECONDS,
+                )
+            except asyncio.TimeoutError:
+                logger.warning("路径规划超时(%ss)，改用估算: %s -> %s", config.ROUTE_LEG_TIMEOUT_SECONDS, origin, dest)
+            except Exception as e:
+                # 路径规划失败不影响整体流程
+                logger.warning("路径规划失败: %s", e)
+        if not move:
+            return estimate_move(straight_km, mode, models)
+
+        # 用真实路线校准本地估算模型
+        SPEED_MODELS[mode].observe((origin, dest), straight_km, move["distance_km"], move["est_duration_min"])
+        return {**move, "source": "amap"}
+
+    if not config.AMAP_BATCH_ENABLED or fast:
+        return list(await asyncio.gather(*(resolve(o, d, km) for o, d, km in legs)))
+
+    # 批量模式：需要查高德的路段合并成一次批量请求，整体超时或失败时这些路段全部改用估算
+    moves = [estimate_move(km, mode, models) for _, _, km in legs]
+    remote = [i for i, (_, _, km) in enumerate(legs) if km >= config.ROUTE_ESTIMATE_BELOW_KM]
+    if not remote:
+        return moves
+    try:
+        routes = await asyncio.wait_for(
+            client.route_time_many([(legs[i][0], legs[i][1]) for i in remote], mode=mode, city=city),
+            timeout=config.ROUTE_LEG_TIMEOUT_SECONDS,
+        )
+    except asyncio.TimeoutError:
+        logger.warning("批量路径规划超时(%ss)，%d个路段改用估算", config.ROUTE_LEG_TIMEOUT_SECONDS, len(remote))
+        return moves
+    except Exception as e:
+        logger.warning("批量路径规划失败: %s", e)
+        return moves
+    for i, move in zip(remote, routes):
+        if move:
+            SPEED_MODELS[mode].observe((legs[i][0], legs[i][1]), legs[i][2], move["distance_km"], move["est_duration_min"])
+            moves[i] = {**move, "source": "amap"}
+    return moves
+
+async def iter_itinerary(client: AsyncAmapClient, city: str, days: int, interests: Optional[List[str]], starting_point: Optional[str], start_date: str) -> AsyncIterator[Tuple[str, Any]]:
+    """分阶段生成行程，每完成一步就产出一个事件：
+
+    - ("start", 起点坐标或 None)：地理编码完成后
+    - ("day", 当天的 {"date", "items"})：按天的顺序，当天所有路段解析完就产出
+    - ("done", 完整行程)：与 build_itinerary 的返回值相同
+
+    所有天的路段在排序完成后同时开始解析（共享 ROUTE_CONCURRENCY 上限），调用方提前停止迭代时会取消未完成的路段。
+    完整行程的 debug_info.upstream 记录本次实际发往高德的请求数（每份行程的上游搜索次数是查询规划的核心指标）。
+    """
+    with track_upstream() as upstream:
+        async for event, data in _plan_stages(client, city, days, interests, starting_point, start_date):
+            if event == "done":
+                data["debug_info"]["upstream"] = dict(upstream)
+                KEYWORD_YIELD.record_plan(upstream)
+                observe_plan(data["debug_info"])
+                logger.debug("本次行程上游请求: %s", upstream)
+            yield event, data
+
+async def _plan_stages(client: AsyncAmapClient, city: str, days: int, interests: Optional[List[str]], starting_point: Optional[str], start_date: str) -> AsyncIterator[Tuple[str, Any]]:
+    logger.info("开始为%s规划%d天行程，兴趣: %s", city, days, interests)
+    
+    stage = StageTimer()
+
+    # 1) 起点坐标（优先起点，否则用城市中心）
+    start_lnglat = None
+    with stage("geocode"):
+        if starting_point:
+            start_lnglat = await client.geocode(starting_point, city=city)
+            logger.debug("起点坐标: %s", start_lnglat)
+        if not start_lnglat:
+            start_lnglat = await client.geocode(city)
+            logger.debug("城市中心坐标: %s", start_lnglat)
+    yield "start", start_lnglat
+
+    # 2) 基于兴趣搜集候选 POI
+    keywords_pool = interest_keywords(interests)
+    logger.debug("搜索关键词池: %s", keywords_pool)
+
+    with stage("collect"):
+        # 优化POI搜索逻辑 - 减少搜索页数，优先获取高质量结果
+        max_pois_needed = days * len(SLOTS) * 2  # 需要的最多POI数量
+        poi_list = await _collect_pois(client, city, keywords_pool, max_pois_needed, days * len(SLOTS))
+
+        has_start = bool(start_lnglat) and start_lnglat != (0, 0)
+        # 指定了出发点时，只保留出发点附近的候选
+        if starting_point and has_start and config.START_RADIUS_KM > 0:
+            poi_list = _filter_near_start(poi_list, start_lnglat, config.START_RADIUS_KM, days * len(SLOTS))
+
+    logger.info("%s 最终POI数量: %d", city, len(poi_list))
+
+    with stage("order"):
+        # 候选点两两直线距离矩阵：[起点] + poi_list，供排序和估算移动时间使用
+        points = [start_lnglat if has_start else (0.0, 0.0)] + [p.location for p in poi_list]
+        dist = haversine_matrix(points)
+
+        # 3) 按地理位置分天、每天选点并优化顺序，再填充时段，得到每天的路段
+        day_orders, route_stats = _optimize_days(dist, np.asarray(points[1:], dtype=np.float64).reshape(-1, 2), days, has_start)
+        logger.debug("行程顺序优化: %s", route_stats)
+        day_items, day_legs = _assign_slots(poi_list, day_orders, has_start)
+
+    # 4) 所有天的路段同时开始解析（估算或并发查询高德），按天依次写回 Item.move 并产出
+    sem = asyncio.Semaphore(config.ROUTE_CONCURRENCY)
+    models = speed_snapshot()
+    tasks = [
+        asyncio.ensure_future(_route_legs(client, city, [(points[i], points[j], float(dist[i, j])) for _, i, j in legs], sem=sem, models=models))
+        for legs in day_legs
+    ]
+    moves: List[Dict[str, Any]] = []
+    days_blocks: List[Dict[str, Any]] = []
+    try:
+        for d, (items, legs, task) in enumerate(zip(day_items, day_legs, tasks)):
+            with stage("routing"):
+                day_moves = await task
+                for (item, _, _), move in zip(legs, day_moves):
+                    item.move = move
+                moves.extend(day_moves)
+                block = {"date": _date_plus(start_date, d), "items": items}
+            days_blocks.append(block)
+            yield "day", block
+    finally:
+        for t in tasks:
+            if not t.done():
+                t.cancel()
 
     # 生成地图路线
     polylines = []
     if len(days_blocks) and len(days_blocks[0]["items"]) >= 2:
         first_day = days_blocks[0]["items"]
-        valid_items = [item for item in first_day if item.get("poi", {}).get("location") != [0, 0]]
+        valid_items = [item for item in first_day if item.poi.location != (0, 0)]
         if len(valid_items) >= 2:
-            a = valid_items[0]["poi"]["location"]
-            b = valid_items[1]["poi"]["location"]
+            a = list(valid_items[0].poi.location)
+            b = list(valid_items[1].poi.location)
             polylines.append({"coords": [a, b], "mode": "walk"})
 
     overview = f"为{city}规划的{days}天行程，包含{len(poi_list)}个推荐景点。"
     if len(poi_list) < days * len(SLOTS):
         overview += "部分时段需要手动添加景点。"
 
-    return {
+    yield "done", {
         "city": city, 
         "days_total": days, 
         "overview": overview, 
+        "start": list(start_lnglat) if has_start else None,
         "days": days_blocks, 
         "map": {"polylines": polylines},
         "debug_info": {
             "total_pois": len(poi_list),
             "keywords_used": keywords_pool[:10],  # 只显示前10个关键词
-            "search_success": len(poi_list) > 0
+            "search_success": len(poi_list) > 0,
+            "route_optimization": route_stats,
+            "routing": {
+                "mode": config.ROUTING_MODE,
+                "amap_legs": sum(1 for m in moves if m.get("source") == "amap"),
+                "estimated_legs": sum(1 for m in moves if m.get("source") == "estimate"),
+            },
+            "timings_ms": stage.result(),
         }
     }
 
+async def build_itinerary(client: AsyncAmapClient, city: str, days: int, interests: Optional[List[str]], starting_point: Optional[str], start_date: str) -> Dict[str, Any]:
+    async for event, data in iter_itinerary(client, city, days, interests, starting_point, start_date):
+        if event == "done":
+            return data
+    raise RuntimeError("行程生成未完成")
+
 def _date_plus(ymd: str, offset_days: int) -> str:
     dt = datetime.strptime(ymd, "%Y-%m-%d") + timedelta(days=offset_days)
     return dt.strftime("%Y-%m-%d")
 
+def apply_dates(plan: Dict[str, Any], start_date: str) -> Dict[str, Any]:
+    """把（可能来自缓存的）行程换成从 start_date 开始的日期，返回新对象，不修改原行程"""
+    days = [{**day, "date": _date_plus(start_date, d)} for d, day in enumerate(plan.get("days", []))]
+    return {**plan, "days": days}
+
 from urllib.parse import quote
 
 def _amap_marker_link(lng: float, lat: float, name: str) -> str:
@@ -204,65 +637,71 @@ def _amap_direction_link(origin: tuple, dest: tuple, tname: str) -> str:
     d = f"{dest[0]},{dest[1]}"
     return f"https://uri.amap.com/direction?from={o}&to={d}&t=walk&name={quote(tname)}"
 
-def to_km_travel(plan: Dict[str, Any]) -> Dict[str, Any]:
-    """把 /api/plan 的返回（PlanResponse JSON） 转成 kmTravel 风格内容模型"""
-    city = plan.get("city", "")
-    days_total = plan.get("days_total", 0)
-    out_days = []
-    all_days = plan.get("days", [])
-
-    for di, day in enumerate(all_days, start=1):
-        date = day.get("date", "")
-        items = day.get("items", [])
-        spots = []
-        prev_coord = None
-
-        for it in items:
-            poi = it.get("poi") or {}
-            name = poi.get("name") or "POI"
-            loc = poi.get("location") or []
-            
-            # 验证坐标有效性
-            lng, lat = None, None
-            if len(loc) == 2 and isinstance(loc[0], (int, float)) and isinstance(loc[1], (int, float)):
-                if loc[0] != 0 and loc[1] != 0:  # 排除 (0,0) 无效坐标
-                    lng, lat = loc[0], loc[1]
-
-            # stay_suggested_hours：简易估算（可按品类定制；这里只做演示：2小时）
-            stay = 2.0
-
-            navs = []
-            # 只有有效坐标才生成导航链接
-            if lng is not None and lat is not None:
-                navs.append({"text": "在高德看点位", "href": _amap_marker_link(lng, lat, name)})
-                if prev_coord and prev_coord != (0, 0):  # 确保前一个坐标也有效
-                    navs.append({"text": "从上个点步行导航", "href": _amap_direction_link(prev_coord, (lng, lat), name)})
-
-            # 如果是占位景点，不生成导航链接
-            if name == "待定景点":
-                navs = []  # 清空导航链接
-                name = "待定景点（需要手动添加）"
-
-            spots.append({
-                "name": name,
-                "desc": poi.get("category") or "",      # 你可以在生成逻辑里注入更丰富的文案
-                "stay_suggested_hours": stay,
-                "image": None,                           # 预留图片位：后续可打接高德/小红书图
-                "nav_links": navs,
-            })
-            
-            # 只有有效坐标才更新前一个坐标
-            if lng is not None and lat is not None:
-                prev_coord = (lng, lat)
-
-        out_days.append({
-            "title": f"Day {di}: {city}（{date}）" if city else f"Day {di}（{date}）",
-            "intro": None,
-            "spots": spots,
-            "transport_note": "景点之间建议步行/打车，远距离可地铁/公交。",
+def km_header(city: str, days_total: int) -> Dict[str, Any]:
+    """kmTravel 内容模型中与具体天无关的头部"""
+    return {
+        "title": f"{city}{days_total}天旅行攻略" if city else f"{days_total}天旅行攻略",
+        "subtitle": "根据兴趣与相邻点路况自动生成（演示版）",
+        "weather": None,   # 想接近示例页可接气象 API 填充
+        "tips": [
+            "建议提前预约热门景点；合理安排行程与用餐。",
+            "尽量错峰出行，注意当地天气与交通。",
+        ],
+    }
+
+def km_day(di: int, day: Dict[str, Any], city: str) -> Dict[str, Any]:
+    """把一天的 {"date", "items": [Item]} 转成 KmDay（di 从 1 开始），Poi 在这里才取出字段"""
+    date = day.get("date", "")
+    items = day.get("items", [])
+    spots = []
+    prev_coord = None
+
+    for it in items:
+        poi = it.poi
+        name = poi.name or "POI"
+        
+        # 验证坐标有效性
+        lng, lat = None, None
+        if poi.lng != 0 and poi.lat != 0:  # 排除 (0,0) 无效坐标
+            lng, lat = poi.lng, poi.lat
+
+        # stay_suggested_hours：简易估算（可按品类定制；这里只做演示：2小时）
+        stay = 2.0
+
+        navs = []
+        # 只有有效坐标才生成导航链接
+        if lng is not None and lat is not None:
+            navs.append({"text": "在高德看点位", "href": _amap_marker_link(lng, lat, name)})
+            if prev_coord and prev_coord != (0, 0):  # 确保前一个坐标也有效
+                navs.append({"text": "从上个点步行导航", "href": _amap_direction_link(prev_coord, (lng, lat), name)})
+
+        # 如果是占位景点，不生成导航链接
+        if name == "待定景点":
+            navs = []  # 清空导航链接
+            name = "待定景点（需要手动添加）"
+
+        spots.append({
+            "name": name,
+            "desc": poi.category or "",      # 你可以在生成逻辑里注入更丰富的文案
+            "stay_suggested_hours": stay,
+            "image": None,                           # 预留图片位：后续可打接高德/小红书图
+            "nav_links": navs,
+            "move": it.move,
         })
+        
+        # 只有有效坐标才更新前一个坐标
+        if lng is not None and lat is not None:
+            prev_coord = (lng, lat)
+
+    return {
+        "title": f"Day {di}: {city}（{date}）" if city else f"Day {di}（{date}）",
+        "intro": None,
+        "spots": spots,
+        "transport_note": "景点之间建议步行/打车，远距离可地铁/公交。",
+    }
 
-    # 生成有效的CTA链接
+def km_cta(out_days: List[Dict[str, Any]]) -> List[Dict[str, str]]:
+    """根据第一天的景点生成 CTA 链接"""
     cta = []
     if out_days and out_days[0]["spots"]:
         # 找到第一个有效景点的第一个可用链接
@@ -283,17 +722,14 @@ def to_km_travel(plan: Dict[str, Any]) -> Dict[str, Any]:
                 "text": "添加景点到行程",
                 "href": "#"
             })
+    return cta
 
-    resp = {
-        "title": f"{city}{days_total}天旅行攻略" if city else f"{days_total}天旅行攻略",
-        "subtitle": "根据兴趣与相邻点路况自动生成（演示版）",
-        "weather": None,   # 想接近示例页可接气象 API 填充
-        "tips": [
-            "建议提前预约热门景点；合理安排行程与用餐。",
-            "尽量错峰出行，注意当地天气与交通。",
-        ],
+def to_km_travel(plan: Dict[str, Any]) -> Dict[str, Any]:
+    """把 /api/plan 的返回（PlanResponse JSON） 转成 kmTravel 风格内容模型"""
+    city = plan.get("city", "")
+    out_days = [km_day(di, day, city) for di, day in enumerate(plan.get("days", []), start=1)]
+    return {
+        **km_header(city, plan.get("days_total", 0)),
         "days": out_days,
-        "cta_links": cta,
+        "cta_links": km_cta(out_days),
     }
-    return resp
-
@@ -0,0 +1,56 @@
+from __future__ import annotations
+
+import sys
+from typing import Any, Dict, NamedTuple, Optional, Tuple
+
+# 流水线和缓存内部的 POI 表示：不可变的 NamedTuple，坐标直接存两个 float，
+# 重复率高的字符串（id / 名称 / 分类）经 sys.intern 在整个进程共享一份。
+# 只在 API 边界（调试接口、同步客户端、kmTravel 整形）才转成字典。
+
+
+def _intern(v: Any) -> Optional[str]:
+    return sys.intern(v) if isinstance(v, str) and v else None
+
+
+def _text(v: Any) -> Optional[str]:
+    # 高德的空字段返回 []，统一成 None，不为每个 POI 多存一个空列表
+    return v if isinstance(v, str) and v else None
+
+
+class Poi(NamedTuple):
+    id: Optional[str]
+    name: Optional[str]
+    category: Optional[str]
+    lng: float
+    lat: float
+    address: Optional[str] = None
+    tel: Optional[str] = None
+    distance: Optional[str] = None
+    rating: Optional[str] = None
+
+    @property
+    def location(self) -> Tuple[float, float]:
+        return self.lng, self.lat
+
+    def to_dict(self) -> Dict[str, Any]:
+        """与原先 search_poi 返回的字典结构相同"""
+        return {
+            "id": self.id,
+            "name": self.name,
+            "category": self.category,
+            "location": [self.lng, self.lat],
+            "address": self.address,
+            "tel": self.tel,
+            "distance": self.distance,
+            "rating": self.rating,
+        }
+
+
+def make_poi(id: Any, name: Any, category: Any, lng: float, lat: float,
+             address: Any = None, tel: Any = None, distance: Any = None, rating: Any = None) -> Poi:
+    return Poi(_intern(id), _intern(name), _intern(category), float(lng), float(lat),
+               _text(address), _text(tel), _text(distance), _text(rating))
+
+
+# 占位景点（某天 POI 不足时填充），全进程共用一个
+PLACEHOLDER_POI = make_poi(None, "待定景点", "景点", 0.0, 0.0, address="待定")
@@ -0,0 +1,160 @@
+from __future__ import annotations
+
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, List, Sequence, Tuple
+
+from app.core import config
+
+# 关键词 → 高德 POI 分类编码。能用分类编码表达的关键词改为按 types 查询：
+# 分类比文本匹配更准，多个分类可以用“|”合并成一次查询
+TYPE_CODES: Dict[str, str] = {
+    "博物馆": "140100",
+    "展览馆": "140200",
+    "美术馆": "140400",
+    "图书馆": "140500",
+    "科技馆": "140600",
+    "大学": "141201",
+    "公园": "110101",
+    "动物园": "110102",
+    "植物园": "110103",
+    "广场": "110105",
+    "寺庙": "110205",
+    "佛寺": "110205",
+    "道观": "110205",
+    "教堂": "110206",
+    "清真寺": "110207",
+    "游乐园": "080501",
+    "电影院": "080601",
+    "剧院": "080603",
+    "商场": "060100",
+    "购物中心": "060101",
+    "步行街": "061001",
+    "商业街": "061000",
+}
+
+# 没有历史数据时按“整页都是新 POI”乐观估计，保证新关键词有机会被尝试
+_OPTIMISTIC_NEW = 8.0
+# 至少跑过这么多次、且从未贡献新 POI 的关键词视为已被其他关键词覆盖，排到最后
+_COVERED_AFTER_RUNS = 3
+
+
+@dataclass(frozen=True)
+class PoiQuery:
+    """一次 place/text 查询：keywords、types 均可为“|”连接的多个值，terms 为合并进来的原始关键词"""
+    keywords: str
+    types: str
+    terms: Tuple[str, ...]
+
+    @property
+    def label(self) -> str:
+        return "|".join(self.terms)
+
+
+def dedupe_keywords(keywords: Sequence[str]) -> List[str]:
+    """去掉重复和被包含的关键词：文本搜索“历史”的结果已覆盖“历史文化”，只保留较短的那个（位置取首次出现处）"""
+    out: List[str] = []
+    for kw in keywords:
+        kw = (kw or "").strip()
+        if not kw or kw in out:
+            continue
+        if any(k in kw for k in out):
+            continue
+        # 新关键词比已有的更宽泛：替换掉被它包含的那些
+        covered = [i for i, k in enumerate(out) if kw in k]
+        if covered:
+            out[covered[0]] = kw
+            out = [k for i, k in enumerate(out) if i not in covered[1:]]
+        else:
+            out.append(kw)
+    return out
+
+
+class KeywordYield:
+    """按城市记录每个关键词历史上贡献了多少个新 POI（没被前面的查询找到过的），以及每份行程的上游搜索次数。
+
+    排序只看每 refresh_seconds 固定一次的快照，不看实时统计：两次快照之间同样的输入总是得到同样的查询顺序，
+    不会因为刚处理过的请求而变；贡献相同的关键词保持规划时的原顺序。refresh_seconds 为 0 时每次都用最新统计。
+    """
+
+    def __init__(self, refresh_seconds: float = 3600.0):
+        self._stats: Dict[Tuple[str, str], List[float]] = {}  # (城市, 关键词) -> [次数, 返回数, 新增数]
+        self._ranked: Dict[Tuple[str, str], Tuple[float, ...]] = {}  # 排序用的快照
+        self.refresh_seconds = refresh_seconds
+        self._snapshot_at = time.monotonic()
+        self.plans = 0
+        self.searches = 0
+        self.round_trips = 0
+
+    def refresh(self) -> None:
+        """把当前的历史统计固定成排序用的快照"""
+        self._ranked = {k: tuple(v) for k, v in self._stats.items()}
+        self._snapshot_at = time.monotonic()
+
+    def _snapshot(self) -> Dict[Tuple[str, str], Tuple[float, ...]]:
+        if time.monotonic() - self._snapshot_at >= self.refresh_seconds:
+            self.refresh()
+        return self._ranked
+
+    def expected_new(self, city: str, keyword: str, live: bool = False) -> float:
+        """关键词每次查询平均新增的 POI 数；live 时用实时统计（只用于不影响行程结果的判断，如要不要提前发请求）"""
+        stats = self._stats if live else self._snapshot()
+        runs, _, new = stats.get((city, keyword), (0, 0, 0))
+        return new / runs if runs else _OPTIMISTIC_NEW
+
+    def covered(self, city: str, keyword: str) -> bool:
+        runs, _, new = self._snapshot().get((city, keyword), (0, 0, 0))
+        return runs >= _COVERED_AFTER_RUNS and new == 0
+
+    def rank(self, city: str, keywords: Sequence[str]) -> List[str]:
+        """按快照里的历史贡献从高到低排序（稳定排序，没有数据或贡献相同时保持原顺序），已被覆盖的关键词排在最后"""
+        return sorted(keywords, key=lambda k: (self.covered(city, k), -self.expected_new(city, k)))
+
+    def record(self, city: str, query: PoiQuery, returned: int, new: int) -> None:
+        # 合并查询无法区分是哪个关键词命中的，平均分摊
+        n = len(query.terms)
+        for term in query.terms:
+            s = self._stats.setdefault((city, term), [0, 0, 0])
+            s[0] += 1
+            s[1] += returned / n
+            s[2] += new / n
+
+    def record_plan(self, upstream: Dict[str, int]) -> None:
+        self.plans += 1
+        self.searches += upstream.get("place", 0)
+        self.round_trips += upstream.get("round_trips", 0)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "plans": self.plans,
+            "upstream_searches_per_plan": round(self.searches / self.plans, 2) if self.plans else 0.0,
+            "round_trips_per_plan": round(self.round_trips / self.plans, 2) if self.plans else 0.0,
+            "tracked_keywords": len(self._stats),
+            "covered_keywords": sum(1 for (c, k) in self._ranked if self.covered(c, k)),
+            "snapshot_age_seconds": round(time.monotonic() - self._snapshot_at, 1),
+        }
+
+
+KEYWORD_YIELD = KeywordYield(config.POI_QUERY_RANK_REFRESH_SECONDS)
+
+
+def plan_queries(city: str, keywords: Sequence[str], per_query: int) -> List[PoiQuery]:
+    """把关键词池规划成尽量少的查询：去重/去包含 → 按本城市历史贡献排序 →
+    有分类编码的合并成 types 查询，其余每 per_query 个用“|”合并成一次多关键词查询。
+
+    查询按组内最好的关键词排序，贡献最高的关键词所在的查询排在最前。
+    """
+    ranked = KEYWORD_YIELD.rank(city, dedupe_keywords(keywords))
+    per_query = max(1, per_query)
+    typed = [k for k in ranked if k in TYPE_CODES]
+    free = [k for k in ranked if k not in TYPE_CODES]
+
+    groups: List[Tuple[int, PoiQuery]] = []
+    for i in range(0, len(typed), per_query):
+        terms = tuple(typed[i:i + per_query])
+        codes = list(dict.fromkeys(TYPE_CODES[k] for k in terms))
+        groups.append((ranked.index(terms[0]), PoiQuery("", "|".join(codes), terms)))
+    for i in range(0, len(free), per_query):
+        terms = tuple(free[i:i + per_query])
+        groups.append((ranked.index(terms[0]), PoiQuery("|".join(terms), "", terms)))
+    return [q for _, q in sorted(groups, key=lambda g: g[0])]
@@ -0,0 +1,126 @@
+from __future__ import annotations
+
+from collections import defaultdict
+from typing import Any, Dict, Hashable, Iterator, List, Optional, Tuple
+import math
+import re
+
+from app.utils.geo import haversine_km
+from app.utils.poi import Poi
+
+KM_PER_DEG_LAT = 111.32
+
+
+class GridIndex:
+    """经纬度网格空间索引：按 cell_km 见方的格子分桶。
+
+    半径查询只检查覆盖圆的那几个格子，k 近邻按格子一圈圈向外扩，
+    单次查询与候选池大小基本无关（O(1) 平均），替代对整个候选列表的线性扫描。
+    """
+
+    def __init__(self, cell_km: float = 0.5, ref_lat: Optional[float] = None):
+        self.cell_km = cell_km
+        self.ref_lat = ref_lat
+        self._cells: Dict[Tuple[int, int], List[Tuple[Hashable, float, float]]] = defaultdict(list)
+        self._count = 0
+        self._bounds: Optional[Tuple[int, int, int, int]] = None  # 已有格子的 (min_x, min_y, max_x, max_y)
+
+    def __len__(self) -> int:
+        return self._count
+
+    def _scale(self) -> Tuple[float, float]:
+        # 经度方向每度的公里数随纬度变化，用首个点（或传入的参考纬度）固定下来
+        lat = self.ref_lat if self.ref_lat is not None else 0.0
+        return KM_PER_DEG_LAT * max(math.cos(math.radians(lat)), 1e-6), KM_PER_DEG_LAT
+
+    def _cell(self, lng: float, lat: float) -> Tuple[int, int]:
+        sx, sy = self._scale()
+        return int(math.floor(lng * sx / self.cell_km)), int(math.floor(lat * sy / self.cell_km))
+
+    def add(self, key: Hashable, lng: float, lat: float) -> None:
+        if self.ref_lat is None:
+            self.ref_lat = lat
+        cx, cy = self._cell(lng, lat)
+        self._cells[(cx, cy)].append((key, lng, lat))
+        self._count += 1
+        b = self._bounds
+        self._bounds = (cx, cy, cx, cy) if b is None else (min(b[0], cx), min(b[1], cy), max(b[2], cx), max(b[3], cy))
+
+    def _max_ring(self, cx: int, cy: int) -> int:
+        # 超过这一圈就不再有任何格子，避免在空白区域无谓外扩
+        b = self._bounds
+        return max(cx - b[0], b[2] - cx, cy - b[1], b[3] - cy, 0)
+
+    def _ring(self, cx: int, cy: int, r: int) -> Iterator[Tuple[Hashable, float, float]]:
+        if r == 0:
+            yield from self._cells.get((cx, cy), ())
+            return
+        for dx in range(-r, r + 1):
+            for dy in (-r, r):
+                yield from self._cells.get((cx + dx, cy + dy), ())
+        for dy in range(-r + 1, r):
+            for dx in (-r, r):
+                yield from self._cells.get((cx + dx, cy + dy), ())
+
+    def query_radius(self, lng: float, lat: float, radius_km: float) -> List[Tuple[Hashable, float]]:
+        """半径 radius_km 内的所有点，按距离从近到远返回 (key, 距离km)"""
+        if not self._count:
+            return []
+        cx, cy = self._cell(lng, lat)
+        rings = min(int(math.ceil(radius_km / self.cell_km)), self._max_ring(cx, cy))
+        found = []
+        for r in range(rings + 1):
+            for key, plng, plat in self._ring(cx, cy, r):
+                d = haversine_km((lng, lat), (plng, plat))
+                if d <= radius_km:
+                    found.append((key, d))
+        found.sort(key=lambda x: x[1])
+        return found
+
+    def nearest(self, lng: float, lat: float, k: int = 1, max_radius_km: Optional[float] = None) -> List[Tuple[Hashable, float]]:
+        """最近的 k 个点 (key, 距离km)，从近到远。
+
+        第 r 圈之内的格子保证覆盖了距离 r × cell_km 以内的所有点，
+        因此当已找到的第 k 近的点不超过这个距离时即可停止外扩。
+        """
+        if not self._count or k <= 0:
+            return []
+        cx, cy = self._cell(lng, lat)
+        max_r = self._max_ring(cx, cy)
+        found: List[Tuple[Hashable, float]] = []
+        seen = 0
+        r = 0
+        while True:
+            for key, plng, plat in self._ring(cx, cy, r):
+                seen += 1
+                found.append((key, haversine_km((lng, lat), (plng, plat))))
+            found.sort(key=lambda x: x[1])
+            covered = r * self.cell_km
+            if seen >= self._count or r >= max_r or (len(found) >= k and found[k - 1][1] <= covered):
+                break
+            if max_radius_km is not None and covered > max_radius_km:
+                break
+            r += 1
+        if max_radius_km is not None:
+            found = [f for f in found if f[1] <= max_radius_km]
+        return found[:k]
+
+
+_PAREN_RE = re.compile(r"[（(【\[].*?[)）】\]]")
+_SPLIT_RE = re.compile(r"[-—–·・|]")
+
+
+def base_name(name: Optional[str]) -> str:
+    """POI 名称归一：去掉括号里的分店/入口说明，取分隔符前的主体，如“故宫博物院-午门”→“故宫博物院”"""
+    s = _PAREN_RE.sub("", name or "")
+    return _SPLIT_RE.split(s, 1)[0].strip().lower()
+
+
+def same_place(a: Poi, b: Poi) -> bool:
+    """名称是否指向同一地点（调用方负责先确认两者距离足够近）"""
+    if a.id and a.id == b.id:
+        return True
+    na, nb = base_name(a.name), base_name(b.name)
+    if not na or not nb:
+        return False
+    return na == nb or na.startswith(nb) or nb.startswith(na)
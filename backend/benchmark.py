@@ -0,0 +1,411 @@
+#!/usr/bin/env python3
+"""
+行程规划性能基准：在本地高德桩服务（amap_stub）上测量 /api/plan_km
+- 并发扫描：各并发度下的 p50/p95/p99 延迟、吞吐、错误数、每份行程的上游往返次数
+- 分阶段：1~14 天行程在各阶段（地理编码 geocode / 搜集 collect / 排序 order / 路线 routing / 整形 shaping / 序列化 serialization）的墙钟和 CPU 时间，以及上游请求数
+- 响应路径：命中整份行程缓存时每个请求的 CPU 时间，对比 pydantic 校验 + 标准库 json / orjson / 复用已编码响应体
+- 内存：跑完后 POI 搜索缓存里平均每个 POI、整份行程缓存里平均每份行程占用的字节数
+结果输出为 JSON；指定 --baseline 时与基线比较，超过阈值的退化以退出码 1 结束（可用于 CI）；
+规划没有真正走到桩服务时测出的数字没有意义，以退出码 2 结束
+使用方法：
+  python benchmark.py --output data/bench.json
+  python benchmark.py --baseline data/bench_baseline.json --threshold 0.15
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import socket
+import statistics
+import sys
+import threading
+import time
+from dotenv import load_dotenv
+
+# 添加项目路径
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+# 加载环境变量
+load_dotenv()
+
+STAGES = ["geocode", "collect", "order", "routing", "shaping", "serialization"]
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_stub(args, port):
+    """在后台线程里起桩服务（真实 HTTP，和线上一样走连接池），返回 stub"""
+    import uvicorn
+    from app.services.amap_stub import AmapStub, LatencyModel, Recordings, create_stub_app
+
+    stub = AmapStub(
+        Recordings(args.record_file),
+        latency={"default": LatencyModel(args.latency)},
+        error_rate=args.error_rate,
+        seed=args.seed,
+    )
+    server = uvicorn.Server(uvicorn.Config(create_stub_app(stub), host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.01)
+    return stub
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    s = sorted(values)
+    k = (len(s) - 1) * q
+    lo = int(k)
+    hi = min(lo + 1, len(s) - 1)
+    return s[lo] + (s[hi] - s[lo]) * (k - lo)
+
+
+def workload(args, n, tag):
+    """第 i 个请求的参数：城市 × 天数 × 兴趣组合轮换；--cold 时城市名带序号，所有缓存都不命中"""
+    cities = [c for c in args.cities.split(",") if c]
+    combos = [[i for i in combo.split(",") if i] for combo in args.interests.split(";")]
+    days = [int(d) for d in args.days.split(",")]
+    for i in range(n):
+        city = cities[i % len(cities)]
+        if args.cold:
+            city = f"{city}{tag}{i}"
+        yield {
+            "city": city,
+            "start_date": "2025-01-01",
+            "days": days[i % len(days)],
+            "interests": combos[i % len(combos)] or None,
+        }
+
+
+async def profile_stages(app, args):
+    """单请求顺序执行，按天数测量各阶段耗时（取 --profile-runs 次的中位数）和上游请求数"""
+    from app.routers.plan import encode_km_travel
+    from app.utils.itinerary import build_itinerary, to_km_travel
+
+    client = app.state.amap
+    cities = [c for c in args.cities.split(",") if c]
+    interests = [i for i in args.interests.split(";")[0].split(",") if i] or None
+    out = {}
+    for days in range(1, args.max_days + 1):
+        runs = []
+        for r in range(args.profile_runs):
+            # 每次换一个城市名，测的是没有任何缓存时的完整流程
+            city = f"{cities[days % len(cities)]}p{days}r{r}"
+            plan = await build_itinerary(client, city, days, interests, None, "2025-01-01")
+            check_plan(plan, city)
+            timings = dict(plan["debug_info"].get("timings_ms", {}))
+
+            wall, cpu = time.perf_counter(), time.thread_time()
+            shaped = to_km_travel(plan)
+            timings["shaping"] = {"wall_ms": (time.perf_counter() - wall) * 1000, "cpu_ms": (time.thread_time() - cpu) * 1000}
+
+            # 与 /api/plan_km 的编码方式一致（FAST_JSON_ENABLED）
+            wall, cpu = time.perf_counter(), time.thread_time()
+            body = encode_km_travel(shaped)
+            timings["serialization"] = {"wall_ms": (time.perf_counter() - wall) * 1000, "cpu_ms": (time.thread_time() - cpu) * 1000}
+            runs.append((timings, plan["debug_info"].get("upstream", {}), len(body)))
+
+        stages = {
+            name: {
+                k: round(statistics.median(t[name][k] for t, _, _ in runs if name in t), 3)
+                for k in ("wall_ms", "cpu_ms")
+            }
+            for name in STAGES if any(name in t for t, _, _ in runs)
+        }
+        upstream = runs[-1][1]
+        out[str(days)] = {
+            "stages": stages,
+            "cpu_ms_total": round(sum(s["cpu_ms"] for s in stages.values()), 3),
+            "upstream": upstream,
+            "response_bytes": runs[-1][2],
+        }
+    return out
+
+
+class BenchmarkError(RuntimeError):
+    """规划没有真正走到桩服务（配置没生效、桩服务不可用），测出来的数字没有意义"""
+
+
+def check_plan(plan, city):
+    """没有任何缓存的规划必须向桩服务发过请求并找到 POI"""
+    debug = plan.get("debug_info", {})
+    if not debug.get("upstream", {}).get("round_trips"):
+        raise BenchmarkError(f"{city}: 没有向桩服务发出任何请求，检查 AMAP_BASE / GAODE_API_KEY 是否生效")
+    if not debug.get("search_success"):
+        raise BenchmarkError(f"{city}: 没有找到任何 POI（search_success=False）")
+
+
+async def sweep(app, stub, args):
+    """各并发度下发 --requests 个 /api/plan_km 请求"""
+    import httpx
+
+    results = []
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as http:
+        for level in [int(c) for c in args.concurrency.split(",")]:
+            bodies = list(workload(args, args.requests, f"c{level}_"))
+            latencies, errors = [], 0
+            queue = asyncio.Queue()
+            for b in bodies:
+                queue.put_nowait(b)
+            before = sum(stub.requests.values())
+
+            async def worker():
+                nonlocal errors
+                while not queue.empty():
+                    body = queue.get_nowait()
+                    t0 = time.perf_counter()
+                    try:
+                        r = await http.post("/api/plan_km", json=body)
+                        ok = r.status_code == 200
+                    except Exception:
+                        ok = False
+                    latencies.append((time.perf_counter() - t0) * 1000)
+                    errors += 0 if ok else 1
+
+            t0 = time.perf_counter()
+            await asyncio.gather(*(worker() for _ in range(level)))
+            elapsed = time.perf_counter() - t0
+            round_trips = sum(stub.requests.values()) - before
+            if errors == len(bodies):
+                raise BenchmarkError(f"并发 {level} 下所有请求都失败了")
+            results.append({
+                "concurrency": level,
+                "requests": len(bodies),
+                "errors": errors,
+                "p50_ms": round(percentile(latencies, 0.50), 2),
+                "p95_ms": round(percentile(latencies, 0.95), 2),
+                "p99_ms": round(percentile(latencies, 0.99), 2),
+                "mean_ms": round(statistics.fmean(latencies), 2),
+                "throughput_rps": round(len(bodies) / elapsed, 2),
+                "upstream_round_trips_per_plan": round(round_trips / len(bodies), 2),
+            })
+            print(f"   并发 {level}: p50={results[-1]['p50_ms']}ms p95={results[-1]['p95_ms']}ms "
+                  f"p99={results[-1]['p99_ms']}ms 吞吐={results[-1]['throughput_rps']}/s 错误={errors}", file=sys.stderr)
+    return results
+
+
+RESPONSE_MODES = {
+    # 名称: (FAST_JSON_ENABLED, 复用已编码响应体)
+    "validate_json": (False, False),
+    "orjson": (True, False),
+    "orjson_body_cache": (True, True),
+}
+
+
+async def profile_response(app, args):
+    """命中整份行程缓存时 /api/plan_km 每个请求的 CPU / 墙钟时间（顺序发 --response-runs 个相同请求），
+    分别用 pydantic 校验 + 标准库 json、orjson 直接编码、复用已编码响应体三种方式"""
+    import httpx
+    from app.core import config
+
+    plan_cache = app.state.plan_cache
+    if plan_cache is None:
+        return {}
+    saved = config.FAST_JSON_ENABLED, plan_cache._bodies
+    out = {}
+    transport = httpx.ASGITransport(app=app)
+    try:
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as http:
+            for days in sorted({int(d) for d in args.days.split(",")}):
+                body = {"city": args.cities.split(",")[0], "start_date": "2025-01-01", "days": days,
+                        "interests": [i for i in args.interests.split(";")[0].split(",") if i] or None}
+                await http.post("/api/plan_km", json=body)  # 先规划一次放进缓存
+                row = {}
+                for mode, (fast, reuse) in RESPONSE_MODES.items():
+                    config.FAST_JSON_ENABLED = fast
+                    plan_cache._bodies = saved[1] if reuse else None
+                    await http.post("/api/plan_km", json=body)  # 预热（复用模式下写入响应体）
+                    wall, cpu = time.perf_counter(), time.process_time()
+                    for _ in range(args.response_runs):
+                        r = await http.post("/api/plan_km", json=body)
+                    row[mode] = {
+                        "cpu_ms": round((time.process_time() - cpu) * 1000 / args.response_runs, 3),
+                        "wall_ms": round((time.perf_counter() - wall) * 1000 / args.response_runs, 3),
+                        "bytes": len(r.content),
+                    }
+                out[str(days)] = row
+                print(f"   {days}天: " + " ".join(f"{m}={v['cpu_ms']}ms" for m, v in row.items()), file=sys.stderr)
+    finally:
+        config.FAST_JSON_ENABLED, plan_cache._bodies = saved
+    return out
+
+
+def deep_size(obj, seen):
+    """obj 及其引用的全部对象的字节数；seen 中已计过的对象（如共享的 POI、驻留的字符串）不重复计算"""
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_size(k, seen) + deep_size(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(deep_size(v, seen) for v in obj)
+    elif hasattr(obj, "__slots__"):
+        size += sum(deep_size(getattr(obj, name, None), seen) for name in obj.__slots__)
+    elif hasattr(obj, "__dict__"):
+        size += deep_size(obj.__dict__, seen)
+    return size
+
+
+def profile_memory(app):
+    """缓存里的 POI 和行程实际占用的内存：先算 POI 搜索缓存（平均每个 POI），
+    再算整份行程缓存（平均每份行程，其中与 POI 缓存共享的对象不再计入）"""
+    from app.services.amap_cache import CachedAmapClient
+
+    cache = app.state.amap
+    while cache is not None and not isinstance(cache, CachedAmapClient):
+        cache = getattr(cache, "client", None)
+    seen = set()
+    out = {}
+    if cache is not None:
+        pages = list(cache.endpoints["place_text"].positive.values())
+        n = sum(len(p) for p in pages)
+        total = deep_size(pages, seen)
+        out["poi_cache"] = {"pages": len(pages), "pois": n, "bytes": total, "bytes_per_poi": round(total / n, 1) if n else None}
+    if app.state.plan_cache is not None:
+        plans = [plan for plan, _ in app.state.plan_cache._entries.values()]
+        total = deep_size(plans, seen)
+        out["plan_cache"] = {"plans": len(plans), "bytes": total, "bytes_per_plan": round(total / len(plans), 1) if plans else None}
+    return out
+
+
+def metrics(result):
+    """可比较的指标：名称 -> (数值, 是否越大越好)"""
+    out = {}
+    for row in result["sweep"]:
+        c = row["concurrency"]
+        for k in ("p50_ms", "p95_ms", "p99_ms"):
+            out[f"sweep.c{c}.{k}"] = (row[k], False)
+        out[f"sweep.c{c}.throughput_rps"] = (row["throughput_rps"], True)
+        out[f"sweep.c{c}.upstream_round_trips_per_plan"] = (row["upstream_round_trips_per_plan"], False)
+    for days, row in result["stages"].items():
+        for name, s in row["stages"].items():
+            out[f"stages.d{days}.{name}.cpu_ms"] = (s["cpu_ms"], False)
+        out[f"stages.d{days}.upstream_round_trips"] = (row["upstream"].get("round_trips", 0), False)
+    for days, row in result.get("response_path", {}).items():
+        for mode, s in row.items():
+            out[f"response_path.d{days}.{mode}.cpu_ms"] = (s["cpu_ms"], False)
+    for name, key in (("poi_cache", "bytes_per_poi"), ("plan_cache", "bytes_per_plan")):
+        value = result.get("memory", {}).get(name, {}).get(key)
+        if value is not None:
+            out[f"memory.{key}"] = (value, False)
+    return out
+
+
+def compare(current, baseline, threshold, min_delta_ms):
+    """比当前结果差超过 threshold（相对值）的指标；毫秒类指标的绝对差小于 min_delta_ms 时视为噪声"""
+    regressions = []
+    cur, base = metrics(current), metrics(baseline)
+    for name, (value, higher_better) in cur.items():
+        if name not in base or base[name][0] in (None, 0):
+            continue
+        ref = base[name][0]
+        change = (value - ref) / ref
+        worse = -change if higher_better else change
+        if name.endswith("_ms") and abs(value - ref) < min_delta_ms:
+            continue
+        if worse > threshold:
+            regressions.append({"metric": name, "baseline": ref, "current": value, "change_pct": round(change * 100, 1)})
+    return regressions
+
+
+async def run(args):
+    # 配置在导入时读取，而桩服务模块也会间接导入 app.core.config：两个环境变量必须在导入任何 app 模块之前设置
+    port = _free_port()
+    base = f"http://127.0.0.1:{port}/v3"
+    os.environ["AMAP_BASE"] = base
+    os.environ.setdefault("GAODE_API_KEY", "bench")
+    from app.core import config
+    if config.AMAP_BASE != base or not config.GAODE_API_KEY:
+        raise BenchmarkError("app.core.config 在设置 AMAP_BASE / GAODE_API_KEY 之前已被导入")
+    stub = start_stub(args, port)
+    import app.main as main
+
+    logging.getLogger().setLevel(args.log_level)
+    app = main.app
+    async with app.router.lifespan_context(app):
+        print("📊 分阶段测量", file=sys.stderr)
+        stages = await profile_stages(app, args)
+        print("📊 并发扫描", file=sys.stderr)
+        sweep_rows = await sweep(app, stub, args)
+        print("📊 缓存命中时的响应路径", file=sys.stderr)
+        response_path = await profile_response(app, args)
+        memory = profile_memory(app)
+        print(f"   内存: {memory}", file=sys.stderr)
+
+    settings = {k: v for k, v in vars(config).items() if k.isupper() and k != "GAODE_API_KEY" and isinstance(v, (bool, int, float, str))}
+    return {
+        "meta": {
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": sys.version.split()[0],
+            "args": vars(args),
+            "config": settings,
+        },
+        "stages": stages,
+        "sweep": sweep_rows,
+        "response_path": response_path,
+        "memory": memory,
+        "stub": stub.stats(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="行程规划性能基准")
+    parser.add_argument("--cities", default="北京,上海,杭州,成都,西安")
+    parser.add_argument("--days", default="1,3,7,14", help="并发扫描轮换的行程天数")
+    parser.add_argument("--interests", default="history;food,art;", help="兴趣组合，组合之间用分号，空组合表示不选兴趣")
+    parser.add_argument("--concurrency", default="1,4,16,32")
+    parser.add_argument("--requests", type=int, default=64, help="每个并发度发出的请求数")
+    parser.add_argument("--cold", action="store_true", help="每个请求用不同的城市名，所有缓存都不命中")
+    parser.add_argument("--max-days", type=int, default=14, help="分阶段测量 1..N 天")
+    parser.add_argument("--profile-runs", type=int, default=3)
+    parser.add_argument("--response-runs", type=int, default=200, help="响应路径测量时每种方式顺序发出的请求数")
+    parser.add_argument("--latency", default="lognormal:40:0.5", help="桩服务延迟分布（见 amap_stub.py）")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--record-file", default="", help="回放的录制文件，不指定则全部用合成数据")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", default="", help="结果 JSON 路径，默认输出到标准输出")
+    parser.add_argument("--baseline", default="", help="基线 JSON，与之比较并报告退化")
+    parser.add_argument("--threshold", type=float, default=0.15, help="允许的相对退化比例")
+    parser.add_argument("--min-delta-ms", type=float, default=1.0, help="毫秒指标的绝对差小于该值时不算退化")
+    parser.add_argument("--log-level", default="WARNING")
+    args = parser.parse_args()
+
+    try:
+        result = asyncio.run(run(args))
+    except BenchmarkError as e:
+        print(f"❌ 基准无效: {e}", file=sys.stderr)
+        sys.exit(2)
+    exit_code = 0
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        result["regressions"] = compare(result, baseline, args.threshold, args.min_delta_ms)
+        for r in result["regressions"]:
+            print(f"❌ 退化 {r['metric']}: {r['baseline']} -> {r['current']} ({r['change_pct']:+}%)", file=sys.stderr)
+        if result["regressions"]:
+            exit_code = 1
+        else:
+            print(f"✅ 未发现超过 {args.threshold:.0%} 的退化", file=sys.stderr)
+
+    text = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+        print(f"结果已写入 {args.output}", file=sys.stderr)
+    else:
+        print(text)
+    sys.exit(exit_code)
+
+
+if __name__ == "__main__":
+    main()
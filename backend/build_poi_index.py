@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+离线城市 POI 索引构建脚本
+按 INTEREST_KEYWORDS（及通用/兜底关键词）抓取各城市的 POI，写入 POI_INDEX_DIR
+使用方法：python build_poi_index.py 北京 上海 [--force] [--max-age-days 7] [--dir ./data/poi_index]
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+from dotenv import load_dotenv
+
+# 添加项目路径
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+# 加载环境变量
+load_dotenv()
+
+
+def all_keywords():
+    """索引覆盖规划时可能用到的全部关键词"""
+    from app.utils.itinerary import INTEREST_KEYWORDS, UNIVERSAL_KEYWORDS, FALLBACK_KEYWORDS
+
+    keywords = [kw for kws in INTEREST_KEYWORDS.values() for kw in kws]
+    return list(dict.fromkeys(keywords + UNIVERSAL_KEYWORDS + FALLBACK_KEYWORDS))
+
+
+async def build(cities, root, force, max_age_days, pages):
+    from app.services.gaode_mcp import AsyncAmapClient, create_http_client, create_rate_limiter, create_resilience
+    from app.services.poi_index import crawl_city
+    from app.services.rate_limit import background_priority
+
+    keywords = all_keywords()
+    max_age = 0 if force else max_age_days * 24 * 3600
+    os.makedirs(root, exist_ok=True)
+    async with create_http_client() as http:
+        client = AsyncAmapClient(http, limiter=create_rate_limiter(), resilience=create_resilience())
+        # 与线上共用配额，按后台优先级排队
+        with background_priority():
+            for city in cities:
+                print(f"\n🧭 {city}: {len(keywords)} 个关键词")
+                try:
+                    result = await crawl_city(client, root, city, keywords, pages=pages, max_age_seconds=max_age)
+                except Exception as e:
+                    print(f"   ❌ 失败: {e}")
+                    continue
+                print(f"   ✅ {result['pois']} 个POI，刷新 {result['refreshed']} 个关键词 -> {result['path']}")
+
+
+def main():
+    from app.core import config
+    from app.core.logging_config import setup_logging
+
+    setup_logging()
+
+    parser = argparse.ArgumentParser(description="构建离线城市 POI 索引")
+    parser.add_argument("cities", nargs="+", help="城市名，如 北京 上海")
+    parser.add_argument("--dir", default=config.POI_INDEX_DIR or "./data/poi_index", help="索引目录（默认 POI_INDEX_DIR）")
+    parser.add_argument("--force", action="store_true", help="忽略已有结果，全部关键词重新抓取")
+    parser.add_argument("--max-age-days", type=float, default=config.POI_INDEX_MAX_AGE_DAYS, help="超过该天数的关键词重新抓取")
+    parser.add_argument("--pages", type=int, default=config.POI_INDEX_PAGES, help="每个关键词最多抓取的页数")
+    args = parser.parse_args()
+
+    if not config.GAODE_API_KEY:
+        print("❌ 未设置GAODE_API_KEY环境变量")
+        sys.exit(1)
+    asyncio.run(build(args.cities, args.dir, args.force, args.max_age_days, args.pages))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,6 @@
+"""pytest 配置：单元测试都在 tests/ 下，离线运行（python -m pytest -q）。
+
+根目录的 test_amap.py、test_api.py 是请求真实高德 / 本地服务的手动脚本，不作为测试收集。
+"""
+
+collect_ignore = ["test_amap.py", "test_api.py"]
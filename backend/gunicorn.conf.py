@@ -0,0 +1,45 @@
+"""
+gunicorn 多进程部署配置：每个 worker 是一个独立的 uvicorn 事件循环
+使用方法：WORKERS=auto ./run.sh，或 gunicorn -c gunicorn.conf.py app.main:app
+
+多个 worker 通过本机的 SQLite 文件共享高德结果缓存（AMAP_STORE_PATH）和协调状态（SHARED_STATE_PATH：
+限速令牌桶、日配额用量、跨进程加载租约），加 worker 不会成倍消耗高德配额；
+worker 被回收重启后直接读这两个文件，不必重新预热。
+"""
+
+import multiprocessing
+import os
+from dotenv import load_dotenv
+
+# 先加载 .env，下面的默认值不覆盖 .env 里的设置
+load_dotenv()
+
+_here = os.path.dirname(os.path.abspath(__file__))
+
+
+def _workers() -> int:
+    # 请求处理是异步 IO，每个核一个 worker 即可
+    value = os.getenv("WORKERS", "auto")
+    return multiprocessing.cpu_count() if value == "auto" else max(1, int(value))
+
+
+bind = os.getenv("BIND", "0.0.0.0:8000")
+workers = _workers()
+worker_class = "uvicorn.workers.UvicornWorker"
+
+# 每个 worker 处理这么多请求后平滑回收（加随机抖动，避免多个 worker 同时重启），0 表示不回收
+max_requests = int(os.getenv("MAX_REQUESTS", "10000"))
+max_requests_jitter = int(os.getenv("MAX_REQUESTS_JITTER", "1000"))
+# 回收/重载时旧 worker 最多用这么久处理完手上的请求（包括流式响应）
+graceful_timeout = int(os.getenv("GRACEFUL_TIMEOUT", "30"))
+keepalive = 5
+
+# 应用在每个 worker fork 之后各自导入：SQLite 连接、事件循环、日志线程都不能跨 fork 共用
+preload_app = False
+
+# 多 worker 时共享状态必须开启，没有配置就放在 data/ 下（worker 从 master 继承这些环境变量）
+if workers > 1:
+    if not os.getenv("AMAP_STORE_PATH"):
+        os.environ["AMAP_STORE_PATH"] = os.path.join(_here, "data", "amap_cache.db")
+    if not os.getenv("SHARED_STATE_PATH"):
+        os.environ["SHARED_STATE_PATH"] = os.path.join(_here, "data", "shared_state.db")
@@ -1,4 +1,8 @@
 #!/usr/bin/env bash
 set -euo pipefail
 cd "$(dirname "$0")"
-uvicorn app.main:app --host 0.0.0.0 --port 8000
+# WORKERS=1（默认）单进程 uvicorn；WORKERS=N 或 auto（按 CPU 核数）时由 gunicorn 起多个 uvicorn worker，见 gunicorn.conf.py
+if [ "${WORKERS:-1}" = "1" ]; then
+  exec uvicorn app.main:app --host 0.0.0.0 --port 8000
+fi
+exec gunicorn -c gunicorn.conf.py app.main:app
@@ -0,0 +1,122 @@
+import asyncio
+
+import pytest
+
+from app.core import config
+from app.services.amap_cache import CachedAmapClient
+from app.services.gaode_mcp import FAILED
+from app.utils.poi import make_poi
+
+
+class FakeAmap:
+    """内层客户端：记录每个 POI 查询被请求的次数，slow 秒后返回；fail 中的关键词返回 FAILED"""
+
+    api_key = "test"
+
+    def __init__(self, slow=0.01, fail=()):
+        self.slow = slow
+        self.fail = set(fail)
+        self.fetches = {}
+
+    def _result(self, city, keywords):
+        self.fetches[keywords] = self.fetches.get(keywords, 0) + 1
+        if keywords in self.fail:
+            return FAILED
+        if keywords == "无结果":
+            return []
+        return [make_poi(keywords, f"{city}{keywords}", "景点", 116.0, 39.0)]
+
+    async def search_poi(self, city, keywords, page=1, offset=10, extensions="base", types="", strict=False):
+        await asyncio.sleep(self.slow)
+        return self._result(city, keywords)
+
+    async def search_poi_many(self, city, queries, extensions="base", strict=False):
+        await asyncio.sleep(self.slow)
+        return [self._result(city, kw) for kw, _, _, _ in queries]
+
+
+@pytest.fixture
+def singleflight(monkeypatch):
+    monkeypatch.setattr(config, "AMAP_SINGLEFLIGHT_ENABLED", True)
+
+
+def _queries(*keywords):
+    return [(kw, 1, 10, "") for kw in keywords]
+
+
+def test_concurrent_batches_share_in_flight_keys(singleflight):
+    async def main():
+        amap = FakeAmap()
+        cache = CachedAmapClient(amap)
+        a, b, c = await asyncio.gather(
+            cache.search_poi_many("北京", _queries("公园", "博物馆", "公园")),
+            cache.search_poi_many("北京", _queries("博物馆", "小吃")),
+            cache.search_poi("北京", "小吃"),
+        )
+        assert amap.fetches == {"公园": 1, "博物馆": 1, "小吃": 1}
+        assert [p[0].name for p in a] == ["北京公园", "北京博物馆", "北京公园"]
+        assert [p[0].name for p in b] == ["北京博物馆", "北京小吃"]
+        assert c[0].name == "北京小吃"
+        assert cache.flight.stats()["collapsed_calls"] == 2
+
+    asyncio.run(main())
+
+
+def test_batch_waiters_share_failures(singleflight):
+    async def main():
+        amap = FakeAmap(fail={"故障"})
+        cache = CachedAmapClient(amap)
+        a, b = await asyncio.gather(
+            cache.search_poi_many("上海", _queries("故障", "无结果")),
+            cache.search_poi("上海", "故障"),
+        )
+        assert a == [[], []] and b == []
+        assert amap.fetches == {"故障": 1, "无结果": 1}
+        # 失败不缓存，下次照常请求；确实没有结果的走负缓存
+        await cache.search_poi_many("上海", _queries("故障", "无结果"))
+        assert amap.fetches == {"故障": 2, "无结果": 1}
+
+    asyncio.run(main())
+
+
+def test_batch_exception_reaches_single_waiters(singleflight):
+    class Broken(FakeAmap):
+        async def search_poi_many(self, city, queries, extensions="base", strict=False):
+            await asyncio.sleep(self.slow)
+            raise RuntimeError("boom")
+
+    async def main():
+        cache = CachedAmapClient(Broken())
+        results = await asyncio.gather(
+            cache.search_poi_many("广州", _queries("早茶")),
+            cache.search_poi("广州", "早茶"),
+            return_exceptions=True,
+        )
+        assert all(isinstance(r, RuntimeError) for r in results)
+        assert cache.flight.stats()["in_flight"] == 0
+
+    asyncio.run(main())
+
+
+def test_positive_negative_and_failed_results(monkeypatch):
+    monkeypatch.setattr(config, "AMAP_CACHE_NEGATIVE_TTL_SECONDS", 0.05)
+
+    async def main():
+        amap = FakeAmap(slow=0, fail={"故障"})
+        cache = CachedAmapClient(amap)
+        for _ in range(3):
+            assert (await cache.search_poi("西安", "城墙"))[0].name == "西安城墙"
+            assert await cache.search_poi("西安", "无结果") == []
+            assert await cache.search_poi("西安", "故障") == []
+        # 有结果的缓存；确实没有结果的在负缓存有效期内不再请求；失败的每次都请求
+        assert amap.fetches == {"城墙": 1, "无结果": 1, "故障": 3}
+        stats = cache.stats()["place_text"]
+        assert (stats["hits"], stats["negative_hits"], stats["misses"]) == (2, 2, 5)
+        assert stats["size"] == 1 and stats["negative_size"] == 1
+
+        # 负结果过期后重新请求
+        await asyncio.sleep(0.06)
+        assert await cache.search_poi("西安", "无结果") == []
+        assert amap.fetches["无结果"] == 2
+
+    asyncio.run(main())
@@ -0,0 +1,60 @@
+import asyncio
+
+import pytest
+
+from app.services import amap_store
+from app.services.amap_store import MISSING, AmapStore, decode_value, encode_value
+from app.utils.poi import make_poi
+
+
+@pytest.mark.parametrize("value", [
+    None,
+    (116.397128, 39.916527),
+    {"mode": "walk", "distance_km": 1.25, "est_duration_min": 17},
+    [],
+    [
+        make_poi("B000A8UIN8", "故宫博物院", "风景名胜;博物馆", 116.397, 39.918, "景山前街4号", "010-85007421", "120", "4.9"),
+        # 高德空字段有时返回 []，缺失字段为 None
+        make_poi(None, "天安门广场", "风景名胜", 116.3975, 39.9033, [], None),
+    ],
+    {"other": [1, "二"]},
+])
+def test_encode_decode_round_trip(value):
+    assert decode_value(encode_value(value)) == value
+
+
+def test_get_set_and_expiry(tmp_path):
+    store = AmapStore(str(tmp_path / "cache.db"), 1024 * 1024)
+    try:
+        asyncio.run(store.set("geocode:a", (1.0, 2.0), 60))
+        asyncio.run(store.set("geocode:b", None, 60))
+        asyncio.run(store.set("geocode:c", (3.0, 4.0), -1))
+        assert asyncio.run(store.get("geocode:a")) == (1.0, 2.0)
+        # None 是合法的负结果，和未命中区分开
+        assert asyncio.run(store.get("geocode:b")) is None
+        assert asyncio.run(store.get("geocode:c")) is MISSING
+        assert asyncio.run(store.get("geocode:missing")) is MISSING
+        assert asyncio.run(store.compact())["expired"] == 1
+    finally:
+        store.close()
+
+
+def test_compaction_evicts_least_recently_accessed(tmp_path, monkeypatch):
+    clock = iter(range(1_000_000, 2_000_000, 100))
+    monkeypatch.setattr(amap_store.time, "time", lambda: next(clock))
+    blob = "x" * 1000
+    store = AmapStore(str(tmp_path / "cache.db"), 5000)
+    try:
+        for i in range(8):
+            asyncio.run(store.set(f"k{i}", {"v": blob}, 10_000_000))
+        # 读一次 k0，accessed_at 更新为最新，不应被淘汰
+        assert asyncio.run(store.get("k0")) == {"v": blob}
+        result = asyncio.run(store.compact())
+        assert result["evicted"] > 0
+        kept = [i for i in range(8) if asyncio.run(store.get(f"k{i}")) is not MISSING]
+        assert 0 in kept
+        # 淘汰按最近访问时间从旧到新，剩下的是最近写入的那些
+        assert kept[1:] == list(range(8 - len(kept) + 1, 8))
+        assert len(kept) * 1000 <= 5000 * 0.9
+    finally:
+        store.close()
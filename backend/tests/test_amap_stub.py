@@ -0,0 +1,118 @@
+import asyncio
+import json
+import random
+
+import httpx
+import pytest
+
+from app.services.amap_stub import QPS_EXCEEDED, AmapStub, LatencyModel, Recordings, create_stub_app
+
+GEOCODE = ("/v3/geocode/geo", {"address": "西湖", "city": "杭州", "key": "k1"})
+
+
+def test_latency_model_distributions():
+    rng = random.Random(1)
+    assert LatencyModel("0").sample(rng) == 0.0 and LatencyModel("").sample(rng) == 0.0
+    assert LatencyModel("fixed:20").sample(rng) == pytest.approx(0.02)
+    assert all(0.01 <= LatencyModel("uniform:10:50").sample(rng) <= 0.05 for _ in range(100))
+    samples = sorted(LatencyModel("lognormal:40:0.5").sample(rng) for _ in range(2001))
+    # 中位数在 40ms 附近，长尾明显高于中位数
+    assert samples[1000] == pytest.approx(0.04, rel=0.1) and samples[-1] > 0.1
+    with pytest.raises(ValueError):
+        LatencyModel("pareto:1")
+
+
+def test_recordings_round_trip(tmp_path):
+    path = str(tmp_path / "amap.jsonl")
+    recordings = Recordings(path)
+    recordings.add(*GEOCODE, {"status": "1", "n": 1})
+    recordings.add(*GEOCODE, {"status": "1", "n": 2})
+    lines = [json.loads(line) for line in open(path, encoding="utf-8")]
+    # Key 不写入文件，也不参与匹配
+    assert lines[0]["endpoint"] == "geocode/geo" and "key" not in lines[0]["params"]
+    loaded = Recordings(path)
+    assert len(loaded) == 1
+    assert loaded.get("/v3/geocode/geo", {"address": "西湖", "city": "杭州", "key": "k2"}) == {"status": "1", "n": 2}
+    assert loaded.get("/v3/geocode/geo", {"address": "断桥", "city": "杭州"}) is None
+
+
+def test_replay_strict_and_synthetic():
+    recordings = Recordings()
+    recordings.add(*GEOCODE, {"status": "1", "geocodes": []})
+    replay, strict = AmapStub(recordings), AmapStub(recordings, mode="strict")
+
+    async def main():
+        other = ("/v3/place/text", {"city": "杭州", "keywords": "公园", "page": "1", "offset": "5"})
+        return (await replay.handle(*GEOCODE), await replay.handle(*other), await replay.handle(*other),
+                await strict.handle(*GEOCODE), await strict.handle(*other))
+
+    hit, synth, again, strict_hit, missing = asyncio.run(main())
+    assert hit == strict_hit == (200, {"status": "1", "geocodes": []})
+    # 没有录制时 replay 合成确定性的数据，strict 返回 404
+    assert synth == again and synth[0] == 200 and len(synth[1]["pois"]) == 5
+    assert missing[0] == 404 and missing[1]["info"] == "NO_RECORDING"
+    assert (replay.replayed, replay.synthesized, strict.replayed) == (1, 2, 1)
+    with pytest.raises(ValueError):
+        AmapStub(recordings, mode="live")
+
+
+def test_record_forwards_and_keeps_only_successes(tmp_path):
+    seen = []
+
+    def upstream(request):
+        seen.append(request)
+        if request.url.params["address"] == "坏地址":
+            return httpx.Response(200, json={"status": "0", "info": "INVALID_PARAMS"})
+        return httpx.Response(200, json={"status": "1", "info": "OK", "geocodes": []})
+
+    path = str(tmp_path / "amap.jsonl")
+    stub = AmapStub(Recordings(path), mode="record", api_key="real-key")
+    stub._http = httpx.AsyncClient(transport=httpx.MockTransport(upstream))
+
+    async def main():
+        ok = await stub.handle(*GEOCODE)
+        bad = await stub.handle("/v3/geocode/geo", {"address": "坏地址", "key": "k1"})
+        replayed = await stub.handle(*GEOCODE)
+        await stub.close()
+        return ok, bad, replayed
+
+    ok, bad, replayed = asyncio.run(main())
+    # 转发时换成桩自己的 Key；录过的请求不再转发
+    assert [str(r.url.path) for r in seen] == ["/v3/geocode/geo"] * 2
+    assert seen[0].url.params["key"] == "real-key"
+    assert ok == replayed and bad[1]["status"] == "0"
+    assert stub.recorded == 1 and stub.replayed == 1 and len(Recordings(path)) == 1
+
+
+@pytest.mark.parametrize("kw, status, kind", [
+    ({"error_rate": 1.0}, 500, "error"),
+    ({"throttle_rate": 1.0}, 200, "throttle"),
+    ({"timeout_rate": 1.0, "hang_seconds": 0.0}, 504, "timeout"),
+])
+def test_fault_injection(kw, status, kind):
+    stub = AmapStub(Recordings(), **kw)
+    code, body = asyncio.run(stub.handle(*GEOCODE))
+    assert code == status and stub.injected[kind] == 1
+    if kind == "throttle":
+        assert body == QPS_EXCEEDED
+
+
+def test_fault_rates_and_batch_counted_once():
+    stub = AmapStub(Recordings(), error_rate=0.2, throttle_rate=0.1, seed=3)
+
+    async def main():
+        for _ in range(1000):
+            await stub.handle(*GEOCODE)
+        clean = AmapStub(Recordings())
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=create_stub_app(clean)), base_url="http://stub") as http:
+            ops = [{"url": "/v3/geocode/geo?address=西湖&city=杭州"}, {"url": "/v3/place/text?city=杭州&keywords=公园&offset=3"}]
+            batch = await http.post("/v3/batch", json={"ops": ops})
+            stats = await http.get("/stub/stats")
+        return batch.json(), stats.json()
+
+    batch, stats = asyncio.run(main())
+    assert 150 < stub.injected["error"] < 250 and 60 < stub.injected["throttle"] < 140
+    assert stub.injected["timeout"] == 0
+    # 批量请求整体注入/计数一次，内部每个子请求各自应答
+    assert [op["status"] for op in batch] == [200, 200] and len(batch[1]["body"]["pois"]) == 3
+    assert stats["requests"] == {"batch": 1} and stats["synthesized"] == 2
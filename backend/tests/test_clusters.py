@@ -0,0 +1,35 @@
+import numpy as np
+import pytest
+
+from app.utils.geo import balanced_clusters
+
+
+@pytest.mark.parametrize("n,k", [(30, 3), (31, 4), (7, 2), (50, 7), (12, 12)])
+def test_group_sizes_within_capacity(n, k):
+    coords = np.random.default_rng(n).uniform([116.2, 39.8], [116.6, 40.05], (n, 2))
+    labels = balanced_clusters(coords, k, seed=42)
+    assert labels.shape == (n,)
+    sizes = np.bincount(labels, minlength=k)
+    assert len(sizes) == k
+    assert sizes.max() <= -(-n // k)
+    assert sizes.sum() == n
+
+
+def test_fewer_points_than_groups_and_single_group():
+    coords = [(116.0, 40.0), (116.1, 40.0)]
+    assert list(balanced_clusters(coords, 5)) == [0, 1]
+    assert list(balanced_clusters(coords, 1)) == [0, 0]
+
+
+def test_same_seed_same_labels():
+    coords = np.random.default_rng(3).uniform([116.2, 39.8], [116.6, 40.05], (40, 2))
+    assert np.array_equal(balanced_clusters(coords, 4, seed=1), balanced_clusters(coords, 4, seed=1))
+
+
+def test_separated_groups_stay_together():
+    rng = np.random.default_rng(5)
+    west = rng.normal([116.0, 40.0], 0.005, (10, 2))
+    east = rng.normal([117.0, 40.0], 0.005, (10, 2))
+    labels = balanced_clusters(np.vstack([west, east]), 2, seed=0)
+    assert len(set(labels[:10])) == 1 and len(set(labels[10:])) == 1
+    assert labels[0] != labels[10]
@@ -0,0 +1,96 @@
+import asyncio
+
+import pytest
+
+from app.core import config
+from app.utils import itinerary, query_plan
+from app.utils.itinerary import _collect_pois
+from app.utils.poi import make_poi
+from app.utils.query_plan import KeywordYield
+
+
+class FakeSearch:
+    """POI 搜索：每页 offset 个互不重叠的 POI，empty 中的关键词没有结果；reverse 时越靠后发出的请求越早返回"""
+
+    def __init__(self, empty=(), reverse=False):
+        self.empty = set(empty)
+        self.reverse = reverse
+        self.calls = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.cancelled = 0
+
+    def _page(self, keywords, types, page, offset):
+        label = keywords or types
+        if label in self.empty:
+            return []
+        base = 100.0 + len(self.calls) + page * 0.5
+        return [make_poi(f"{label}-{page}-{i}", f"{label}-{page}-{i}", "", base + i * 0.05, 30.0) for i in range(offset)]
+
+    async def search_poi(self, city, keywords, page=1, offset=10, types=""):
+        self.calls.append((keywords or types, page))
+        result = self._page(keywords, types, page, offset)
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(0.05 / len(self.calls) if self.reverse else 0.01)
+            return result
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        finally:
+            self.in_flight -= 1
+
+    async def search_poi_many(self, city, queries, extensions="base"):
+        self.calls.append(tuple(kw or types for kw, _, _, types in queries))
+        await asyncio.sleep(0.001)
+        return [self._page(kw, types, page, offset) for kw, page, offset, types in queries]
+
+
+@pytest.fixture(autouse=True)
+def fresh_yield(monkeypatch):
+    yields = KeywordYield(0)
+    monkeypatch.setattr(itinerary, "KEYWORD_YIELD", yields)
+    monkeypatch.setattr(query_plan, "KEYWORD_YIELD", yields)
+
+
+@pytest.fixture
+def single_requests(monkeypatch):
+    monkeypatch.setattr(config, "POI_QUERY_COMPACTION", False)
+    monkeypatch.setattr(config, "AMAP_BATCH_ENABLED", False)
+    monkeypatch.setattr(config, "POI_SEARCH_CONCURRENCY", 3)
+
+
+def test_fan_out_keeps_query_order(single_requests):
+    client = FakeSearch(reverse=True)
+    pois = asyncio.run(_collect_pois(client, "杭州", ["甲", "乙", "丙"], max_needed=100, min_needed=4))
+    # 6 个查询并发发出（受并发上限限制），结果仍按关键词、页码顺序合并
+    assert client.max_in_flight == 3 and len(client.calls) == 6
+    assert [p.name for p in pois[::8]] == ["甲-1-0", "甲-2-0", "乙-1-0", "乙-2-0", "丙-1-0", "丙-2-0"]
+    assert len(pois) == 48
+
+
+def test_stops_and_cancels_when_enough(single_requests):
+    client = FakeSearch()
+    pois = asyncio.run(_collect_pois(client, "杭州", ["甲", "乙", "丙"], max_needed=10, min_needed=4))
+    assert [p.name for p in pois] == [f"甲-1-{i}" for i in range(8)] + ["甲-2-0", "甲-2-1"]
+    # 第一波 3 个请求返回后就够了，其余的取消（排队中的不再发出）
+    assert len(client.calls) - client.cancelled == 3 and client.in_flight == 0
+
+
+def test_fallback_keywords_fill_the_gap(single_requests):
+    client = FakeSearch(empty={"冷门"})
+    pois = asyncio.run(_collect_pois(client, "杭州", ["冷门"], max_needed=30, min_needed=12))
+    assert len(pois) == 12
+    assert {p.name.split("-")[0] for p in pois} <= set(itinerary.FALLBACK_KEYWORDS)
+
+
+@pytest.mark.parametrize("min_needed, round_trips", [(12, 1), (4, 2)])
+def test_fallback_window_prefetched_when_at_risk(monkeypatch, min_needed, round_trips):
+    monkeypatch.setattr(config, "POI_QUERY_COMPACTION", True)
+    monkeypatch.setattr(config, "AMAP_BATCH_ENABLED", True)
+    client = FakeSearch(empty={"冷门"})
+    pois = asyncio.run(_collect_pois(client, "杭州", ["冷门"], max_needed=30, min_needed=min_needed))
+    # 主查询预计凑不够时，备用关键词随第一波一起发出，省掉一次往返
+    assert len(client.calls) == round_trips
+    assert len(pois) == min_needed
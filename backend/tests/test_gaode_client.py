@@ -0,0 +1,99 @@
+import asyncio
+
+import httpx
+import pytest
+
+from app.services.amap_stub import AmapStub, Recordings, create_stub_app
+from app.services.gaode_mcp import FAILED, AsyncAmapClient, track_upstream
+
+
+def _stub_http(**kw):
+    """挂在本地高德桩（合成数据）上的 httpx 客户端，不走网络"""
+    stub = AmapStub(Recordings(), seed=1, **kw)
+    return stub, httpx.AsyncClient(transport=httpx.ASGITransport(app=create_stub_app(stub)))
+
+
+def test_shared_client_geocode_search_and_route():
+    async def main():
+        stub, http = _stub_http()
+        async with http:
+            client = AsyncAmapClient(http, api_key="test")
+            with track_upstream() as calls:
+                center, pois, page2 = await asyncio.gather(
+                    client.geocode("南京"),
+                    client.search_poi("南京", "博物馆|公园", page=1, offset=4),
+                    client.search_poi("南京", "博物馆|公园", page=2, offset=4),
+                )
+                route = await client.route_time(pois[0].location, pois[1].location, mode="drive")
+        assert isinstance(center, tuple) and len(center) == 2
+        # 多关键词的结果交替排列，第二页接着第一页
+        assert [p.name for p in pois] == ["南京博物馆1", "南京公园1", "南京博物馆2", "南京公园2"]
+        assert [p.name for p in page2][:2] == ["南京博物馆3", "南京公园3"]
+        assert pois[0].tel is None and pois[0].category == "风景名胜;博物馆"
+        assert route["mode"] == "drive" and route["distance_km"] > 0 and isinstance(route["est_duration_min"], int)
+        assert calls == {"round_trips": 4, "geocode": 1, "place": 2, "direction": 1}
+        assert stub.stats()["requests"] == {"geocode": 1, "place": 2, "direction": 1}
+
+    asyncio.run(main())
+
+
+@pytest.mark.parametrize("kw", [{"error_rate": 1.0}, {"throttle_rate": 1.0}])
+def test_failures_are_empty_or_failed_in_strict_mode(kw):
+    async def main():
+        _, http = _stub_http(**kw)
+        async with http:
+            client = AsyncAmapClient(http, api_key="test")
+            loose = await asyncio.gather(client.geocode("南京"), client.search_poi("南京", "公园"),
+                                         client.route_time((118.7, 32.0), (118.8, 32.1)))
+            strict = await asyncio.gather(client.geocode("南京", strict=True), client.search_poi("南京", "公园", strict=True),
+                                          client.route_time((118.7, 32.0), (118.8, 32.1), strict=True))
+        assert loose == [None, [], None]
+        assert all(v is FAILED for v in strict)
+
+    asyncio.run(main())
+
+
+def test_missing_key_fails_without_requests():
+    async def main():
+        stub, http = _stub_http()
+        async with http:
+            client = AsyncAmapClient(http, api_key="test")
+            client.api_key = ""
+            assert await client.search_poi("南京", "公园") == []
+            assert await client.geocode("南京", strict=True) is FAILED
+            assert await client.route_time_many([((1, 1), (2, 2))], strict=True) == [FAILED]
+        assert stub.stats()["requests"] == {}
+
+    asyncio.run(main())
+
+
+def test_batch_chunks_and_falls_back_to_single_requests(monkeypatch):
+    from app.core import config
+
+    monkeypatch.setattr(config, "AMAP_BATCH_MAX_OPS", 2)
+    queries = [(kw, 1, 3, "") for kw in ("公园", "博物馆", "寺庙", "夜市", "古镇")]
+
+    async def run(batch_works):
+        stub = AmapStub(Recordings(), seed=1)
+        asgi = httpx.ASGITransport(app=create_stub_app(stub))
+
+        async def handler(request):
+            if request.url.path.endswith("/batch") and not batch_works:
+                # Key 没有开通批量接口
+                return httpx.Response(403, json={"status": "0", "info": "INSUFFICIENT_PRIVILEGES"})
+            return await asgi.handle_async_request(request)
+
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as http:
+            client = AsyncAmapClient(http, api_key="test")
+            with track_upstream() as calls:
+                found = await client.search_poi_many("苏州", queries)
+        return found, calls, stub.stats()["requests"]
+
+    batched, calls, requests = asyncio.run(run(True))
+    assert calls == {"round_trips": 3, "place": 5}
+    assert requests == {"batch": 3}
+    fallback, calls, requests = asyncio.run(run(False))
+    # 每批失败后逐个请求，结果与批量一致
+    assert fallback == batched and [p[0].name for p in batched] == [f"苏州{kw}1" for kw, *_ in queries]
+    assert requests == {"place": 5}
+    assert calls == {"round_trips": 8, "place": 10}
@@ -0,0 +1,56 @@
+import random
+
+import numpy as np
+import pytest
+
+from app.utils.geo import SpeedModel, estimate_move, haversine_km, haversine_matrix
+
+
+def test_matrix_matches_scalar_haversine():
+    rng = random.Random(3)
+    coords = [(116.0 + rng.random(), 39.5 + rng.random()) for _ in range(30)]
+    matrix = haversine_matrix(coords)
+    assert matrix.shape == (30, 30)
+    assert np.allclose(matrix, matrix.T) and np.all(np.diag(matrix) == 0)
+    for i in range(0, 30, 7):
+        for j in range(0, 30, 5):
+            assert matrix[i, j] == pytest.approx(haversine_km(coords[i], coords[j]), abs=1e-9)
+    # 北京天安门 → 上海人民广场约 1067 km
+    assert haversine_km((116.3975, 39.9087), (121.4737, 31.2304)) == pytest.approx(1067, rel=0.01)
+    assert haversine_matrix([]).shape == (0, 0)
+
+
+def _observe(model, legs):
+    for key, straight, dist, minutes in legs:
+        model.observe(key, straight, dist, minutes)
+
+
+def test_speed_model_uses_median_of_distinct_legs():
+    legs = [(i, 2.0, 2.0 * (1.2 + 0.01 * i), 30 + i) for i in range(25)]
+    model = SpeedModel(detour=1.3, speed_kmh=4.5, min_samples=20)
+    _observe(model, legs[:19])
+    # 样本不够时保持经验值
+    assert (model.detour, model.speed_kmh) == (1.3, 4.5)
+    _observe(model, legs[19:])
+    assert model.detour == pytest.approx(1.32)
+
+    # 同一路段被反复观测（缓存命中）不改变系数，观测顺序也不影响结果
+    before = (model.detour, model.speed_kmh)
+    for _ in range(50):
+        model.observe(0, 2.0, 2.0 * 2.9, 200)
+    assert model.detour == pytest.approx(before[0], abs=0.02)
+    shuffled = SpeedModel(detour=1.3, speed_kmh=4.5, min_samples=20)
+    _observe(shuffled, random.Random(1).sample(legs, len(legs)))
+    assert (shuffled.detour, shuffled.speed_kmh) == pytest.approx(before)
+
+
+def test_frozen_snapshot_and_estimate():
+    model = SpeedModel(detour=1.3, speed_kmh=4.5, min_samples=1)
+    frozen = model.frozen()
+    model.observe("leg", 2.0, 5.0, 60)
+    assert frozen.detour == 1.3 and model.detour == 2.5
+    move = estimate_move(1.0, "walk", {"walk": frozen})
+    assert move == {"mode": "walk", "distance_km": 1.3, "est_duration_min": 17, "source": "estimate"}
+    # 过短的路段不参与校准
+    model.observe("short", 0.1, 1.0, 30)
+    assert "short" not in model._samples
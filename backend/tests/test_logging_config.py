@@ -0,0 +1,112 @@
+import json
+import logging
+import queue
+
+import pytest
+
+from app.core import config, logging_config
+from app.core.logging_config import DeferredQueueHandler, debug_sampled, parse_rates, setup_logging, stop_logging
+
+
+class _Records(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+@pytest.fixture
+def records():
+    logger = logging.getLogger("test.sampled")
+    handler = _Records()
+    logger.addHandler(handler)
+    logger.propagate = False
+    yield logger, handler.records
+    logger.removeHandler(handler)
+    logger.propagate = True
+    logger.setLevel(logging.NOTSET)
+
+
+@pytest.fixture
+def root_logging():
+    """setup_logging 会替换根日志的 handler，测试结束后还原"""
+    root = logging.getLogger()
+    handlers, level = list(root.handlers), root.level
+    yield
+    stop_logging()
+    root.handlers[:] = handlers
+    root.setLevel(level)
+
+
+def test_parse_rates():
+    assert parse_rates("amap=0.01, search = 0.1,bad,=1,x=2,y=-1") == {"amap": 0.01, "search": 0.1, "x": 1.0, "y": 0.0}
+    assert parse_rates("") == {}
+
+
+def test_debug_sampled_by_category(monkeypatch, records):
+    logger, seen = records
+    monkeypatch.setattr(logging_config, "_rates", {"never": 0.0, "half": 0.5})
+    monkeypatch.setattr(logging_config, "_default_rate", 1.0)
+    draws = iter([0.7, 0.2])
+    monkeypatch.setattr(logging_config.random, "random", lambda: next(draws))
+
+    logger.setLevel(logging.INFO)
+    debug_sampled(logger, "half", "off %s", 1)
+    logger.setLevel(logging.DEBUG)
+    debug_sampled(logger, "never", "dropped %s", 2)
+    debug_sampled(logger, "half", "unlucky %s", 3)
+    debug_sampled(logger, "half", "kept %s", 4)
+    debug_sampled(logger, "other", "default %s", 5)
+    # 未开启 DEBUG 时不抽样；记录的位置是调用方而不是 debug_sampled 本身
+    assert [r.getMessage() for r in seen] == ["kept 4", "default 5"]
+    assert seen[0].funcName == "test_debug_sampled_by_category"
+    assert next(draws, None) is None
+
+
+def test_deferred_queue_handler_formats_mutable_args_eagerly():
+    q = queue.SimpleQueue()
+    handler = DeferredQueueHandler(q)
+    logger = logging.getLogger("test.deferred")
+    logger.addHandler(handler)
+    logger.propagate = False
+    try:
+        data = {"n": 1}
+        logger.warning("plain %s %d", "a", 2)
+        logger.warning("mutable %s", data)
+        data["n"] = 2
+    finally:
+        logger.removeHandler(handler)
+        logger.propagate = True
+    plain, mutable = q.get_nowait(), q.get_nowait()
+    # 不可变参数留给后台线程格式化；可变参数在调用线程就格式化好，之后的改动不影响日志
+    assert (plain.msg, plain.args) == ("plain %s %d", ("a", 2))
+    assert (mutable.msg, mutable.args) == ("mutable {'n': 1}", None)
+
+
+def test_queue_json_output(monkeypatch, capsys, root_logging):
+    monkeypatch.setattr(config, "LOG_CONFIG", "")
+    monkeypatch.setattr(config, "LOG_FORMAT", "json")
+    monkeypatch.setattr(config, "LOG_QUEUE", True)
+    monkeypatch.setattr(config, "LOG_LEVEL", "info")
+    setup_logging(force=True)
+    assert isinstance(logging.getLogger().handlers[0], DeferredQueueHandler)
+    logging.getLogger("test.json").info("规划 %s", "杭州", extra={"request_id": "r1"})
+    logging.getLogger("test.json").debug("不输出")
+    stop_logging()
+    lines = capsys.readouterr().err.splitlines()
+    assert len(lines) == 1
+    out = json.loads(lines[0])
+    assert (out["level"], out["logger"], out["msg"], out["request_id"]) == ("INFO", "test.json", "规划 杭州", "r1")
+    assert logging.getLogger("httpx").level == logging.WARNING
+
+
+def test_keeps_existing_handlers(monkeypatch, root_logging):
+    monkeypatch.setattr(config, "LOG_CONFIG", "")
+    root = logging.getLogger()
+    existing = _Records()
+    root.handlers[:] = [existing]
+    setup_logging()
+    # 运行环境（如 uvicorn --log-config）已经配置过时不覆盖
+    assert root.handlers == [existing]
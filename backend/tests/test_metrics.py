@@ -0,0 +1,102 @@
+import asyncio
+
+import httpx
+import pytest
+from fastapi import FastAPI
+
+from app.core import config
+from app.routers import metrics as metrics_router
+from app.routers import plan as plan_router
+from app.routers.plan import _plan_server_timing
+from app.services import metrics
+from app.services.amap_cache import CachedAmapClient
+from app.services.amap_stub import AmapStub, Recordings, create_stub_app
+from app.services.gaode_mcp import AsyncAmapClient
+from app.services.metrics import Counter, Histogram, Registry, server_timing
+from app.services.plan_cache import PlanCache
+
+
+def test_text_format():
+    registry = Registry()
+    hist = registry.register(Histogram("t_seconds", "耗时", ["stage"], buckets=(0.1, 1.0)))
+    counter = registry.register(Counter("t_total", "次数", ["path"]))
+    for v in (0.05, 0.5, 2.0):
+        hist.observe(v, stage="a")
+    counter.inc(path='x"\\y')
+    counter.inc(2, path='x"\\y')
+    counter.set(7, path="z")
+    lines = registry.render().splitlines()
+    # 桶计数累计，+Inf 等于总数；标签值转义
+    assert lines[:2] == ["# HELP t_seconds 耗时", "# TYPE t_seconds histogram"]
+    assert lines[2:7] == [
+        't_seconds_bucket{stage="a",le="0.1"} 1',
+        't_seconds_bucket{stage="a",le="1"} 2',
+        't_seconds_bucket{stage="a",le="+Inf"} 3',
+        't_seconds_sum{stage="a"} 2.55',
+        't_seconds_count{stage="a"} 3',
+    ]
+    assert lines[-2:] == ['t_total{path="x\\"\\\\y"} 3', 't_total{path="z"} 7']
+    assert hist.count(stage="a") == 3 and hist.count(stage="b") == 0
+    with pytest.raises(ValueError):
+        registry.register(Counter("t_total", "重复"))
+
+
+def test_plan_server_timing_variants():
+    raw = {"debug_info": {"timings_ms": {"geocode": {"wall_ms": 12.34}, "collect": {"wall_ms": 80.0}}}}
+    assert server_timing([("a", 1.24), ("b", 10)]) == "a;dur=1.2, b;dur=10.0"
+    assert _plan_server_timing(raw, "miss", 0.001, 0.002, 0.1) == (
+        "geocode;dur=12.3, collect;dur=80.0, shaping;dur=1.0, serialization;dur=2.0, total;dur=100.0")
+    # 命中缓存时不再带流水线阶段；复用已编码的响应体时只剩总耗时
+    assert _plan_server_timing(raw, "stale", 0.001, 0.002, 0.01) == (
+        'plan-cache;desc="stale", shaping;dur=1.0, serialization;dur=2.0, total;dur=10.0')
+    assert _plan_server_timing(raw, "hit", None, None, 0.001) == 'plan-cache;desc="hit", body-cache;desc="hit", total;dur=1.0'
+
+
+def test_plan_headers_and_metrics_endpoint(monkeypatch):
+    monkeypatch.setattr(config, "METRICS_ENABLED", True)
+    shaping = metrics.STAGE_SECONDS.count(stage="shaping")
+    plans = metrics.PLANS.value(result="ok")
+
+    async def main():
+        upstream = httpx.AsyncClient(transport=httpx.ASGITransport(app=create_stub_app(AmapStub(Recordings(), seed=1))))
+        async with upstream:
+            app = FastAPI()
+            app.include_router(plan_router.router, prefix="/api")
+            app.include_router(metrics_router.router)
+            app.state.amap = CachedAmapClient(AsyncAmapClient(upstream, api_key="test"))
+            app.state.plan_cache = PlanCache(8, 600, 300, body_maxsize=8)
+            async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as http:
+                body = {"city": "西安", "start_date": "2025-04-01", "days": 2}
+                first = await http.post("/api/plan_km", json=body)
+                second = await http.post("/api/plan_km", json=body)
+                text = (await http.get("/metrics")).text
+        return first, second, text
+
+    first, second, text = asyncio.run(main())
+    stages = [part.split(";")[0] for part in first.headers["Server-Timing"].split(", ")]
+    assert stages[0] == "geocode" and stages[-3:] == ["shaping", "serialization", "total"]
+    assert second.headers["Server-Timing"].startswith('plan-cache;desc="hit", body-cache;desc="hit", total;dur=')
+    # 只有真正编码过响应体的请求记录 shaping；新规划的行程计入 plans_total
+    assert metrics.STAGE_SECONDS.count(stage="shaping") == shaping + 1
+    assert metrics.PLANS.value(result="ok") == plans + 1
+    assert "# TYPE plan_stage_seconds histogram" in text
+    assert 'plan_cache_lookups_total{result="hit"} 1' in text and 'plan_cache_lookups_total{result="miss"} 1' in text
+    assert 'amap_cache_lookups_total{endpoint="geocode",result="miss"}' in text
+    assert 'amap_upstream_requests_total{family=' in text
+
+
+def test_no_server_timing_when_disabled(monkeypatch):
+    monkeypatch.setattr(config, "METRICS_ENABLED", False)
+
+    async def main():
+        upstream = httpx.AsyncClient(transport=httpx.ASGITransport(app=create_stub_app(AmapStub(Recordings(), seed=1))))
+        async with upstream:
+            app = FastAPI()
+            app.include_router(plan_router.router, prefix="/api")
+            app.state.amap = AsyncAmapClient(upstream, api_key="test")
+            app.state.plan_cache = None
+            async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as http:
+                return await http.post("/api/plan_km", json={"city": "西安", "start_date": "2025-04-01", "days": 1})
+
+    response = asyncio.run(main())
+    assert response.status_code == 200 and "Server-Timing" not in response.headers
@@ -0,0 +1,53 @@
+import asyncio
+
+from app.services.plan_cache import PlanCache, plan_cache_key
+
+
+def test_key_normalizes_equivalent_requests():
+    a = plan_cache_key(" 北京 ", 3, ["food", "history", "food", " "], " 天安门 ")
+    b = plan_cache_key("北京", 3, ["history", " food"], "天安门")
+    assert a == b == ("北京", 3, ("food", "history"), "天安门")
+
+
+def test_key_missing_values():
+    assert plan_cache_key("上海", 2, None, None) == plan_cache_key("上海", 2, [], "")
+    assert plan_cache_key("上海", 2, None, None) != plan_cache_key("上海", 3, None, None)
+    assert plan_cache_key("上海", 2, ["art"], None) != plan_cache_key("上海", 2, ["food"], None)
+
+
+def test_hit_stale_and_single_build():
+    builds = []
+
+    async def build():
+        builds.append(1)
+        await asyncio.sleep(0.01)
+        return {"days": [], "debug_info": {"search_success": True}}
+
+    async def main():
+        cache = PlanCache(maxsize=8, ttl=60, soft_ttl=0.05)
+        key = plan_cache_key("北京", 1, ["food"], None)
+        results = await asyncio.gather(*(cache.get_or_build(key, build) for _ in range(5)))
+        assert [status for _, status in results] == ["miss"] * 5
+        assert len(builds) == 1
+        assert (await cache.get_or_build(key, build))[1] == "hit"
+        await asyncio.sleep(0.06)
+        # 超过 soft_ttl：先返回旧结果，后台再规划一次
+        assert (await cache.get_or_build(key, build))[1] == "stale"
+        await asyncio.sleep(0.05)
+        assert len(builds) == 2 and cache.refreshes == 1
+        await cache.close()
+
+    asyncio.run(main())
+
+
+def test_failed_plan_not_cached():
+    async def build():
+        return {"days": [], "debug_info": {"search_success": False}}
+
+    async def main():
+        cache = PlanCache(maxsize=8, ttl=60, soft_ttl=60)
+        key = plan_cache_key("北京", 1, None, None)
+        await cache.get_or_build(key, build)
+        assert (await cache.get_or_build(key, build))[1] == "miss"
+
+    asyncio.run(main())
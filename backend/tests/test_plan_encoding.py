@@ -0,0 +1,81 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+from fastapi import FastAPI
+
+from app.core import config
+from app.routers.plan import encode_km_travel, router
+from app.services.amap_stub import AmapStub, Recordings, create_stub_app
+from app.services.gaode_mcp import AsyncAmapClient
+from app.services.plan_cache import PlanCache
+from app.utils.itinerary import build_itinerary, to_km_travel
+
+
+def _stub_http():
+    """挂在本地高德桩（合成数据、无延迟）上的 httpx 客户端，不走网络"""
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=create_stub_app(AmapStub(Recordings(), seed=1))))
+
+
+def _encode_both(monkeypatch, shaped):
+    monkeypatch.setattr(config, "FAST_JSON_ENABLED", True)
+    fast = encode_km_travel(shaped)
+    monkeypatch.setattr(config, "FAST_JSON_ENABLED", False)
+    return fast, encode_km_travel(shaped)
+
+
+@pytest.mark.parametrize("days, interests, start", [(1, None, None), (3, ["history", "food"], "西湖"), (5, ["art"], None)])
+def test_fast_json_matches_validated_response(monkeypatch, days, interests, start):
+    async def build():
+        async with _stub_http() as http:
+            return await build_itinerary(AsyncAmapClient(http, api_key="test"), "杭州", days, interests, start, "2025-01-01")
+
+    plan = asyncio.run(build())
+    assert plan["debug_info"]["search_success"]
+    fast, validated = _encode_both(monkeypatch, to_km_travel(plan))
+    # 字段顺序、None、浮点格式都一致，逐字节相同
+    assert fast == validated
+    assert json.loads(fast)["days"][days - 1]["title"].endswith(f"（2025-01-0{days}）")
+
+
+def test_fast_json_matches_validated_empty_plan(monkeypatch):
+    async def build():
+        async with _stub_http() as http:
+            # 没有 Key：所有请求都失败，行程只剩占位景点
+            client = AsyncAmapClient(http, api_key="test")
+            client.api_key = ""
+            return await build_itinerary(client, "杭州", 2, None, None, "2025-01-01")
+
+    plan = asyncio.run(build())
+    assert not plan["debug_info"]["search_success"]
+    fast, validated = _encode_both(monkeypatch, to_km_travel(plan))
+    assert fast == validated
+
+
+def test_cached_body_matches_fresh_encoding(monkeypatch):
+    monkeypatch.setattr(config, "FAST_JSON_ENABLED", True)
+
+    async def main():
+        async with _stub_http() as upstream:
+            app = FastAPI()
+            app.include_router(router, prefix="/api")
+            app.state.amap = AsyncAmapClient(upstream, api_key="test")
+            app.state.plan_cache = PlanCache(8, 600, 300, body_maxsize=8)
+            async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as http:
+                body = {"city": "成都", "start_date": "2025-03-01", "days": 2, "interests": ["food"]}
+                first = await http.post("/api/plan_km", json=body)
+                second = await http.post("/api/plan_km", json=body)
+                other = await http.post("/api/plan_km", json={**body, "start_date": "2025-03-05"})
+                monkeypatch.setattr(config, "FAST_JSON_ENABLED", False)
+                validated = await http.post("/api/plan_km", json={**body, "start_date": "2025-03-07"})
+            return app.state.plan_cache, first, second, other, validated
+
+    cache, first, second, other, validated = asyncio.run(main())
+    assert [r.headers["X-Plan-Cache"] for r in (first, second, other)] == ["miss", "hit", "hit"]
+    # 第二次直接复用已编码的响应体；换了日期的命中同一份行程但重新编码
+    assert cache.body_hits == 1
+    assert second.content == first.content
+    assert "2025-03-05" in other.json()["days"][0]["title"]
+    # 同一份行程套上日期后，校验路径和 orjson 路径只差日期
+    assert validated.content == other.content.replace(b"2025-03-05", b"2025-03-07").replace(b"2025-03-06", b"2025-03-08")
@@ -0,0 +1,89 @@
+import asyncio
+import json
+
+import httpx
+from fastapi import FastAPI
+
+from app.routers.plan import router
+from app.services.amap_stub import AmapStub, Recordings, create_stub_app
+from app.services.gaode_mcp import AsyncAmapClient
+from app.services.plan_cache import PlanCache
+
+BODY = {"city": "杭州", "start_date": "2025-01-01", "days": 3, "interests": ["history"]}
+
+
+def _app(upstream, plan_cache=None):
+    app = FastAPI()
+    app.include_router(router, prefix="/api")
+    app.state.amap = AsyncAmapClient(upstream, api_key="test") if upstream is not None else None
+    app.state.plan_cache = plan_cache
+    return app
+
+
+def _stub_http():
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=create_stub_app(AmapStub(Recordings(), seed=1))))
+
+
+async def _post(app, path, body, **headers):
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as http:
+        return await http.post(path, json=body, headers=headers)
+
+
+def _ndjson(response):
+    return [(e["event"], e["data"]) for e in map(json.loads, response.text.splitlines())]
+
+
+def _sse(response):
+    events = []
+    for block in response.text.strip().split("\n\n"):
+        event, data = block.split("\n")
+        assert event.startswith("event: ") and data.startswith("data: ")
+        events.append((event[len("event: "):], json.loads(data[len("data: "):])))
+    return events
+
+
+def test_ndjson_event_order_matches_full_plan():
+    async def main():
+        async with _stub_http() as upstream:
+            app = _app(upstream, PlanCache(8, 600, 300))
+            streamed = await _post(app, "/api/plan_km/stream", BODY)
+            # 流式生成的行程写入缓存，随后的整份请求命中同一份行程
+            full = await _post(app, "/api/plan_km", BODY)
+        return streamed, full
+
+    streamed, full = asyncio.run(main())
+    assert streamed.headers["content-type"].startswith("application/x-ndjson")
+    assert streamed.headers["X-Plan-Cache"] == "miss" and full.headers["X-Plan-Cache"] == "hit"
+    events = _ndjson(streamed)
+    assert [e for e, _ in events] == ["header", "day", "day", "day", "summary"]
+    header, summary = events[0][1], events[-1][1]
+    assert header["days_total"] == 3 and header["start"] is not None
+    assert [d["index"] for _, d in events[1:-1]] == [1, 2, 3]
+    plan = full.json()
+    assert [{k: v for k, v in d.items() if k != "index"} for _, d in events[1:-1]] == plan["days"]
+    assert summary["cta_links"] == plan["cta_links"]
+    assert summary["debug_info"]["search_success"]
+
+
+def test_sse_from_cache_keeps_the_same_order():
+    async def main():
+        async with _stub_http() as upstream:
+            app = _app(upstream, PlanCache(8, 600, 300))
+            first = await _post(app, "/api/plan_km/stream", BODY)
+            second = await _post(app, "/api/plan_km/stream", BODY, accept="text/event-stream")
+        return first, second
+
+    first, second = asyncio.run(main())
+    assert second.headers["content-type"].startswith("text/event-stream")
+    assert second.headers["X-Plan-Cache"] == "hit" and second.headers["cache-control"] == "no-cache"
+    # 命中缓存时一次性输出，事件顺序和内容与边算边推时相同
+    assert _sse(second) == _ndjson(first)
+
+
+def test_stream_ends_with_error_event():
+    # 没有可用的高德客户端：规划中途出错，以 error 事件收尾而不是断开连接
+    response = asyncio.run(_post(_app(None), "/api/plan_km/stream", BODY))
+    assert response.status_code == 200
+    events = _ndjson(response)
+    assert events[-1][0] == "error" and events[-1][1]["detail"].startswith("Upstream error")
+    assert "summary" not in [e for e, _ in events]
@@ -0,0 +1,58 @@
+import asyncio
+
+import httpx
+import pytest
+
+from app.services.amap_stub import AmapStub, Recordings, create_stub_app
+from app.services.gaode_mcp import AsyncAmapClient, _parse_pois
+from app.utils.itinerary import Item, build_itinerary, km_day
+from app.utils.poi import PLACEHOLDER_POI, Poi, make_poi
+
+
+def _raw(i, **kw):
+    return {"id": f"B{i}", "name": "".join(["西湖", "公园"]), "type": "风景名胜;公园", "location": f"120.1{i},30.2{i}",
+            "address": f"{i}号", "tel": [], **kw}
+
+
+def test_parse_pois_compact_and_interned():
+    pois = _parse_pois({"status": "1", "pois": [_raw(1), _raw(2, rating="4.8"), _raw(3, location="")]}, "公园")
+    # 坐标无效的跳过；高德的空字段（[]）变成 None
+    assert [p.id for p in pois] == ["B1", "B2"]
+    assert pois[0].tel is None and pois[0].rating is None and pois[1].rating == "4.8"
+    assert pois[0].location == (120.11, 30.21)
+    # 重复出现的名称、类别共用同一个字符串对象；Poi 是元组，不带 __dict__
+    assert pois[0].name is pois[1].name and pois[0].category is pois[1].category
+    assert isinstance(pois[0], tuple) and not hasattr(pois[0], "__dict__")
+
+
+def test_make_poi_normalizes_fields_and_to_dict():
+    poi = make_poi("", "灵隐寺", "风景名胜", "120.1", 30.2, address=[], tel="0571", distance="", rating=None)
+    assert poi.id is None and poi.address is None and poi.distance is None
+    assert poi.to_dict() == {
+        "id": None, "name": "灵隐寺", "category": "风景名胜", "location": [120.1, 30.2],
+        "address": None, "tel": "0571", "distance": None, "rating": None,
+    }
+    assert Poi._fields[:5] == ("id", "name", "category", "lng", "lat")
+
+
+def test_item_uses_slots():
+    item = Item("morning", PLACEHOLDER_POI)
+    assert not hasattr(item, "__dict__") and item.move is None
+    with pytest.raises(AttributeError):
+        item.extra = 1
+
+
+def test_placeholder_shared_and_rendered():
+    async def main():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=create_stub_app(AmapStub(Recordings(), seed=1)))) as http:
+            # 没有 Key：搜不到任何景点，每个时段都用同一个占位 Poi
+            client = AsyncAmapClient(http, api_key="test")
+            client.api_key = ""
+            return await build_itinerary(client, "杭州", 2, None, None, "2025-01-01")
+
+    plan = asyncio.run(main())
+    items = [it for day in plan["days"] for it in day["items"]]
+    assert len(items) == 6 and all(it.poi is PLACEHOLDER_POI for it in items)
+    spots = km_day(1, plan["days"][0], "杭州")["spots"]
+    assert [s["name"] for s in spots] == ["待定景点（需要手动添加）"] * 3
+    assert all(s["nav_links"] == [] and s["desc"] == "景点" for s in spots)
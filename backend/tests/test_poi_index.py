@@ -0,0 +1,134 @@
+import asyncio
+import os
+import time
+
+import pytest
+
+from app.services.gaode_mcp import FAILED
+from app.services.poi_index import CityPoiIndex, IndexedAmapClient, PoiIndexSet, crawl_city, write_city_index
+from app.utils.poi import make_poi
+
+# 索引只存 id/名称/分类/坐标/地址/电话
+POIS = [
+    make_poi("B1", "西湖", "风景名胜;风景名胜", 120.14, 30.24, "西湖区龙井路1号", "0571-1"),
+    make_poi("B2", "浙江省博物馆", "科教文化服务;博物馆", 120.15, 30.25, None, None),
+    make_poi(None, "河坊街", "购物服务;特色商业街", 120.17, 30.24, "上城区", None),
+    make_poi("B4", "中国美术学院美术馆", "科教文化服务;美术馆", 120.16, 30.25, [], "0571-4"),
+    make_poi("B5", "西湖博物馆总馆", "科教文化服务;博物馆", 120.16, 30.26),
+]
+POSTINGS = {"西湖": [0, 4], "博物馆": [1, 4], "美术馆": [3]}
+CENTER = (120.15, 30.28)
+
+
+def _write(root, keyword_times=None):
+    now = time.time()
+    times = keyword_times or {k: now for k in POSTINGS}
+    return write_city_index(str(root), "杭州", POIS, POSTINGS, times, CENTER)
+
+
+def _names(pois):
+    return [p.name for p in pois]
+
+
+def test_write_read_round_trip(tmp_path):
+    index = CityPoiIndex(_write(tmp_path))
+    assert len(index) == len(POIS) and index.center == CENTER
+    assert [index.poi(i) for i in range(len(index))] == POIS
+    assert not os.path.exists(os.path.join(tmp_path, "杭州.tmp"))
+
+    # 抓取过的关键词按倒排表顺序；多个关键词交替合并、去重
+    assert _names(index.search("博物馆")) == ["浙江省博物馆", "西湖博物馆总馆"]
+    assert _names(index.search("西湖|美术馆")) == ["西湖", "中国美术学院美术馆", "西湖博物馆总馆"]
+    # types 按分类编码对应的关键词检索
+    assert _names(index.search("", types="140100|140400")) == ["浙江省博物馆", "中国美术学院美术馆", "西湖博物馆总馆"]
+    assert _names(index.search("西湖|博物馆", page=2, offset=2)) == ["西湖博物馆总馆"]
+
+    # 没抓取过的关键词按名称/分类子串匹配，按 POI 顺序
+    assert _names(index.search("商业街")) == ["河坊街"]
+    assert _names(index.search("科教")) == ["浙江省博物馆", "中国美术学院美术馆", "西湖博物馆总馆"]
+    assert index.search("不存在") == []
+
+
+def test_legacy_index_without_search_text(tmp_path):
+    path = _write(tmp_path)
+    os.remove(os.path.join(path, "search.bin"))
+    os.remove(os.path.join(path, "search_offsets.npy"))
+    index = CityPoiIndex(path)
+    assert _names(index.search("街")) == ["河坊街"]
+    # 地址不在检索文本里
+    assert [int(i) for i in index.postings("上城区")] == []
+    assert [int(i) for i in index.postings("馆")] == [1, 3, 4]
+
+
+class _Upstream:
+    """内层客户端：记录发往缓存/高德的查询"""
+
+    def __init__(self):
+        self.calls = []
+
+    async def search_poi(self, city, keywords, page=1, offset=10, extensions="base", types=""):
+        self.calls.append((keywords, types))
+        return [make_poi("U", "实时结果", "", 0.0, 0.0)]
+
+    async def search_poi_many(self, city, queries, extensions="base"):
+        return [await self.search_poi(city, kw, page, offset, types=types) for kw, page, offset, types in queries]
+
+
+def test_stale_keywords_fall_through_to_upstream(tmp_path):
+    old = time.time() - 30 * 24 * 3600
+    _write(tmp_path, {"西湖": time.time(), "博物馆": old, "美术馆": time.time()})
+    upstream = _Upstream()
+    indexes = PoiIndexSet(str(tmp_path))
+    client = IndexedAmapClient(upstream, indexes)
+    client.max_age_seconds = 7 * 24 * 3600
+
+    async def main():
+        assert _names(await client.search_poi("杭州", "西湖")) == ["西湖", "西湖博物馆总馆"]
+        # 检索用到的关键词里有一个过期，整次检索改为实时搜索
+        assert _names(await client.search_poi("杭州", "西湖|博物馆")) == ["实时结果"]
+        assert _names(await client.search_poi("杭州", "", types="140100")) == ["实时结果"]
+        results = await client.search_poi_many("杭州", [("美术馆", 1, 10, ""), ("博物馆", 1, 10, ""), ("西湖", 1, 10, "")])
+        assert [_names(r) for r in results] == [["中国美术学院美术馆"], ["实时结果"], ["西湖", "西湖博物馆总馆"]]
+        # 没有索引的城市照常交给内层客户端
+        assert _names(await client.search_poi("苏州", "园林")) == ["实时结果"]
+
+    asyncio.run(main())
+    assert upstream.calls == [("西湖|博物馆", ""), ("", "140100"), ("博物馆", ""), ("园林", "")]
+    assert (indexes.hits, indexes.fallbacks, indexes.stale) == (3, 4, 3)
+
+
+class _Crawler:
+    """抓取用的客户端：每个关键词按页返回 POI，fail 中的 (关键词, 页码) 请求失败"""
+
+    def __init__(self, fail):
+        self.fail = set(fail)
+
+    async def geocode(self, address, city=None):
+        return CENTER
+
+    async def search_poi(self, city, keywords, page=1, offset=10, extensions="base", types="", strict=False):
+        assert strict
+        if (keywords, page) in self.fail:
+            return FAILED
+        if (keywords, "raise") in self.fail:
+            raise RuntimeError("quota")
+        return [make_poi(f"{keywords}{page}-{i}", f"{keywords}{page}-{i}", "", 120.0, 30.0) for i in range(offset)]
+
+
+def test_crawl_failure_keeps_old_posting_and_timestamp(tmp_path):
+    old = time.time() - 30 * 24 * 3600
+    _write(tmp_path, {"西湖": old, "博物馆": old, "美术馆": old})
+    client = _Crawler({("西湖", 2), ("夜市", 1), ("小吃", "raise")})
+    result = asyncio.run(crawl_city(client, str(tmp_path), "杭州", ["西湖", "博物馆", "夜市", "小吃"],
+                                    pages=2, offset=2, max_age_seconds=7 * 24 * 3600))
+    assert (result["refreshed"], result["skipped"]) == (1, 3)
+
+    index = CityPoiIndex(os.path.join(tmp_path, "杭州"))
+    times = index.meta["keyword_updated_at"]
+    # 第 2 页失败：旧结果和旧抓取时间都保留，不拿第 1 页的半截结果替换
+    assert _names(index.search("西湖")) == ["西湖", "西湖博物馆总馆"]
+    assert times["西湖"] == pytest.approx(old)
+    # 新关键词失败：不写入空倒排表，下次照常抓取
+    assert "夜市" not in times and "小吃" not in times
+    assert _names(index.search("博物馆")) == ["博物馆1-0", "博物馆1-1", "博物馆2-0", "博物馆2-1"]
+    assert times["博物馆"] > old
@@ -0,0 +1,112 @@
+import asyncio
+
+import httpx
+import pytest
+
+from app.core import config
+from app.services.amap_cache import CachedAmapClient
+from app.services.amap_stub import AmapStub, Recordings, create_stub_app
+from app.services.gaode_mcp import AsyncAmapClient
+from app.services.prefetch import Prefetcher, parse_targets
+from app.services.shared_state import SharedState
+from app.utils.itinerary import first_page_queries
+
+
+def _stub_http():
+    stub = AmapStub(Recordings(), seed=1)
+    return stub, httpx.AsyncClient(transport=httpx.ASGITransport(app=create_stub_app(stub)))
+
+
+def test_parse_targets():
+    targets = parse_targets(" 北京, 上海,,", "history,food;food, history;;")
+    # 兴趣组合内排序去重，组合之间去重；空组合表示不选兴趣
+    assert targets == [
+        ("北京", ("food", "history")), ("北京", ()),
+        ("上海", ("food", "history")), ("上海", ()),
+    ]
+
+
+@pytest.mark.parametrize("batch", [True, False])
+def test_warm_up_fills_the_cache_for_planned_queries(monkeypatch, batch):
+    monkeypatch.setattr(config, "AMAP_BATCH_ENABLED", batch)
+
+    async def main():
+        stub, http = _stub_http()
+        async with http:
+            cache = CachedAmapClient(AsyncAmapClient(http, api_key="test"))
+            prefetcher = Prefetcher(cache, cache, parse_targets("杭州", "history"), 3600, 60, 1)
+            await prefetcher.warm_up()
+            warmed = sum(stub.stats()["requests"].values())
+            # 规划时的第 1 页搜索和城市地理编码都已缓存，不再打上游
+            await cache.geocode("杭州")
+            for kw, page, offset, types in first_page_queries("杭州", ["history"]):
+                await cache.search_poi("杭州", kw, page=page, offset=offset, types=types)
+            return prefetcher, warmed, sum(stub.stats()["requests"].values())
+
+    prefetcher, warmed, after = asyncio.run(main())
+    assert warmed > 0 and after == warmed
+    assert prefetcher.stats()["warmed"] == 1 and prefetcher.warmup_seconds is not None
+
+
+class _Broken:
+    async def geocode(self, *args, **kw):
+        raise RuntimeError("upstream down")
+
+
+def test_ready_even_when_warm_up_fails():
+    async def main():
+        prefetcher = Prefetcher(_Broken(), None, parse_targets("杭州,成都", ""), 3600, 60, 1)
+        task = asyncio.create_task(prefetcher.run())
+        await asyncio.wait_for(prefetcher.ready.wait(), 1)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        return prefetcher.stats()
+
+    stats = asyncio.run(main())
+    assert stats["ready"] and (stats["warmed"], stats["warm_errors"]) == (0, 2)
+
+
+def test_refresh_hot_reloads_entries_hit_by_users(monkeypatch):
+    monkeypatch.setattr(config, "AMAP_BATCH_ENABLED", False)
+
+    async def main():
+        stub, http = _stub_http()
+        async with http:
+            cache = CachedAmapClient(AsyncAmapClient(http, api_key="test"))
+            ttl = cache.endpoints["geocode"].ttl
+            prefetcher = Prefetcher(cache, cache, [], 3600, ttl + 1, 2)
+            for city in ("杭州", "杭州", "杭州", "成都", "成都", "南京"):
+                await cache.geocode(city)
+            # 首次加载不算命中；只有被用户再次命中至少 min_hits 次的才提前刷新，热度高的在前
+            candidates = cache.refresh_candidates("geocode", ttl + 1, 1)
+            assert [k[0] for k in candidates] == ["杭州", "成都"]
+            assert cache.refresh_candidates("geocode", 0, 1) == []
+            await prefetcher.refresh_hot()
+            return stub.stats()["requests"]["geocode"], prefetcher.stats()
+
+    geocodes, stats = asyncio.run(main())
+    assert geocodes == 3 + 1 and stats["refreshed"] == 1 and stats["refresh_errors"] == 0
+
+
+def test_only_one_worker_refreshes_per_round(tmp_path):
+    a = SharedState(str(tmp_path / "shared.db"))
+    b = SharedState(str(tmp_path / "shared.db"))
+
+    async def main():
+        # 另一个 worker 已经拿到本轮的刷新租约
+        assert await a.try_lease([Prefetcher.REFRESH_LEASE], ttl=60) == [True]
+        prefetcher = Prefetcher(_Broken(), None, [], 0.01, 60, 1, shared=b)
+        task = asyncio.create_task(prefetcher.run())
+        await asyncio.sleep(0.1)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        return prefetcher.stats()
+
+    try:
+        stats = asyncio.run(main())
+    finally:
+        a.close()
+        b.close()
+    # 取消时可能正等着抢租约，最后一轮还没计入
+    assert stats["refresh_skipped"] >= 1 and stats["rounds"] - stats["refresh_skipped"] <= 1
+    assert stats["warm_errors"] == 0
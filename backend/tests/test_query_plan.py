@@ -0,0 +1,43 @@
+from app.utils import query_plan
+from app.utils.query_plan import KeywordYield, PoiQuery, dedupe_keywords, plan_queries
+
+
+def test_dedupe_keeps_broadest_keyword_at_first_position():
+    assert dedupe_keywords(["历史文化", "历史", "历史", "小吃街", "小吃"]) == ["历史", "小吃"]
+    assert dedupe_keywords([" 公园 ", "", None, "公园", "湿地公园", "夜景"]) == ["公园", "夜景"]
+    # 一个短关键词同时覆盖前面好几个：替换第一个，其余删掉
+    assert dedupe_keywords(["古镇老街", "夜市", "古镇码头", "古镇"]) == ["古镇", "夜市"]
+
+
+def test_plan_queries_merges_type_codes_and_free_keywords(monkeypatch):
+    monkeypatch.setattr(query_plan, "KEYWORD_YIELD", KeywordYield(0))
+    queries = plan_queries("杭州", ["博物馆", "夜市", "美术馆", "佛寺", "寺庙", "小吃", "老街"], per_query=2)
+    assert queries == [
+        PoiQuery("", "140100|140400", ("博物馆", "美术馆")),
+        PoiQuery("夜市|小吃", "", ("夜市", "小吃")),
+        # 佛寺和寺庙是同一个分类编码，只查一次
+        PoiQuery("", "110205", ("佛寺", "寺庙")),
+        PoiQuery("老街", "", ("老街",)),
+    ]
+    assert all(len(q.terms) == 1 for q in plan_queries("杭州", ["夜市", "小吃"], per_query=0))
+
+
+def test_rank_uses_snapshot_and_keeps_ties_in_order():
+    yields = KeywordYield(refresh_seconds=3600)
+    city = "成都"
+    for _ in range(3):
+        yields.record(city, PoiQuery("火锅", "", ("火锅",)), returned=20, new=0)
+        yields.record(city, PoiQuery("茶馆", "", ("茶馆",)), returned=20, new=12)
+    # 快照还没刷新：排序和没有历史时一样，保持原顺序
+    assert yields.rank(city, ["火锅", "茶馆", "夜市"]) == ["火锅", "茶馆", "夜市"]
+    assert yields.expected_new(city, "茶馆", live=True) == 12
+
+    yields.refresh()
+    # 茶馆贡献最高；夜市没有数据按乐观估计；火锅三次都没有新 POI，视为已覆盖排到最后
+    assert yields.rank(city, ["火锅", "夜市", "茶馆"]) == ["茶馆", "夜市", "火锅"]
+    assert yields.covered(city, "火锅")
+    # 之后的记录不影响排序，直到下次刷新
+    for _ in range(5):
+        yields.record(city, PoiQuery("夜市", "", ("夜市",)), returned=20, new=20)
+    assert yields.rank(city, ["火锅", "夜市", "茶馆"]) == ["茶馆", "夜市", "火锅"]
+    assert yields.rank(city, ["甲", "乙", "丙"]) == ["甲", "乙", "丙"]
@@ -0,0 +1,125 @@
+import asyncio
+
+import pytest
+
+from app.services.rate_limit import (
+    PRIORITY_BACKGROUND, PRIORITY_INTERACTIVE, QuotaExhausted, RateLimiter, TokenBucket,
+)
+
+
+def test_interactive_served_before_background():
+    async def main():
+        bucket = TokenBucket("place", rate=100, burst=1)
+        await bucket.acquire()
+        order = []
+
+        async def take(name, prio):
+            await bucket.acquire(prio)
+            order.append(name)
+
+        tasks = [asyncio.create_task(take(f"bg{i}", PRIORITY_BACKGROUND)) for i in range(3)]
+        await asyncio.sleep(0)
+        tasks += [asyncio.create_task(take(f"fg{i}", PRIORITY_INTERACTIVE)) for i in range(3)]
+        await asyncio.gather(*tasks)
+        return order
+
+    assert asyncio.run(main()) == ["fg0", "fg1", "fg2", "bg0", "bg1", "bg2"]
+
+
+def test_cancel_after_grant_returns_token():
+    async def main():
+        bucket = TokenBucket("place", rate=0.001, burst=1)
+        await bucket.acquire()
+        waiter = asyncio.create_task(bucket.acquire())
+        await asyncio.sleep(0)
+        assert bucket.stats()["queue_depth"] == 1
+        # 令牌补充，发给排队的请求；它还没来得及继续执行就被取消了
+        bucket._tokens = 1.0
+        bucket._dispatch()
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert bucket.acquired == 1
+        # 还回来的令牌下一个请求立即可用
+        assert await asyncio.wait_for(bucket.acquire(), 0.1) == 0.0
+
+    asyncio.run(main())
+
+
+def test_cancel_while_queued_does_not_consume():
+    async def main():
+        bucket = TokenBucket("place", rate=20, burst=1)
+        await bucket.acquire()
+        first = asyncio.create_task(bucket.acquire())
+        second = asyncio.create_task(bucket.acquire())
+        await asyncio.sleep(0)
+        first.cancel()
+        await asyncio.wait_for(second, 1.0)
+        assert bucket.acquired == 2
+
+    asyncio.run(main())
+
+
+def test_daily_limit_and_feedback():
+    async def main():
+        bucket = TokenBucket("geocode", rate=100, burst=10, daily_limit=2)
+        await bucket.acquire()
+        await bucket.acquire()
+        with pytest.raises(QuotaExhausted):
+            await bucket.acquire()
+        throttled = TokenBucket("place", rate=100, burst=5)
+        throttled.feedback({"infocode": "10004", "info": "ACCESS_TOO_FREQUENT"})
+        assert throttled.stats()["tokens"] < 1
+        throttled.feedback({"infocode": "10044", "info": "USER_DAILY_QUERY_OVER_LIMIT"})
+        with pytest.raises(QuotaExhausted):
+            await throttled.acquire()
+
+    asyncio.run(main())
+
+
+
+def test_shared_bucket_across_workers(tmp_path):
+    from app.services.rate_limit import SharedTokenBucket
+    from app.services.shared_state import SharedState
+
+    async def main(states):
+        # 两个 worker 各自的桶共用同一个状态文件：令牌和日配额都是全局的
+        a, b = (SharedTokenBucket("place", rate=0.001, burst=2, state=s) for s in states)
+        assert await a.try_acquire() and await b.try_acquire()
+        assert not await a.try_acquire()
+        # 一个 worker 还回的令牌另一个能拿到
+        a.release()
+        states[0]._pool.submit(lambda: None).result()  # 还令牌不等结果，先等它写完
+        assert await b.try_acquire()
+
+        a, b = (SharedTokenBucket("direction", rate=0.001, burst=5, state=s, daily_limit=3) for s in states)
+        assert await a.try_acquire() and await b.try_acquire() and await a.try_acquire()
+        assert not await b.try_acquire()
+        with pytest.raises(QuotaExhausted):
+            await b.acquire()
+        assert b.stats()["used_today"] == 3
+
+    states = [SharedState(str(tmp_path / "shared.db")) for _ in range(2)]
+    try:
+        asyncio.run(main(states))
+    finally:
+        for s in states:
+            s.close()
+
+
+def test_single_pending_wake_up_timer():
+    async def main():
+        bucket = TokenBucket("place", rate=20, burst=1)
+        await bucket.acquire()
+        timers = []
+        waiters = []
+        for _ in range(5):
+            waiters.append(asyncio.create_task(bucket.acquire()))
+            await asyncio.sleep(0)
+            timers.append(bucket._timer)
+        # 每次入队都重新排一次唤醒，之前的必须已取消
+        assert all(t.cancelled() for t in timers[:-1]) and not timers[-1].cancelled()
+        await asyncio.gather(*waiters)
+        assert bucket._timer is None
+
+    asyncio.run(main())
@@ -0,0 +1,113 @@
+import asyncio
+import time
+
+import pytest
+
+from app.services.resilience import CircuitBreaker, CircuitOpenError, Resilience
+
+
+def test_breaker_opens_after_consecutive_failures(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(time, "monotonic", lambda: now[0])
+    breaker = CircuitBreaker(failures=3, cooldown=10)
+    for _ in range(2):
+        assert breaker.allow()
+        breaker.record_failure()
+    breaker.record_success()  # 成功清零连续失败计数
+    for _ in range(3):
+        assert breaker.allow()
+        breaker.record_failure()
+    assert breaker.state == "open" and breaker.opens == 1
+    assert not breaker.allow() and breaker.short_circuited == 1
+
+    # 冷却结束后半开：只放一个探测请求
+    now[0] += 10
+    assert breaker.allow() and breaker.state == "half_open"
+    assert not breaker.allow()
+    # 探测被取消时让出名额
+    breaker.release()
+    assert breaker.allow()
+    # 探测失败重新打开，不重复计 opens
+    breaker.record_failure()
+    assert breaker.state == "open" and breaker.opens == 1
+
+    now[0] += 10
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == "closed" and breaker.allow()
+
+
+def _resilience(**kw):
+    opts = dict(attempt_timeout=1.0, max_retries=0, backoff=0.0, hedge=True, hedge_quantile=0.9,
+                hedge_min=0.02, breaker_failures=2, breaker_cooldown=60, min_samples=5)
+    opts.update(kw)
+    return Resilience(**opts)
+
+
+def _warm(res, family="place", seconds=0.01):
+    for _ in range(10):
+        res._family(family).latency.add(seconds)
+
+
+def test_open_breaker_short_circuits():
+    async def main():
+        res = _resilience()
+
+        async def fail():
+            raise ValueError("boom")
+
+        for _ in range(2):
+            with pytest.raises(ValueError):
+                await res.call("place", fail)
+        with pytest.raises(CircuitOpenError):
+            await res.call("place", fail)
+        assert res.stats()["place"]["breaker"] == "open"
+
+    asyncio.run(main())
+
+
+def test_hedge_only_with_free_token():
+    async def main():
+        sends = []
+
+        async def slow():
+            sends.append(time.monotonic())
+            await asyncio.sleep(0.2 if len(sends) == 1 else 0.01)
+            return len(sends)
+
+        res = _resilience()
+        _warm(res)
+        assert await res.call("place", slow, try_acquire=lambda: _result(True)) == 2
+        assert res.stats()["place"]["hedges"] == 1 and res.stats()["place"]["hedge_wins"] == 1
+
+        sends.clear()
+        res = _resilience()
+        _warm(res)
+        assert await res.call("place", slow, try_acquire=lambda: _result(False)) == 1
+        assert len(sends) == 1
+        assert res.stats()["place"]["hedges"] == 0 and res.stats()["place"]["hedges_skipped"] == 1
+
+    asyncio.run(main())
+
+
+def test_queueing_does_not_trigger_hedge():
+    async def main():
+        async def queued():
+            # 排队等令牌的时间远超对冲阈值
+            await asyncio.sleep(0.1)
+
+        async def fast():
+            await asyncio.sleep(0.005)
+            return "ok"
+
+        res = _resilience()
+        _warm(res)
+        assert await res.call("place", fast, acquire=queued, try_acquire=lambda: _result(True)) == "ok"
+        stats = res.stats()["place"]
+        assert stats["hedges"] == 0 and stats["attempts"] == 1
+
+    asyncio.run(main())
+
+
+async def _result(value):
+    return value
@@ -0,0 +1,100 @@
+import asyncio
+import copy
+
+import pytest
+
+from app.core import config
+from app.utils import geo, itinerary
+from app.utils.itinerary import _route_legs
+
+A, B, C, D = (120.10, 30.20), (120.15, 30.25), (120.30, 30.30), (120.101, 30.201)
+
+
+class FakeRoutes:
+    """路径规划：每段 delay 秒后返回；slow 中的终点超时，broken 中的终点抛异常"""
+
+    def __init__(self, delay=0.02, slow=(), broken=()):
+        self.delay = delay
+        self.slow = set(slow)
+        self.broken = set(broken)
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.calls = []
+
+    async def route_time(self, origin, dest, mode="walk", city=None):
+        self.calls.append(dest)
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(10 if dest in self.slow else self.delay)
+            if dest in self.broken:
+                raise RuntimeError("boom")
+            return {"mode": mode, "distance_km": 9.99, "est_duration_min": 42}
+        finally:
+            self.in_flight -= 1
+
+    async def route_time_many(self, legs, mode="walk", city=None):
+        self.calls.append(tuple(d for _, d in legs))
+        await asyncio.sleep(self.delay)
+        if any(d in self.broken for _, d in legs):
+            raise RuntimeError("boom")
+        return [{"mode": mode, "distance_km": 9.99, "est_duration_min": 42} for _ in legs]
+
+
+@pytest.fixture(autouse=True)
+def routing(monkeypatch):
+    monkeypatch.setattr(itinerary, "SPEED_MODELS", copy.deepcopy(geo.SPEED_MODELS))
+    monkeypatch.setattr(config, "ROUTING_MODE", "amap")
+    monkeypatch.setattr(config, "ROUTE_ESTIMATE_BELOW_KM", 1.0)
+    monkeypatch.setattr(config, "ROUTE_LEG_TIMEOUT_SECONDS", 0.2)
+    monkeypatch.setattr(config, "ROUTE_CONCURRENCY", 2)
+
+
+def _legs(*pairs):
+    return [(o, d, geo.haversine_km(o, d)) for o, d in pairs]
+
+
+def test_single_requests_concurrent_with_fallbacks(monkeypatch):
+    monkeypatch.setattr(config, "AMAP_BATCH_ENABLED", False)
+    client = FakeRoutes(slow={C}, broken={A})
+    legs = _legs((A, B), (B, C), (A, D), (C, B), (B, A))
+    moves = asyncio.run(_route_legs(client, "杭州", legs))
+    # 很近的路段直接估算，不请求高德；超时、失败的路段退化为估算，不影响其他路段
+    assert [m["source"] for m in moves] == ["amap", "estimate", "estimate", "amap", "estimate"]
+    assert D not in client.calls and len(client.calls) == 4
+    assert moves[0]["distance_km"] == 9.99
+    assert client.max_in_flight == 2
+
+
+def test_shared_semaphore_bounds_all_days(monkeypatch):
+    monkeypatch.setattr(config, "AMAP_BATCH_ENABLED", False)
+    client = FakeRoutes()
+
+    async def main():
+        sem = asyncio.Semaphore(3)
+        days = [_legs((A, B), (B, C)), _legs((C, A), (A, C)), _legs((B, A))]
+        return await asyncio.gather(*(_route_legs(client, "杭州", legs, sem=sem) for legs in days))
+
+    moves = asyncio.run(main())
+    assert [len(m) for m in moves] == [2, 2, 1]
+    assert client.max_in_flight == 3
+
+
+def test_batch_mode_one_request_and_failure(monkeypatch):
+    monkeypatch.setattr(config, "AMAP_BATCH_ENABLED", True)
+    client = FakeRoutes()
+    moves = asyncio.run(_route_legs(client, "杭州", _legs((A, B), (A, D), (B, C))))
+    assert client.calls == [(B, C)]
+    assert [m["source"] for m in moves] == ["amap", "estimate", "amap"]
+
+    # 整批失败时这些路段都改用估算
+    client = FakeRoutes(broken={C})
+    moves = asyncio.run(_route_legs(client, "杭州", _legs((A, B), (B, C))))
+    assert [m["source"] for m in moves] == ["estimate", "estimate"]
+
+
+def test_fast_mode_never_calls_upstream(monkeypatch):
+    monkeypatch.setattr(config, "ROUTING_MODE", "fast")
+    client = FakeRoutes()
+    moves = asyncio.run(_route_legs(client, "杭州", _legs((A, B), (B, C))))
+    assert client.calls == [] and all(m["source"] == "estimate" for m in moves)
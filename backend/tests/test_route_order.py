@@ -0,0 +1,40 @@
+import time
+
+import numpy as np
+import pytest
+
+from app.utils.geo import haversine_matrix
+from app.utils.itinerary import _or_opt, _path_length, _two_opt
+
+
+def _instances(count: int, size: int):
+    rng = np.random.default_rng(7)
+    for _ in range(count):
+        coords = rng.uniform([116.2, 39.8], [116.6, 40.05], (size, 2))
+        order = list(rng.permutation(size))
+        yield haversine_matrix(coords), order
+
+
+@pytest.mark.parametrize("improve", [_two_opt, _or_opt])
+@pytest.mark.parametrize("with_start", [False, True])
+def test_never_increases_length(improve, with_start):
+    for dist, order in _instances(50, 9):
+        start = int(order[0]) if with_start else None
+        path = [int(i) for i in (order[1:] if with_start else order)]
+        out = improve(dist, start, list(path), time.perf_counter() + 1.0)
+        assert sorted(out) == sorted(path)
+        assert _path_length(dist, start, out) <= _path_length(dist, start, path) + 1e-9
+
+
+def test_two_opt_reverses_prefix_without_start():
+    # 一条直线上的四个点：最优解需要翻转包含第一个节点的前缀
+    coords = np.array([[116.02, 40.0], [116.01, 40.0], [116.00, 40.0], [116.03, 40.0]])
+    dist = haversine_matrix(coords)
+    out = _two_opt(dist, None, [1, 0, 2, 3], time.perf_counter() + 1.0)
+    assert _path_length(dist, None, out) == pytest.approx(_path_length(dist, None, [2, 1, 0, 3]))
+
+
+def test_two_opt_keeps_start_fixed():
+    dist, _ = next(_instances(1, 8))
+    out = _two_opt(dist, 0, [i for i in range(1, 8)][::-1], time.perf_counter() + 1.0)
+    assert 0 not in out and sorted(out) == list(range(1, 8))
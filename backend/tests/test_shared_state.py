@@ -0,0 +1,62 @@
+import asyncio
+import threading
+
+from app.services.shared_state import SharedState
+
+
+def test_leases_across_workers(tmp_path):
+    a = SharedState(str(tmp_path / "shared.db"))
+    b = SharedState(str(tmp_path / "shared.db"))
+
+    async def main():
+        assert await a.try_lease(["k1", "k2"], ttl=60) == [True, True]
+        assert await b.try_lease(["k2", "k3"], ttl=60) == [False, True]
+        assert await b.held("k1") and not await a.held("k4")
+        assert b.stats()["active_leases"] == 3
+        await a.release(["k1"])
+        assert not await b.held("k1")
+        # 过期的租约可以被别人拿走
+        assert await a.try_lease(["k5"], ttl=0) == [True]
+        assert await b.try_lease(["k5"], ttl=60) == [True]
+
+    try:
+        asyncio.run(main())
+        assert (b.leases_acquired, b.leases_contended) == (2, 1)
+        # 关闭时释放本进程持有的租约
+        a.close()
+        assert asyncio.run(b.try_lease(["k2"], ttl=60)) == [True]
+    finally:
+        b.close()
+
+
+class _TracingConn:
+    """记录每次 SQLite 调用所在线程的连接包装"""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.threads = set()
+
+    def execute(self, *args):
+        self.threads.add(threading.current_thread().name)
+        return self.conn.execute(*args)
+
+    def __getattr__(self, name):
+        return getattr(self.conn, name)
+
+
+def test_sqlite_runs_off_the_event_loop(tmp_path):
+    state = SharedState(str(tmp_path / "shared.db"))
+    conn = state._conn = _TracingConn(state._conn)
+
+    async def main():
+        await state.take("place", 1, 2)
+        await state.try_lease(["k"], ttl=60)
+        await state.held("k")
+        await state.release(["k"])
+        state.stats()
+
+    try:
+        asyncio.run(main())
+        assert conn.threads and all(name.startswith("shared-state") for name in conn.threads)
+    finally:
+        state.close()
@@ -0,0 +1,113 @@
+import asyncio
+
+import pytest
+
+from app.services.singleflight import SingleFlight
+
+
+def test_concurrent_callers_share_one_call():
+    async def main():
+        flight = SingleFlight()
+        calls = []
+
+        async def load():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return {"value": len(calls)}
+
+        results = await asyncio.gather(*(flight.do("k", load) for _ in range(5)))
+        assert len(calls) == 1
+        assert all(r is results[0] for r in results)
+        assert flight.stats()["upstream_calls"] == 1 and flight.stats()["collapsed_calls"] == 4
+        # 调用结束后不再合并，下一次重新加载
+        await flight.do("k", load)
+        assert len(calls) == 2 and flight.stats()["in_flight"] == 0
+
+    asyncio.run(main())
+
+
+def test_errors_are_shared():
+    async def main():
+        flight = SingleFlight()
+
+        async def fail():
+            await asyncio.sleep(0.01)
+            raise ValueError("boom")
+
+        results = await asyncio.gather(*(flight.do("k", fail) for _ in range(3)), return_exceptions=True)
+        assert all(isinstance(r, ValueError) for r in results)
+        assert flight.stats()["shared_errors"] == 2
+
+    asyncio.run(main())
+
+
+def test_cancelling_one_waiter_keeps_the_call():
+    async def main():
+        flight = SingleFlight()
+        finished = []
+
+        async def load():
+            await asyncio.sleep(0.02)
+            finished.append(1)
+            return "ok"
+
+        a = asyncio.create_task(flight.do("k", load))
+        b = asyncio.create_task(flight.do("k", load))
+        await asyncio.sleep(0)
+        a.cancel()
+        assert await b == "ok" and finished == [1]
+        with pytest.raises(asyncio.CancelledError):
+            await a
+
+    asyncio.run(main())
+
+
+def test_cancelling_every_waiter_cancels_the_call():
+    async def main():
+        flight = SingleFlight()
+        state = {}
+
+        async def load():
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                state["cancelled"] = True
+                raise
+
+        waiters = [asyncio.create_task(flight.do("k", load)) for _ in range(3)]
+        await asyncio.sleep(0)
+        for w in waiters:
+            w.cancel()
+        await asyncio.gather(*waiters, return_exceptions=True)
+        await asyncio.sleep(0)
+        assert state == {"cancelled": True}
+        assert flight.stats()["in_flight"] == 0
+
+    asyncio.run(main())
+
+
+def test_cancelling_batch_waiters_cancels_the_batch():
+    async def main():
+        flight = SingleFlight()
+        state = {}
+
+        async def load_many(keys):
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                state["cancelled"] = keys
+                raise
+
+        batch = asyncio.create_task(flight.do_many(["a", "b"], load_many))
+        single = asyncio.create_task(flight.do("a", lambda: load_many(["x"])))
+        await asyncio.sleep(0)
+        batch.cancel()
+        await asyncio.sleep(0.01)
+        # “a” 还有单条请求在等，批量调用不能取消
+        assert state == {}
+        single.cancel()
+        await asyncio.gather(batch, single, return_exceptions=True)
+        await asyncio.sleep(0.01)
+        assert state == {"cancelled": ["a", "b"]}
+
+    asyncio.run(main())
@@ -0,0 +1,90 @@
+import asyncio
+import random
+
+import pytest
+
+from app.core import config
+from app.utils import itinerary, query_plan
+from app.utils.geo import haversine_km
+from app.utils.itinerary import _collect_pois, _filter_near_start
+from app.utils.poi import make_poi
+from app.utils.query_plan import KeywordYield
+from app.utils.spatial import GridIndex, base_name, same_place
+
+
+def _points(n, seed=7):
+    rnd = random.Random(seed)
+    return [(120.1 + rnd.uniform(-0.1, 0.1), 30.25 + rnd.uniform(-0.1, 0.1)) for _ in range(n)]
+
+
+def _index(points, cell_km=0.5):
+    index = GridIndex(cell_km=cell_km)
+    for i, (lng, lat) in enumerate(points):
+        index.add(i, lng, lat)
+    return index
+
+
+@pytest.mark.parametrize("radius_km", [0.3, 1.0, 4.0])
+def test_query_radius_matches_linear_scan(radius_km):
+    points = _points(400)
+    index = _index(points)
+    center = (120.12, 30.24)
+    expected = sorted(i for i, p in enumerate(points) if haversine_km(center, p) <= radius_km)
+    found = index.query_radius(center[0], center[1], radius_km)
+    assert sorted(i for i, _ in found) == expected
+    assert [d for _, d in found] == sorted(d for _, d in found)
+
+
+@pytest.mark.parametrize("k", [1, 5, 30])
+def test_nearest_matches_linear_scan(k):
+    points = _points(400)
+    index = _index(points)
+    # 查询点在所有格子之外也要能一圈圈扩到有点的地方
+    for center in [(120.05, 30.3), (121.0, 31.0)]:
+        expected = sorted(range(len(points)), key=lambda i: haversine_km(center, points[i]))[:k]
+        assert [i for i, _ in index.nearest(center[0], center[1], k=k)] == expected
+    assert index.nearest(120.1, 30.25, k=5, max_radius_km=0.0001) == []
+    assert GridIndex().nearest(120.1, 30.25) == [] and len(index) == 400
+
+
+def test_same_place_by_id_or_base_name():
+    a = make_poi("B1", "故宫博物院", "景点", 116.397, 39.918)
+    assert base_name("故宫博物院-午门") == base_name("故宫博物院（东华门）") == "故宫博物院"
+    assert same_place(a, make_poi("B2", "故宫博物院-午门", "景点", 116.397, 39.917))
+    assert same_place(a, make_poi("B1", "别名", "景点", 116.397, 39.918))
+    assert not same_place(a, make_poi("B3", "景山公园", "景点", 116.397, 39.925))
+    assert not same_place(make_poi(None, "", "", 0, 0), make_poi(None, "", "", 0, 0))
+
+
+def test_filter_near_start_keeps_order_and_falls_back_to_nearest():
+    start = (120.0, 30.0)
+    # 每个点往东偏 i km 左右，打乱顺序后检查结果保持原始顺序
+    offsets = [5, 0, 12, 2, 8, 1]
+    pois = [make_poi(str(o), f"p{o}", "", start[0] + o / 96.4, start[1]) for o in offsets]
+    near = _filter_near_start(pois, start, radius_km=3.0, min_needed=2)
+    assert [p.name for p in near] == ["p0", "p2", "p1"]
+    # 范围内不够时保留离起点最近的 min_needed 个，仍按原始顺序
+    nearest = _filter_near_start(pois, start, radius_km=3.0, min_needed=5)
+    assert [p.name for p in nearest] == ["p5", "p0", "p2", "p8", "p1"]
+
+
+class VariantSearch:
+    """每个关键词返回同一批地点，名称带入口/分店后缀、坐标略有偏移"""
+
+    async def search_poi(self, city, keywords, page=1, offset=10, types=""):
+        if page > 1:
+            return []
+        suffix = "" if keywords == "甲" else f"-{keywords}门"
+        shift = 0.0 if keywords == "甲" else 0.0005
+        return [make_poi(f"{keywords}{i}", f"地点{i}{suffix}", "", 120.0 + i * 0.02 + shift, 30.0) for i in range(5)]
+
+
+def test_collect_pois_merges_nearby_variants(monkeypatch):
+    yields = KeywordYield(0)
+    monkeypatch.setattr(itinerary, "KEYWORD_YIELD", yields)
+    monkeypatch.setattr(query_plan, "KEYWORD_YIELD", yields)
+    monkeypatch.setattr(config, "POI_QUERY_COMPACTION", False)
+    monkeypatch.setattr(config, "AMAP_BATCH_ENABLED", False)
+    pois = asyncio.run(_collect_pois(VariantSearch(), "杭州", ["甲", "乙"], max_needed=20, min_needed=1))
+    # 约 50 米内的同名变体并入先出现的那个；相隔约 2 公里的不同地点保留
+    assert [p.name for p in pois] == [f"地点{i}" for i in range(5)]